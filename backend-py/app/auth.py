@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from passlib.context import CryptContext
 from jose import JWTError, jwt
@@ -8,6 +8,7 @@ import logging
 
 from .db import get_db
 from .models import User, UserCreate, UserLogin, Token
+from .timestamps import now_ms, from_ms
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -17,6 +18,11 @@ SECRET_KEY = os.getenv("JWT_SECRET", "dev-secret-change-me-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 days
 
+# Comma-separated list of emails allowed to use /api/admin endpoints
+ADMIN_EMAILS = {
+    e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()
+}
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
@@ -47,8 +53,8 @@ async def get_user_by_email(db, email: str):
             "id": row["id"],
             "email": row["email"],
             "password_hash": row["password_hash"],
-            "created_at": datetime.fromisoformat(row["created_at"].replace('Z', '+00:00')),
-            "updated_at": datetime.fromisoformat(row["updated_at"].replace('Z', '+00:00'))
+            "created_at": from_ms(row["created_at"]),
+            "updated_at": from_ms(row["updated_at"])
         }
     return None
 
@@ -62,8 +68,8 @@ async def get_user_by_id(db, user_id: int):
         return User(
             id=row["id"],
             email=row["email"],
-            created_at=datetime.fromisoformat(row["created_at"].replace('Z', '+00:00')),
-            updated_at=datetime.fromisoformat(row["updated_at"].replace('Z', '+00:00'))
+            created_at=from_ms(row["created_at"]),
+            updated_at=from_ms(row["updated_at"])
         )
     return None
 
@@ -75,7 +81,18 @@ async def authenticate_user(db, email: str, password: str):
         return False
     return user
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+# /api/batch authenticates once and hands the user to its sub-requests here
+BATCH_USER_STATE = "batch_user"
+
+async def get_current_user(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db = Depends(get_db)
+):
+    batch_user = getattr(request.state, BATCH_USER_STATE, None)
+    if batch_user is not None:
+        return batch_user
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -84,22 +101,30 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("sub")
-        if user_id is None:
+        sub = payload.get("sub")
+        if sub is None:
             raise credentials_exception
-    except JWTError:
+        # sub — строка; PostgreSQL, в отличие от SQLite, не приводит её к числу сам
+        user_id = int(sub)
+    except (JWTError, ValueError):
         raise credentials_exception
     
-    db = await get_db()
     user = await get_user_by_id(db, user_id)
     if user is None:
         raise credentials_exception
     
     return user
 
+async def get_admin_user(current_user: User = Depends(get_current_user)):
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin privileges required"
+        )
+    return current_user
+
 @router.post("/register", response_model=Token)
-async def register(user: UserCreate):
-    db = await get_db()
+async def register(user: UserCreate, db = Depends(get_db)):
     
     # Check if user already exists
     existing_user = await get_user_by_email(db, user.email)
@@ -112,10 +137,11 @@ async def register(user: UserCreate):
     # Hash password and create user
     hashed_password = get_password_hash(user.password)
     
+    now = now_ms()
     cursor = await db.execute(
-        """INSERT INTO users (email, password_hash) 
-           VALUES (?, ?) RETURNING id""",
-        (user.email, hashed_password)
+        """INSERT INTO users (email, password_hash, created_at, updated_at) 
+           VALUES (?, ?, ?, ?) RETURNING id""",
+        (user.email, hashed_password, now, now)
     )
     row = await cursor.fetchone()
     await db.commit()
@@ -133,8 +159,7 @@ async def register(user: UserCreate):
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/login", response_model=Token)
-async def login(user: UserLogin):
-    db = await get_db()
+async def login(user: UserLogin, db = Depends(get_db)):
     
     user_data = await authenticate_user(db, user.email, user.password)
     if not user_data:
@@ -0,0 +1,362 @@
+"""
+Online backups of the SQLite database.
+
+Snapshots are taken with SQLite's incremental backup API: a few hundred pages
+are copied per step and the copier sleeps between steps, so the service keeps
+writing while a backup runs. Every snapshot is gzip-compressed and stored next
+to a sha256 sidecar file (sha256sum format), the oldest ones are rotated away.
+
+CLI:
+    python -m app.backup create
+    python -m app.backup list
+    python -m app.backup verify <file>
+    python -m app.backup restore <file>
+"""
+from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+import asyncio
+import fcntl
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from .db import DB_PATH
+from .storage import POSTGRES
+from .auth import get_admin_user
+from .models import User
+from . import metrics
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", str(Path(DB_PATH).parent / "backups"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "0"))  # 0 = no schedule
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.02"))  # seconds
+# A write from another connection restarts the copy; after this many restarts
+# the remaining pages are copied in one step so busy databases still finish.
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "5"))
+
+SUFFIX = ".db.gz"
+CHUNK_SIZE = 1024 * 1024
+
+_backup_lock = asyncio.Lock()
+
+class BackupInProgress(Exception):
+    pass
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _sidecar(path: Path) -> Path:
+    return path.with_name(path.name + ".sha256")
+
+class _TooManyRestarts(Exception):
+    pass
+
+def _copy_online(src_path: str, dst_path: str, check: bool = True,
+                 pages_per_step: int = BACKUP_PAGES_PER_STEP, step_sleep: float = BACKUP_STEP_SLEEP,
+                 max_restarts: int = BACKUP_MAX_RESTARTS) -> dict:
+    """Copy src into dst page batch by page batch. Returns page statistics.
+
+    The defaults throttle a backup; pages_per_step=-1 copies in one step."""
+    stats = {"pages": 0, "steps": 0, "restarts": 0}
+    last_remaining = [None]
+
+    def progress(status_code, remaining, total):
+        stats["pages"] = total
+        stats["steps"] += 1
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            stats["restarts"] += 1
+            if stats["restarts"] >= max_restarts:
+                raise _TooManyRestarts()
+        last_remaining[0] = remaining
+        if remaining and step_sleep > 0:
+            time.sleep(step_sleep)
+
+    src = sqlite3.connect(src_path, timeout=5)
+    dst = sqlite3.connect(dst_path)
+    try:
+        try:
+            src.backup(dst, pages=pages_per_step, progress=progress)
+        except _TooManyRestarts:
+            logger.warning(f"⚠️  Backup restarted {stats['restarts']} times by concurrent "
+                           f"writes, copying the rest in one step")
+            src.backup(dst, pages=-1)
+            stats["steps"] += 1
+
+        row = dst.execute("PRAGMA quick_check").fetchone() if check else ("ok",)
+        if row[0] != "ok":
+            raise sqlite3.DatabaseError(f"Backup copy failed quick_check: {row[0]}")
+    finally:
+        dst.close()
+        src.close()
+    return stats
+
+def _compress(src: Path, dst: Path) -> str:
+    """gzip src into dst and return the sha256 of the compressed file."""
+    digest = hashlib.sha256()
+
+    class _HashingWriter:
+        def __init__(self, f):
+            self.f = f
+
+        def write(self, data):
+            digest.update(data)
+            return self.f.write(data)
+
+        def flush(self):
+            self.f.flush()
+
+    with open(src, "rb") as fin, open(dst, "wb") as raw:
+        with gzip.GzipFile(filename=src.name, mode="wb", fileobj=_HashingWriter(raw), mtime=0) as gz:
+            shutil.copyfileobj(fin, gz, CHUNK_SIZE)
+        raw.flush()
+        os.fsync(raw.fileno())
+    return digest.hexdigest()
+
+def rotate_backups(keep: int = BACKUP_KEEP) -> List[str]:
+    """Delete all but the newest `keep` snapshots. Returns removed file names."""
+    removed = []
+    for path in list_backup_files()[keep:]:
+        path.unlink(missing_ok=True)
+        _sidecar(path).unlink(missing_ok=True)
+        removed.append(path.name)
+    return removed
+
+def list_backup_files() -> List[Path]:
+    """Snapshots, newest first."""
+    backup_dir = Path(BACKUP_DIR)
+    if not backup_dir.exists():
+        return []
+    return sorted(backup_dir.glob("budget-*" + SUFFIX), reverse=True)
+
+def create_backup() -> dict:
+    """Take a consistent compressed snapshot of DB_PATH. Blocking."""
+    backup_dir = Path(BACKUP_DIR)
+    backup_dir.mkdir(parents=True, exist_ok=True)
+
+    # Several uvicorn workers may run the scheduler; only one copies at a time.
+    lock_file = open(backup_dir / ".lock", "w")
+    try:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BackupInProgress("Another backup is already running")
+
+        name = "budget-" + datetime.utcnow().strftime("%Y%m%d-%H%M%S") + SUFFIX
+        target = backup_dir / name
+        started = time.perf_counter()
+
+        with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+            raw_copy = Path(tmp) / "snapshot.db"
+            stats = _copy_online(DB_PATH, str(raw_copy))
+            copy_seconds = time.perf_counter() - started
+            db_bytes = raw_copy.stat().st_size
+
+            partial = Path(tmp) / name
+            checksum = _compress(raw_copy, partial)
+            os.replace(partial, target)
+
+        _sidecar(target).write_text(f"{checksum}  {name}\n", encoding="utf-8")
+        duration = time.perf_counter() - started
+        removed = rotate_backups()
+    finally:
+        lock_file.close()
+
+    result = {
+        "file": name,
+        "sha256": checksum,
+        "db_bytes": db_bytes,
+        "compressed_bytes": target.stat().st_size,
+        "pages": stats["pages"],
+        "steps": stats["steps"],
+        "restarts": stats["restarts"],
+        "duration_seconds": round(duration, 3),
+        "pages_per_second": round(stats["pages"] / copy_seconds, 1) if copy_seconds else None,
+        "bytes_per_second": round(db_bytes / copy_seconds, 1) if copy_seconds else None,
+        "rotated": removed,
+    }
+
+    metrics.inc("backup.count")
+    metrics.observe("backup.duration", duration)
+    metrics.set_gauge("backup.last_bytes", db_bytes)
+    metrics.set_gauge("backup.last_compressed_bytes", result["compressed_bytes"])
+    metrics.set_gauge("backup.last_bytes_per_second", result["bytes_per_second"] or 0)
+    metrics.set_gauge("backup.last_finished_at", time.time())
+
+    logger.info(f"💾 Backup {name}: {db_bytes} bytes in {duration:.2f}s "
+                f"({stats['steps']} steps, {stats['restarts']} restarts)")
+    return result
+
+def _resolve(name_or_path: str) -> Path:
+    path = Path(name_or_path)
+    if not path.exists():
+        path = Path(BACKUP_DIR) / path.name
+    if not path.exists():
+        raise FileNotFoundError(f"Backup not found: {name_or_path}")
+    return path
+
+def verify_backup(name_or_path: str) -> dict:
+    """Check the sidecar checksum and run integrity_check on the decompressed copy."""
+    path = _resolve(name_or_path)
+    sidecar = _sidecar(path)
+    if not sidecar.exists():
+        return {"file": path.name, "ok": False, "error": "checksum file missing"}
+
+    expected = sidecar.read_text(encoding="utf-8").split()[0]
+    actual = _sha256_file(path)
+    if actual != expected:
+        return {"file": path.name, "ok": False, "error": "checksum mismatch"}
+
+    with tempfile.TemporaryDirectory(dir=path.parent) as tmp:
+        raw_copy = Path(tmp) / "verify.db"
+        with gzip.open(path, "rb") as fin, open(raw_copy, "wb") as fout:
+            shutil.copyfileobj(fin, fout, CHUNK_SIZE)
+        conn = sqlite3.connect(raw_copy)
+        try:
+            integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            conn.close()
+
+    return {
+        "file": path.name,
+        "ok": integrity == "ok",
+        "sha256": actual,
+        "error": None if integrity == "ok" else integrity,
+    }
+
+def restore_backup(name_or_path: str, target: str = DB_PATH) -> dict:
+    """Verify a snapshot and copy it over `target` through the backup API,
+    so connections that are still open see a consistent database."""
+    result = verify_backup(name_or_path)
+    if not result["ok"]:
+        raise ValueError(f"Refusing to restore {result['file']}: {result['error']}")
+
+    path = _resolve(name_or_path)
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=path.parent) as tmp:
+        raw_copy = Path(tmp) / "restore.db"
+        with gzip.open(path, "rb") as fin, open(raw_copy, "wb") as fout:
+            shutil.copyfileobj(fin, fout, CHUNK_SIZE)
+        src = sqlite3.connect(raw_copy)
+        dst = sqlite3.connect(target, timeout=30)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+
+    logger.info(f"♻️  Restored {path.name} into {target}")
+    return {"file": path.name, "target": target,
+            "duration_seconds": round(time.perf_counter() - started, 3)}
+
+def backup_info(path: Path) -> dict:
+    stat = path.stat()
+    return {
+        "file": path.name,
+        "compressed_bytes": stat.st_size,
+        "created_at": datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(),
+        "has_checksum": _sidecar(path).exists(),
+    }
+
+async def run_backup() -> dict:
+    async with _backup_lock:
+        return await asyncio.to_thread(create_backup)
+
+def _latest_backup_age() -> Optional[float]:
+    files = list_backup_files()
+    if not files:
+        return None
+    return time.time() - files[0].stat().st_mtime
+
+async def backup_scheduler():
+    """Background task: take a snapshot every BACKUP_INTERVAL_HOURS."""
+    if POSTGRES:
+        logger.info("💾 DATABASE_URL is PostgreSQL: scheduled SQLite backups are off, use pg_dump")
+        return
+    interval = BACKUP_INTERVAL_HOURS * 3600
+    logger.info(f"💾 Backup schedule: every {BACKUP_INTERVAL_HOURS}h into {BACKUP_DIR}")
+    while True:
+        age = _latest_backup_age()
+        if age is not None and age < interval:
+            await asyncio.sleep(interval - age)
+            continue
+        try:
+            await run_backup()
+        except BackupInProgress:
+            pass
+        except Exception as e:
+            metrics.inc("backup.failures")
+            logger.error(f"❌ Scheduled backup failed: {e}")
+        await asyncio.sleep(min(interval, 60))
+
+@router.post("/")
+async def trigger_backup(admin: User = Depends(get_admin_user)):
+    if POSTGRES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="The database is PostgreSQL: back it up with pg_dump")
+    try:
+        return await run_backup()
+    except BackupInProgress as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+@router.get("/")
+async def list_backups(admin: User = Depends(get_admin_user)):
+    return {
+        "backup_dir": BACKUP_DIR,
+        "keep": BACKUP_KEEP,
+        "interval_hours": BACKUP_INTERVAL_HOURS,
+        "backups": [backup_info(p) for p in list_backup_files()],
+    }
+
+@router.post("/{name}/verify")
+async def verify(name: str, admin: User = Depends(get_admin_user)):
+    try:
+        # Only snapshots from BACKUP_DIR can be verified over HTTP
+        return await asyncio.to_thread(verify_backup, str(Path(BACKUP_DIR) / Path(name).name))
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Backup not found")
+
+def main(argv: List[str]) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    usage = "usage: python -m app.backup create | list | verify <file> | restore <file>"
+    if not argv:
+        print(usage)
+        return 2
+
+    command = argv[0]
+    if command == "create":
+        if POSTGRES:
+            print("DATABASE_URL is PostgreSQL: back it up with pg_dump")
+            return 2
+        print(create_backup())
+    elif command == "list":
+        for path in list_backup_files():
+            print(backup_info(path))
+    elif command == "verify" and len(argv) == 2:
+        result = verify_backup(argv[1])
+        print(result)
+        return 0 if result["ok"] else 1
+    elif command == "restore" and len(argv) == 2:
+        print(restore_backup(argv[1]))
+    else:
+        print(usage)
+        return 2
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
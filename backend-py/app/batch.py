@@ -0,0 +1,97 @@
+"""
+POST /api/batch — several read requests in one round trip.
+
+The PWA opens with /api/me, /api/categories/, /api/transactions/,
+/api/transactions/stats/summary and /api/sync/status. The batch endpoint
+authenticates once, opens one connection with one read transaction (so every
+sub-response sees the same snapshot) and runs the sub-requests through the
+regular routers in-process. Sub-requests find the user and the connection in
+request.state (see get_current_user and get_db).
+"""
+from fastapi import APIRouter, Depends, Request
+from typing import List
+from urllib.parse import urlsplit
+import json
+import logging
+import time
+
+from .db import get_db, SHARED_DB_STATE
+from .auth import get_current_user, BATCH_USER_STATE
+from .models import User, BatchRequest, BatchResponse, BatchResult
+from . import metrics
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+FORWARDED_HEADERS = (b"authorization", b"accept", b"accept-language", b"user-agent")
+
+async def _dispatch(request: Request, path: str, user: User, db) -> BatchResult:
+    url = urlsplit(path)
+    if not url.path.startswith("/api/") or url.path.rstrip("/") == "/api/batch":
+        return BatchResult(status=400, body={"error": "Only /api/ paths can be batched"})
+
+    scope = {
+        "type": "http",
+        "asgi": request.scope.get("asgi", {"version": "3.0"}),
+        "http_version": request.scope.get("http_version", "1.1"),
+        "method": "GET",
+        "scheme": request.scope.get("scheme", "http"),
+        "server": request.scope.get("server"),
+        "client": request.scope.get("client"),
+        "root_path": request.scope.get("root_path", ""),
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": [(k, v) for k, v in request.scope["headers"] if k in FORWARDED_HEADERS],
+        "state": {BATCH_USER_STATE: user, SHARED_DB_STATE: db},
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    response = {"status": 500, "headers": [], "body": b""}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    try:
+        await request.app(scope, receive, send)
+    except Exception as e:
+        # ServerErrorMiddleware has already produced the 500 response
+        logger.error(f"❌ Batch sub-request {url.path} failed: {e}")
+
+    content_type = dict(response["headers"]).get(b"content-type", b"")
+    body = response["body"].decode("utf-8", errors="replace")
+    if content_type.startswith(b"application/json") and body:
+        body = json.loads(body)
+    return BatchResult(status=response["status"], body=body)
+
+@router.post("/", response_model=BatchResponse)
+async def batch(
+    batch_request: BatchRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    started = time.perf_counter()
+    results: List[BatchResult] = []
+
+    # Deferred BEGIN: the WAL snapshot is taken at the first read and kept
+    # until rollback, so all sub-requests see the same data.
+    await db.execute("BEGIN")
+    try:
+        for item in batch_request.requests:
+            result = await _dispatch(request, item.path, current_user, db)
+            result.id = item.id
+            results.append(result)
+    finally:
+        await db.rollback()
+
+    metrics.inc("batch.requests")
+    metrics.inc("batch.sub_requests", len(results))
+    metrics.observe("batch.duration", time.perf_counter() - started)
+    return BatchResponse(results=results)
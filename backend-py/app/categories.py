@@ -1,29 +1,74 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from typing import Dict, List, Optional, Set
 import uuid
 import logging
 
 from .db import get_db
 from .auth import get_current_user
-from .models import User, Category, CategoryCreate, CategoryUpdate
+from .changes import log_change, log_changes, CATEGORIES, INSERT, UPDATE, DELETE
+from .locks import user_write_transaction
+from .fingerprints import category_hash
+from .storage import ROW_DIFFERS, INTEGRITY_ERRORS
+from .models import (
+    User, Category, CategoryCreate, CategoryUpdate, CategoryBulkCreate, CategoryBulkUpdate, BulkDelete,
+    BulkItemResult, BulkResponse,
+)
+from .timestamps import now_ms, from_ms
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+CATEGORY_COLUMNS = "id, user_id, name, type, color, icon, sync_id, created_at, updated_at"
+
+def category_from_row(row) -> dict:
+    """Fields of Category from a categories row (times are epoch ms)."""
+    data = dict(row)
+    data["created_at"] = from_ms(data["created_at"])
+    data["updated_at"] = from_ms(data["updated_at"])
+    return data
+
+def update_statement(edited: List[str], returning: str) -> str:
+    """UPDATE of one category with update_params.
+
+    One statement: the name check, the no-op check (same values are neither
+    written nor logged) and content_hash recomputed from the new values.
+    Edited fields fall back to the new updated_at as their sync version.
+    """
+    return f"""UPDATE categories
+        SET name = COALESCE(:name, name), color = COALESCE(:color, color), icon = COALESCE(:icon, icon),
+            content_hash = category_hash(COALESCE(:name, name), type, COALESCE(:color, color),
+                                         COALESCE(:icon, icon)),
+            field_versions = json_remove(field_versions, {', '.join(f"'$.{name}'" for name in edited)}),
+            updated_at = :now
+        WHERE id = :id AND user_id = :user_id
+          AND (name, color, icon) {ROW_DIFFERS} (COALESCE(:name, name), COALESCE(:color, color),
+                                                 COALESCE(:icon, icon))
+          AND NOT EXISTS (SELECT 1 FROM categories other
+                          WHERE other.user_id = :user_id AND other.name = :name AND other.id != :id)
+        RETURNING {returning}"""
+
+def update_params(category_update: CategoryUpdate, category_id: int, user_id: int) -> dict:
+    return {**category_update.model_dump(include={"name", "color", "icon"}),
+            "now": now_ms(), "id": category_id, "user_id": user_id}
+
+def edited_fields(category_update: CategoryUpdate) -> List[str]:
+    return [name for name in ("name", "color", "icon") if getattr(category_update, name) is not None]
+
 async def get_user_category(db, user_id: int, category_id: int):
     cursor = await db.execute(
-        """SELECT id, user_id, name, type, color, icon, sync_id, created_at, updated_at 
-           FROM categories WHERE id = ? AND user_id = ?""",
+        f"SELECT {CATEGORY_COLUMNS} FROM categories WHERE id = ? AND user_id = ?",
         (category_id, user_id)
     )
     row = await cursor.fetchone()
     if row:
-        return dict(row)
+        return category_from_row(row)
     return None
 
 @router.get("/", response_model=List[Category])
-async def get_categories(current_user: User = Depends(get_current_user)):
-    db = await get_db()
+async def get_categories(
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
     
     cursor = await db.execute(
         """SELECT id, user_id, name, type, color, icon, sync_id, created_at, updated_at 
@@ -34,37 +79,38 @@ async def get_categories(current_user: User = Depends(get_current_user)):
     
     categories = []
     for row in rows:
-        categories.append(Category(**dict(row)))
+        categories.append(Category(**category_from_row(row)))
     
     return categories
 
 @router.post("/", response_model=Category)
 async def create_category(
     category: CategoryCreate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
 ):
-    db = await get_db()
-    
-    # Check if category with same name already exists
-    cursor = await db.execute(
-        "SELECT id FROM categories WHERE user_id = ? AND name = ?",
-        (current_user.id, category.name)
-    )
-    if await cursor.fetchone():
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Category with this name already exists"
-        )
     
     sync_id = str(uuid.uuid4())
+    now = now_ms()
     
+    # The name check is part of the INSERT: no row back means the name is taken
     cursor = await db.execute(
-        """INSERT INTO categories (user_id, name, type, color, icon, sync_id)
-           VALUES (?, ?, ?, ?, ?, ?) RETURNING id, created_at, updated_at""",
+        """INSERT INTO categories (user_id, name, type, color, icon, sync_id, created_at, updated_at, content_hash)
+           SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?
+           WHERE NOT EXISTS (SELECT 1 FROM categories WHERE user_id = ? AND name = ?)
+           RETURNING id, created_at, updated_at""",
         (current_user.id, category.name, category.type.value, 
-         category.color, category.icon, sync_id)
+         category.color, category.icon, sync_id, now, now,
+         category_hash(category.name, category.type.value, category.color, category.icon),
+         current_user.id, category.name)
     )
     row = await cursor.fetchone()
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Category with this name already exists"
+        )
+    await log_change(db, current_user.id, CATEGORIES, sync_id, INSERT)
     await db.commit()
     
     return Category(
@@ -75,16 +121,167 @@ async def create_category(
         color=category.color,
         icon=category.icon,
         sync_id=sync_id,
-        created_at=row["created_at"],
-        updated_at=row["updated_at"]
+        created_at=from_ms(row["created_at"]),
+        updated_at=from_ms(row["updated_at"])
     )
 
+def bulk_response(results: List[BulkItemResult]) -> BulkResponse:
+    failed = sum(result.status >= 400 for result in results)
+    return BulkResponse(results=results, succeeded=len(results) - failed, failed=failed)
+
+# Bulk routes are declared before /{category_id}, which would match "bulk" too.
+# Each answers every item as the single-object route would, in one write transaction.
+@router.post("/bulk", response_model=BulkResponse)
+async def create_categories(
+    bulk: CategoryBulkCreate,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    
+    now = now_ms()
+    results: List[Optional[BulkItemResult]] = [None] * len(bulk.items)
+    inserted = {}    # index -> sync_id
+    async with user_write_transaction(db, current_user.id):
+        names = list({category.name for category in bulk.items})
+        cursor = await db.execute(
+            f"SELECT name FROM categories WHERE user_id = ? AND name IN ({','.join('?' * len(names))})",
+            [current_user.id, *names]
+        )
+        taken = {row["name"] for row in await cursor.fetchall()}
+        
+        rows = []
+        for index, category in enumerate(bulk.items):
+            if category.name in taken:
+                results[index] = BulkItemResult(index=index, status=status.HTTP_400_BAD_REQUEST,
+                                                detail="Category with this name already exists")
+                continue
+            taken.add(category.name)
+            sync_id = inserted[index] = str(uuid.uuid4())
+            rows.append((current_user.id, category.name, category.type.value, category.color, category.icon,
+                         sync_id, now, now,
+                         category_hash(category.name, category.type.value, category.color, category.icon)))
+        
+        if rows:
+            await db.executemany(
+                """INSERT INTO categories (user_id, name, type, color, icon, sync_id, created_at, updated_at,
+                                           content_hash)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows
+            )
+            cursor = await db.execute(
+                f"""SELECT id, sync_id FROM categories
+                    WHERE user_id = ? AND sync_id IN ({','.join('?' * len(inserted))})""",
+                [current_user.id, *inserted.values()]
+            )
+            ids = {row["sync_id"]: row["id"] for row in await cursor.fetchall()}
+            await log_changes(db, current_user.id, CATEGORIES, inserted.values(), INSERT)
+    
+    for index, sync_id in inserted.items():
+        results[index] = BulkItemResult(index=index, id=ids[sync_id], status=status.HTTP_200_OK, changed=True)
+    return bulk_response(results)
+
+@router.patch("/bulk", response_model=BulkResponse)
+async def update_categories(
+    bulk: CategoryBulkUpdate,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """Partial updates in item order: names can be swapped through a free one."""
+    
+    results = []
+    logged = {}      # edited fields -> sync_ids
+    async with user_write_transaction(db, current_user.id):
+        # The user's categories that are edited or hold one of the new names
+        ids = list({item.id for item in bulk.items})
+        names = list({item.name for item in bulk.items if item.name is not None})
+        cursor = await db.execute(
+            f"""SELECT id, name FROM categories
+                WHERE user_id = ? AND (id IN ({','.join('?' * len(ids))})
+                                       OR name IN ({','.join('?' * len(names)) or 'NULL'}))""",
+            [current_user.id, *ids, *names]
+        )
+        name_of = {row["id"]: row["name"] for row in await cursor.fetchall()}
+        # Имя -> все его категории: sync может создать две категории с одним именем
+        owners: Dict[str, Set[int]] = {}
+        for category_id, name in name_of.items():
+            owners.setdefault(name, set()).add(category_id)
+        
+        for index, item in enumerate(bulk.items):
+            if item.id not in name_of:
+                results.append(BulkItemResult(index=index, id=item.id, status=status.HTTP_404_NOT_FOUND,
+                                              detail="Category not found"))
+                continue
+            if (item.name is not None and item.name != name_of[item.id]
+                    and owners.get(item.name, set()) - {item.id}):
+                results.append(BulkItemResult(index=index, id=item.id, status=status.HTTP_400_BAD_REQUEST,
+                                              detail="Category with this name already exists"))
+                continue
+            edited = edited_fields(item)
+            row = None
+            if edited:
+                cursor = await db.execute(update_statement(edited, "sync_id, name"),
+                                          update_params(item, item.id, current_user.id))
+                row = await cursor.fetchone()
+            if row is not None:
+                logged.setdefault(tuple(edited), []).append(row["sync_id"])
+                owners[name_of[item.id]].discard(item.id)
+                name_of[item.id] = row["name"]
+                owners.setdefault(row["name"], set()).add(item.id)
+            results.append(BulkItemResult(index=index, id=item.id, status=status.HTTP_200_OK,
+                                          changed=row is not None))
+        
+        for edited, sync_ids in logged.items():
+            await log_changes(db, current_user.id, CATEGORIES, sync_ids, UPDATE, edited)
+    
+    return bulk_response(results)
+
+@router.delete("/bulk", response_model=BulkResponse)
+async def delete_categories(
+    bulk: BulkDelete,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    
+    ids = list(set(bulk.ids))
+    async with user_write_transaction(db, current_user.id):
+        # Categories with transactions stay (the foreign key is ON DELETE RESTRICT);
+        # the rest go in one DELETE
+        cursor = await db.execute(
+            f"""SELECT id, EXISTS (SELECT 1 FROM transactions t WHERE t.category_id = categories.id) AS used
+                FROM categories WHERE user_id = ? AND id IN ({','.join('?' * len(ids))})""",
+            [current_user.id, *ids]
+        )
+        used = {row["id"]: row["used"] for row in await cursor.fetchall()}
+        free = [category_id for category_id, in_use in used.items() if not in_use]
+        deleted = {}
+        if free:
+            cursor = await db.execute(
+                f"""DELETE FROM categories WHERE user_id = ? AND id IN ({','.join('?' * len(free))})
+                    RETURNING id, sync_id""",
+                [current_user.id, *free]
+            )
+            deleted = {row["id"]: row["sync_id"] for row in await cursor.fetchall()}
+            await log_changes(db, current_user.id, CATEGORIES, deleted.values(), DELETE)
+    
+    results = []
+    for index, category_id in enumerate(bulk.ids):
+        # A repeated id is already gone, as it would be for a second DELETE
+        if deleted.pop(category_id, None) is not None:
+            results.append(BulkItemResult(index=index, id=category_id, status=status.HTTP_200_OK, changed=True))
+        elif used.get(category_id):
+            results.append(BulkItemResult(index=index, id=category_id, status=status.HTTP_400_BAD_REQUEST,
+                                          detail="Cannot delete category with existing transactions"))
+        else:
+            results.append(BulkItemResult(index=index, id=category_id, status=status.HTTP_404_NOT_FOUND,
+                                          detail="Category not found"))
+    return bulk_response(results)
+
 @router.get("/{category_id}", response_model=Category)
 async def get_category(
     category_id: int,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
 ):
-    db = await get_db()
     
     category = await get_user_category(db, current_user.id, category_id)
     if not category:
@@ -99,96 +296,75 @@ async def get_category(
 async def update_category(
     category_id: int,
     category_update: CategoryUpdate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
 ):
-    db = await get_db()
     
-    # Check if category exists
-    existing_category = await get_user_category(db, current_user.id, category_id)
-    if not existing_category:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Category not found"
-        )
+    edited = edited_fields(category_update)
+    if not edited:
+        # No fields to update
+        return await get_category(category_id, current_user, db)
     
-    # Check if new name conflicts with existing category
-    if category_update.name:
+    # Name check, no-op check and the response row in one statement
+    cursor = await db.execute(
+        update_statement(edited, CATEGORY_COLUMNS),
+        update_params(category_update, category_id, current_user.id)
+    )
+    row = await cursor.fetchone()
+    if row is None:
+        # Not found, name taken or nothing to change: one read tells which
         cursor = await db.execute(
-            "SELECT id FROM categories WHERE user_id = ? AND name = ? AND id != ?",
-            (current_user.id, category_update.name, category_id)
+            f"""SELECT {CATEGORY_COLUMNS},
+                       EXISTS (SELECT 1 FROM categories other
+                               WHERE other.user_id = categories.user_id AND other.name = ?
+                                 AND other.id != categories.id) AS name_taken
+                FROM categories WHERE id = ? AND user_id = ?""",
+            (category_update.name, category_id, current_user.id)
         )
-        if await cursor.fetchone():
+        existing = await cursor.fetchone()
+        if existing is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Category not found"
+            )
+        if existing["name_taken"]:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Category with this name already exists"
             )
-    
-    # Build update query
-    update_fields = []
-    update_values = []
-    
-    if category_update.name is not None:
-        update_fields.append("name = ?")
-        update_values.append(category_update.name)
-    
-    if category_update.color is not None:
-        update_fields.append("color = ?")
-        update_values.append(category_update.color)
-    
-    if category_update.icon is not None:
-        update_fields.append("icon = ?")
-        update_values.append(category_update.icon)
-    
-    if not update_fields:
-        # No fields to update
-        return Category(**existing_category)
-    
-    update_values.append(category_id)
-    update_values.append(current_user.id)
-    
-    query = f"""UPDATE categories 
-               SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP
-               WHERE id = ? AND user_id = ?
-               RETURNING id, user_id, name, type, color, icon, sync_id, created_at, updated_at"""
-    
-    cursor = await db.execute(query, update_values)
-    row = await cursor.fetchone()
+        return Category(**category_from_row(existing))
+    await log_change(db, current_user.id, CATEGORIES, row["sync_id"], UPDATE, edited)
     await db.commit()
     
-    return Category(**dict(row))
+    return Category(**category_from_row(row))
 
 @router.delete("/{category_id}")
 async def delete_category(
     category_id: int,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
 ):
-    db = await get_db()
     
-    # Check if category exists
-    category = await get_user_category(db, current_user.id, category_id)
-    if not category:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Category not found"
+    # transactions.category_id is ON DELETE RESTRICT: the foreign key is the
+    # "has transactions" check
+    try:
+        cursor = await db.execute(
+            "DELETE FROM categories WHERE id = ? AND user_id = ? RETURNING sync_id",
+            (category_id, current_user.id)
         )
-    
-    # Check if category has transactions
-    cursor = await db.execute(
-        "SELECT COUNT(*) as count FROM transactions WHERE category_id = ?",
-        (category_id,)
-    )
-    row = await cursor.fetchone()
-    if row["count"] > 0:
+        row = await cursor.fetchone()
+    except INTEGRITY_ERRORS:
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Cannot delete category with existing transactions"
         )
-    
-    # Delete category
-    await db.execute(
-        "DELETE FROM categories WHERE id = ? AND user_id = ?",
-        (category_id, current_user.id)
-    )
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Category not found"
+        )
+    await log_change(db, current_user.id, CATEGORIES, row["sync_id"], DELETE)
     await db.commit()
     
     return {"message": "Category deleted successfully"}
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""
+Append-only change log: the source of truth for sync.
+
+Every write to categories and transactions appends (user_id, seq, table,
+sync_id, op, fields) in the same database transaction. seq is assigned by the
+server (AUTOINCREMENT), so it only grows, whatever the clients' clocks say.
+A client remembers the last seq it has seen and asks for everything after it:
+an index range scan on (user_id, seq).
+"""
+from typing import Dict, Iterable, Optional, Tuple
+import json
+
+from .timestamps import now_ms
+
+# Tables tracked in the log
+CATEGORIES = "categories"
+TRANSACTIONS = "transactions"
+
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+
+def _fields(fields: Optional[Iterable[str]]) -> Optional[str]:
+    return json.dumps(sorted(fields)) if fields is not None else None
+
+async def log_change(db, user_id: int, table: str, sync_id: str, op: str,
+                     fields: Optional[Iterable[str]] = None):
+    """Append one entry. `fields` lists the changed columns of an update."""
+    await db.execute(
+        """INSERT INTO change_log (user_id, table_name, sync_id, op, fields, changed_at)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (user_id, table, sync_id, op, _fields(fields), now_ms())
+    )
+
+async def log_changes(db, user_id: int, table: str, sync_ids: Iterable[str], op: str,
+                      fields: Optional[Iterable[str]] = None):
+    """Same entry for many records; `fields` as in log_change."""
+    now = now_ms()
+    fields = _fields(fields)
+    await db.executemany(
+        """INSERT INTO change_log (user_id, table_name, sync_id, op, fields, changed_at)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        [(user_id, table, sync_id, op, fields, now) for sync_id in sync_ids]
+    )
+
+async def latest_change(db, user_id: int) -> Tuple[int, Optional[int]]:
+    """(seq, changed_at) of the user's newest entry: one index seek."""
+    cursor = await db.execute(
+        "SELECT seq, changed_at FROM change_log WHERE user_id = ? ORDER BY seq DESC LIMIT 1",
+        (user_id,)
+    )
+    row = await cursor.fetchone()
+    return (row["seq"], row["changed_at"]) if row else (0, None)
+
+class RecordChange:
+    """What happened to one record after a given seq, folded over its entries."""
+    __slots__ = ("created", "deleted", "fields", "changed_at")
+
+    def __init__(self):
+        self.created = False
+        self.deleted = False
+        self.fields: Optional[set] = set()   # None = every field
+        self.changed_at: Optional[int] = None         # epoch ms
+
+async def changes_since(db, user_id: int, since_seq: int) -> Dict[str, Dict[str, RecordChange]]:
+    """{table: {sync_id: RecordChange}} for entries with seq > since_seq."""
+    cursor = await db.execute(
+        """SELECT table_name, sync_id, op, fields, changed_at FROM change_log
+           WHERE user_id = ? AND seq > ? ORDER BY seq""",
+        (user_id, since_seq)
+    )
+    result: Dict[str, Dict[str, RecordChange]] = {CATEGORIES: {}, TRANSACTIONS: {}}
+    async for row in cursor:
+        change = result.setdefault(row["table_name"], {}).setdefault(row["sync_id"], RecordChange())
+        change.changed_at = row["changed_at"]
+        if row["op"] == DELETE:
+            change.deleted = True
+        elif row["op"] == INSERT or row["fields"] is None:
+            change.created = change.created or row["op"] == INSERT
+            change.fields = None
+        elif change.fields is not None:
+            change.fields.update(json.loads(row["fields"]))
+    return result
@@ -0,0 +1,181 @@
+"""
+Currency rates and conversion of aggregates.
+
+Every transaction has a `currency` (BASE_CURRENCY unless given). Rates live
+in `currency_rates` as units of the currency per one BASE_CURRENCY, effective
+from `day` until the next row of that currency (the format of the ECB
+reference rates when BASE_CURRENCY is EUR). Rates are looked up through an
+in-process cache keyed by (currency, day), dropped whenever a new import
+shows up in `currency_rate_imports`.
+
+Reports convert without touching rows in Python: the distinct
+(currency, day) pairs of the period go into a per-connection temp table of
+factors, and the SQL joins it (FX_JOIN) and sums CONVERTED_CENTS: each
+amount is rounded to whole cents once, so the sums stay exact integers.
+
+Import rates from a local file, either `date,currency,rate` rows or the ECB
+history CSV (`Date,USD,JPY,...`):
+    python -m app.currency import eurofxref-hist.csv
+"""
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import asyncio
+import csv
+import logging
+import os
+import sys
+
+from .db import connect_db
+from .storage import TEMP_SCHEMA, WITHOUT_ROWID
+from .timestamps import day_ms, sql_day
+
+logger = logging.getLogger(__name__)
+
+BASE_CURRENCY = os.getenv("BASE_CURRENCY", "EUR").upper()
+RATES_CACHE_SIZE = int(os.getenv("RATES_CACHE_SIZE", "100000"))
+
+# Подключается к запросу по transactions t после prepare_conversion()
+FX_TABLE = f"{TEMP_SCHEMA}.fx_factors"
+FX_JOIN = f"LEFT JOIN {FX_TABLE} fx ON fx.currency = t.currency AND fx.day = {sql_day('t.date')}"
+CONVERTED_CENTS = "COALESCE(CAST(ROUND(t.amount_cents * fx.factor) AS BIGINT), t.amount_cents)"
+
+class MissingRateError(ValueError):
+    """No rate on or before a day for some currency."""
+    def __init__(self, missing: List[Tuple[str, str]]):
+        self.missing = missing
+        shown = ", ".join(f"{c} on {d}" for c, d in missing[:5])
+        super().__init__(f"No exchange rate for {shown}" + (" …" if len(missing) > 5 else ""))
+
+_cache: "OrderedDict[Tuple[str, str], Optional[float]]" = OrderedDict()
+_cache_version: Optional[int] = None
+
+async def _check_cache(db):
+    global _cache_version
+    cursor = await db.execute("SELECT MAX(id) FROM currency_rate_imports")
+    version = (await cursor.fetchone())[0]
+    if version != _cache_version:
+        _cache.clear()
+        _cache_version = version
+
+async def rates_on(db, pairs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Optional[float]]:
+    """{(currency, day): rate effective on that day, or None}."""
+    await _check_cache(db)
+    result, missing = {}, {}
+    for currency, day in set(pairs):
+        if currency == BASE_CURRENCY:
+            result[(currency, day)] = 1.0
+        elif (currency, day) in _cache:
+            _cache.move_to_end((currency, day))
+            result[(currency, day)] = _cache[(currency, day)]
+        else:
+            missing.setdefault(currency, []).append(day)
+
+    # Промахи: один запрос на валюту — от курса, действующего в первый день, до последнего дня
+    for currency, days in missing.items():
+        first, last = min(days), max(days)
+        cursor = await db.execute(
+            """SELECT day, rate FROM currency_rates
+               WHERE currency = ? AND day <= ? AND day >= COALESCE(
+                   (SELECT MAX(day) FROM currency_rates WHERE currency = ? AND day <= ?), '')
+               ORDER BY day""",
+            (currency, last, currency, first)
+        )
+        rows = await cursor.fetchall()
+        known = [r[0] for r in rows]
+        for day in days:
+            i = bisect_right(known, day)
+            rate = rows[i - 1][1] if i else None
+            result[(currency, day)] = _cache[(currency, day)] = rate
+    while len(_cache) > RATES_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return result
+
+async def prepare_conversion(db, user_id: int, start: date, end: date, target: str):
+    """Fill the fx_factors temp table for the user's transactions with start <= date < end.
+
+    Raises MissingRateError when some currency has no rate on some day."""
+    await db.execute(
+        f"""CREATE TEMP TABLE IF NOT EXISTS fx_factors (
+               currency TEXT NOT NULL, day TEXT NOT NULL, factor DOUBLE PRECISION NOT NULL,
+               PRIMARY KEY (currency, day)
+           ){WITHOUT_ROWID}"""
+    )
+    await db.execute(f"DELETE FROM {FX_TABLE}")
+    cursor = await db.execute(
+        f"""SELECT DISTINCT currency, {sql_day('date')} FROM transactions
+            WHERE user_id = ? AND date >= ? AND date < ? AND currency != ?""",
+        (user_id, day_ms(start), day_ms(end), target)
+    )
+    pairs = [(row[0], row[1]) for row in await cursor.fetchall()]
+    if not pairs:
+        return
+    rates = await rates_on(db, pairs + [(target, day) for _, day in pairs])
+    missing = sorted({p for p in pairs + [(target, d) for _, d in pairs] if rates[p] is None})
+    if missing:
+        raise MissingRateError(missing)
+    await db.executemany(
+        f"INSERT INTO {FX_TABLE} (currency, day, factor) VALUES (?, ?, ?)",
+        [(currency, day, rates[(target, day)] / rates[(currency, day)]) for currency, day in pairs]
+    )
+
+def parse_rates(stream) -> Iterator[Tuple[str, str, float]]:
+    """(currency, day, rate) from a long (date,currency,rate) or ECB-style wide CSV."""
+    reader = csv.reader(stream)
+    header = [h.strip().lower() for h in next(reader, [])]
+    if not header or header[0] != "date":
+        raise ValueError("The first column must be 'date'")
+    long_format = header[1:3] == ["currency", "rate"]
+    currencies = [h.upper() for h in header[1:]]
+    for row in reader:
+        if not row or not row[0].strip():
+            continue
+        day = date.fromisoformat(row[0].strip()).isoformat()
+        if long_format:
+            yield row[1].strip().upper(), day, float(row[2])
+            continue
+        for currency, value in zip(currencies, row[1:]):
+            value = value.strip()
+            # В файле ЕЦБ пустые колонки и N/A — валюта в этот день не котировалась
+            if currency and value and value.upper() != "N/A":
+                yield currency, day, float(value)
+
+async def import_rates(db, path: Path, batch_size: int = 5000) -> int:
+    count = 0
+    with open(path, encoding="utf-8-sig", newline="") as stream:
+        rows = parse_rates(stream)
+        while True:
+            batch = [r for _, r in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            await db.executemany(
+                """INSERT INTO currency_rates (currency, day, rate) VALUES (?, ?, ?)
+                   ON CONFLICT (currency, day) DO UPDATE SET rate = excluded.rate""", batch
+            )
+            count += len(batch)
+    await db.execute(
+        "INSERT INTO currency_rate_imports (source, rows, imported_at) VALUES (?, ?, ?)",
+        (path.name, count, datetime.utcnow().isoformat())
+    )
+    await db.commit()
+    return count
+
+async def _import(path: Path) -> int:
+    db = await connect_db()
+    try:
+        return await import_rates(db, path)
+    finally:
+        await db.close()
+
+def main(argv: List[str]) -> int:
+    if len(argv) != 2 or argv[0] != "import":
+        print("usage: python -m app.currency import FILE")
+        return 2
+    count = asyncio.run(_import(Path(argv[1])))
+    print(f"✅ Imported {count} rates (quoted per 1 {BASE_CURRENCY}) from {argv[1]}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -4,7 +4,13 @@ from pathlib import Path
 import aiosqlite
 import sqlite3
 import logging
-from typing import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional
+from urllib.parse import quote
+from fastapi import Request
+
+from .querybudget import count_statements, check_budget
+from .storage import POSTGRES
 
 log = logging.getLogger(__name__)
 
@@ -16,6 +22,13 @@ SCHEMA_CANDIDATES = [
 ]
 
 async def init_db():
+    if POSTGRES:
+        from .postgres import init_schema
+
+        log.info("🗄️  Initializing PostgreSQL schema...")
+        await init_schema()
+        return
+
     Path(DB_PATH).parent.mkdir(parents=True, exist_ok=True)
 
     schema_path = next((p for p in SCHEMA_CANDIDATES if Path(p).exists()), None)
@@ -30,14 +43,304 @@ async def init_db():
         await db.execute("PRAGMA foreign_keys=ON;")
         await db.executescript(sql)
         await db.commit()
+        await apply_migrations(db)
     log.info("✅ Migrations applied")
 
-async def get_db() -> AsyncIterator[aiosqlite.Connection]:
-    """FastAPI dependency: открывает подключение к SQLite и закрывает после запроса."""
-    db = await aiosqlite.connect(DB_PATH, timeout=5)
+async def apply_migrations(db: aiosqlite.Connection):
+    """Применяет MIGRATIONS, номер последней хранится в PRAGMA user_version.
+
+    BEGIN IMMEDIATE сериализует воркеры uvicorn, стартующие одновременно.
+    """
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = await db.execute("PRAGMA user_version")
+        version = (await cursor.fetchone())[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            log.info(f"🔧 Migration {number}: {migration.__doc__}")
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {number}")
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+async def _column_exists(db: aiosqlite.Connection, table: str, column: str) -> bool:
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in await cursor.fetchall())
+
+async def _add_transaction_fingerprint(db: aiosqlite.Connection):
+    """transactions.fingerprint + index for duplicate lookups"""
+    from .fingerprints import transaction_fingerprint, amount_to_cents
+
+    if not await _column_exists(db, "transactions", "fingerprint"):
+        await db.execute("ALTER TABLE transactions ADD COLUMN fingerprint TEXT")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tx_user_fingerprint ON transactions(user_id, fingerprint)"
+    )
+
+    last_id = 0
+    while True:
+        cursor = await db.execute(
+            """SELECT id, user_id, date, amount, category_id, description FROM transactions
+               WHERE id > ? AND fingerprint IS NULL ORDER BY id LIMIT ?""",
+            (last_id, MIGRATION_BATCH_SIZE)
+        )
+        rows = await cursor.fetchall()
+        if not rows:
+            break
+        await db.executemany(
+            "UPDATE transactions SET fingerprint = ? WHERE id = ?",
+            [(transaction_fingerprint(r[1], r[2], amount_to_cents(r[3]), r[4], r[5]), r[0]) for r in rows]
+        )
+        last_id = rows[-1][0]
+
+async def _drop_import_jobs(db: aiosqlite.Connection):
+    """import_jobs replaced by the generic jobs table"""
+    await db.execute("DROP TABLE IF EXISTS import_jobs")
+
+async def _add_field_versions(db: aiosqlite.Connection):
+    """categories/transactions.field_versions for field-level sync merges"""
+    # JSON {поле: время изменения}; поля без записи считаются изменёнными в updated_at
+    for table in ("categories", "transactions"):
+        if not await _column_exists(db, table, "field_versions"):
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN field_versions TEXT")
+
+async def _backfill_change_log(db: aiosqlite.Connection):
+    """change_log entries for records created before the log existed"""
+    # Одна запись insert на каждую строку: pull с since_seq=0 отдаёт всё
+    for table in ("categories", "transactions"):
+        await db.execute(
+            f"""INSERT INTO change_log (user_id, table_name, sync_id, op, changed_at)
+                SELECT user_id, '{table}', sync_id, 'insert', updated_at FROM {table} ORDER BY id"""
+        )
+
+async def _add_transaction_currency(db: aiosqlite.Connection):
+    """transactions.currency (existing rows get BASE_CURRENCY)"""
+    from .currency import BASE_CURRENCY
+
+    if not await _column_exists(db, "transactions", "currency"):
+        await db.execute(
+            f"ALTER TABLE transactions ADD COLUMN currency TEXT NOT NULL DEFAULT '{BASE_CURRENCY}'"
+        )
+
+async def _amount_to_cents(db: aiosqlite.Connection):
+    """transactions.amount (NUMERIC) -> transactions.amount_cents (INTEGER)"""
+    if not await _column_exists(db, "transactions", "amount"):
+        return
+    if not await _column_exists(db, "transactions", "amount_cents"):
+        await db.execute("ALTER TABLE transactions ADD COLUMN amount_cents INTEGER NOT NULL DEFAULT 0")
+
+    # Пачками по диапазонам id: каждый UPDATE короткий, память не растёт с размером таблицы
+    last_id = 0
+    while True:
+        cursor = await db.execute(
+            "SELECT id FROM transactions WHERE id > ? ORDER BY id LIMIT 1 OFFSET ?",
+            (last_id, MIGRATION_BATCH_SIZE - 1)
+        )
+        row = await cursor.fetchone()
+        upper = row[0] if row else None
+        await db.execute(
+            """UPDATE transactions SET amount_cents = CAST(ROUND(amount * 100) AS INTEGER)
+               WHERE id > ? AND (? IS NULL OR id <= ?)""",
+            (last_id, upper, upper)
+        )
+        if upper is None:
+            break
+        last_id = upper
+    await db.execute("ALTER TABLE transactions DROP COLUMN amount")
+
+# ISO8601 в любом из встречавшихся видов ('...T...Z', CURRENT_TIMESTAMP, с микросекундами) -> epoch ms
+def _iso_to_ms(value: str) -> str:
+    return f"CAST(ROUND((julianday({value}) - 2440587.5) * 86400000) AS INTEGER)"
+
+# (таблица, колонки, индексы по этим колонкам) для _epoch_ms_timestamps
+EPOCH_MS_COLUMNS = [
+    ("users", {"created_at": True, "updated_at": True}, {}),
+    ("categories", {"created_at": True, "updated_at": True, "deleted_at": False}, {
+        "idx_categories_updated": "categories(updated_at)",
+        "idx_categories_deleted": "categories(deleted_at)",
+    }),
+    ("transactions", {"date": True, "created_at": True, "updated_at": True, "deleted_at": False}, {
+        "idx_tx_updated": "transactions(updated_at)",
+        "idx_tx_deleted": "transactions(deleted_at)",
+        "idx_tx_user_date": "transactions(user_id, date)",
+    }),
+    ("change_log", {"changed_at": True}, {}),
+]
+
+async def _epoch_ms_timestamps(db: aiosqlite.Connection):
+    """time columns and field_versions: ISO8601 TEXT -> epoch ms INTEGER"""
+    for table, columns, indexes in EPOCH_MS_COLUMNS:
+        # DROP COLUMN не работает с проиндексированной колонкой: индексы пересоздаются в конце
+        for name in indexes:
+            await db.execute(f"DROP INDEX IF EXISTS {name}")
+        for column, not_null in columns.items():
+            await db.execute(
+                f"ALTER TABLE {table} ADD COLUMN {column}_ms INTEGER"
+                + (" NOT NULL DEFAULT 0" if not_null else "")
+            )
+        await db.execute(
+            f"UPDATE {table} SET "
+            + ", ".join(f"{column}_ms = {_iso_to_ms(column)}" for column in columns)
+        )
+        for column in columns:
+            await db.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+            await db.execute(f"ALTER TABLE {table} RENAME COLUMN {column}_ms TO {column}")
+        for name, target in indexes.items():
+            await db.execute(f"CREATE INDEX {name} ON {target}")
+
+    # Версии полей тоже в ms: LWW сравнивает их с updated_at как числа
+    for table in ("categories", "transactions"):
+        await db.execute(
+            f"""UPDATE {table} SET field_versions = (
+                    SELECT json_group_object(key, {_iso_to_ms('value')}) FROM json_each({table}.field_versions)
+                ) WHERE field_versions IS NOT NULL"""
+        )
+
+async def _drop_timestamp_triggers(db: aiosqlite.Connection):
+    """drop update_*_timestamp triggers (updated_at is set by the application)"""
+    # Базы со схемой app/migrations.sql: AFTER UPDATE триггер переписывал строку второй раз
+    for table in ("users", "categories", "transactions"):
+        await db.execute(f"DROP TRIGGER IF EXISTS update_{table}_timestamp")
+
+async def _add_content_hash(db: aiosqlite.Connection):
+    """categories/transactions.content_hash to skip no-op writes"""
+    from .fingerprints import category_hash, transaction_hash
+
+    for table, columns, row_hash in (
+        ("categories", "name, type, color, icon", lambda r: category_hash(*r[1:])),
+        ("transactions", "amount_cents, currency, description, date, category_id",
+         lambda r: transaction_hash(*r[1:])),
+    ):
+        if not await _column_exists(db, table, "content_hash"):
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN content_hash TEXT")
+        last_id = 0
+        while True:
+            cursor = await db.execute(
+                f"SELECT id, {columns} FROM {table} WHERE id > ? AND content_hash IS NULL ORDER BY id LIMIT ?",
+                (last_id, MIGRATION_BATCH_SIZE)
+            )
+            rows = await cursor.fetchall()
+            if not rows:
+                break
+            await db.executemany(
+                f"UPDATE {table} SET content_hash = ? WHERE id = ?",
+                [(row_hash(r), r[0]) for r in rows]
+            )
+            last_id = rows[-1][0]
+
+async def _sha256_hashes(db: aiosqlite.Connection):
+    """fingerprint/content_hash recomputed as truncated sha256 (PostgreSQL has no blake2b)"""
+    from .fingerprints import transaction_fingerprint, category_hash, transaction_hash
+    from .timestamps import from_ms
+
+    await _update_in_batches(db, "categories", "name, type, color, icon", "content_hash = ?",
+                             lambda r: (category_hash(*r[1:]),))
+    await _update_in_batches(
+        db, "transactions", "amount_cents, currency, description, date, category_id, user_id",
+        "content_hash = ?, fingerprint = ?",
+        lambda r: (transaction_hash(*r[1:6]), transaction_fingerprint(r[6], from_ms(r[4]), r[1], r[5], r[3]))
+    )
+
+async def _utc_fingerprints(db: aiosqlite.Connection):
+    """fingerprint day taken in UTC on every write path (inserts used the client's offset)"""
+    from .fingerprints import transaction_fingerprint
+    from .timestamps import from_ms
+
+    await _update_in_batches(
+        db, "transactions", "user_id, date, amount_cents, category_id, description", "fingerprint = ?",
+        lambda r: (transaction_fingerprint(r[1], from_ms(r[2]), r[3], r[4], r[5]),)
+    )
+
+async def _update_in_batches(db: aiosqlite.Connection, table: str, columns: str, assignments: str,
+                             values: Callable[[sqlite3.Row], tuple]):
+    """UPDATE table SET assignments = values(row) for every row, MIGRATION_BATCH_SIZE rows at a time."""
+    last_id = 0
+    while True:
+        cursor = await db.execute(
+            f"SELECT id, {columns} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, MIGRATION_BATCH_SIZE)
+        )
+        rows = await cursor.fetchall()
+        if not rows:
+            break
+        await db.executemany(
+            f"UPDATE {table} SET {assignments} WHERE id = ?",
+            [(*values(r), r[0]) for r in rows]
+        )
+        last_id = rows[-1][0]
+
+MIGRATION_BATCH_SIZE = 1000
+
+# Изменения схемы, которые нельзя выразить через CREATE ... IF NOT EXISTS в migrate.sql
+# (новые колонки, бэкфиллы). Только добавлять в конец: индекс + 1 = user_version.
+MIGRATIONS = [
+    _add_transaction_fingerprint,
+    _drop_import_jobs,
+    _add_field_versions,
+    _backfill_change_log,
+    _add_transaction_currency,
+    _amount_to_cents,
+    _epoch_ms_timestamps,
+    _drop_timestamp_triggers,
+    _add_content_hash,
+    _sha256_hashes,
+    _utc_fingerprints,
+]
+
+async def connect_db(replica: Optional[str] = None) -> aiosqlite.Connection:
+    """Открывает подключение с теми же настройками, что и у запросов (для фоновых задач).
+
+    replica — файл-копия из app/replica.py: открывается только на чтение."""
+    from .fingerprints import SQL_FUNCTIONS
+
+    if POSTGRES:
+        from .postgres import connect
+
+        return await connect()
+
+    if replica is not None:
+        # Копия не меняется на месте (её заменяют целиком), поэтому immutable: без блокировок
+        db = await aiosqlite.connect(f"file:{quote(replica)}?mode=ro&immutable=1", uri=True)
+    else:
+        db = await aiosqlite.connect(DB_PATH, timeout=5)
     db.row_factory = sqlite3.Row
     await db.execute("PRAGMA foreign_keys=ON;")
+    for name, (params, function) in SQL_FUNCTIONS.items():
+        await db.create_function(name, params, function, deterministic=True)
+    return db
+
+async def close_db():
+    """Закрывает пул подключений PostgreSQL при остановке (у SQLite пула нет)."""
+    if POSTGRES:
+        from .postgres import close_pool
+
+        await close_pool()
+
+# Ключ в request.state с общим подключением (его выставляет /api/batch для подзапросов)
+SHARED_DB_STATE = "shared_db"
+# Ключ в request.state с открытым подключением запроса (его переиспользует replica.get_read_db)
+REQUEST_DB_STATE = "request_db"
+
+@asynccontextmanager
+async def request_db(request: Request) -> AsyncIterator[aiosqlite.Connection]:
+    """Подключение запроса к основной базе: общее у подзапросов /api/batch, иначе своё."""
+    shared = getattr(request.state, SHARED_DB_STATE, None)
+    if shared is not None:
+        yield shared
+        return
+    db = await connect_db()
+    # Число SQL-выражений запроса сверяется с QUERY_BUDGETS (app/querybudget.py)
+    statements = await count_statements(db, request.scope)
+    setattr(request.state, REQUEST_DB_STATE, db)
     try:
         yield db
     finally:
+        setattr(request.state, REQUEST_DB_STATE, None)
+        check_budget(request.scope, statements)
         await db.close()
+
+async def get_db(request: Request) -> AsyncIterator[aiosqlite.Connection]:
+    """FastAPI dependency: открывает подключение (SQLite или из пула PostgreSQL) и закрывает после запроса."""
+    async with request_db(request) as db:
+        yield db
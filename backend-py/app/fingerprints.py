@@ -0,0 +1,100 @@
+"""
+Fingerprints for duplicate detection, content hashes for no-op writes.
+
+A fingerprint is a short hash of (user, day, amount, category, description)
+after normalization, so the same purchase entered twice — from two offline
+devices or from a re-imported bank statement — maps to the same value and
+can be found with an indexed point query on (user_id, fingerprint).
+
+A content hash covers the exact stored values of a record's synced columns
+(content_hash column). A write whose hash equals the stored one changes
+nothing and is skipped.
+
+Both are truncated sha256 so that PostgreSQL computes the same values in SQL
+(app/postgres.sql); descriptions are folded with str.lower(), the Python
+counterpart of SQL lower() in a UTF-8 database.
+"""
+from datetime import date, datetime, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Optional, Union
+import hashlib
+import os
+import re
+
+from .models import DuplicateMode
+from .timestamps import from_ms
+
+# What to do when a write produces a fingerprint that already exists
+DUPLICATE_MODE = DuplicateMode(os.getenv("DUPLICATE_MODE", DuplicateMode.ALLOW.value))
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_description(text: str) -> str:
+    return _WHITESPACE.sub(" ", (text or "").strip()).lower()
+
+def _digest(key: bytes) -> str:
+    # 12 байт (24 hex-символа), как и прежний blake2b(digest_size=12)
+    return hashlib.sha256(key).hexdigest()[:24]
+
+def amount_to_cents(amount: Union[Decimal, float, int, str]) -> int:
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def cents_to_amount(cents: int) -> Decimal:
+    """Integer cents from the database -> Decimal with two places for the API."""
+    return Decimal(int(cents)).scaleb(-2)
+
+def day_key(value: Union[date, datetime, str]) -> str:
+    """YYYY-MM-DD of the UTC day: the day SQL derives from the stored epoch ms."""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()[:10]
+    return str(value)[:10]
+
+def transaction_fingerprint(
+    user_id: int,
+    day: Union[date, datetime, str],
+    amount_cents: int,
+    category_id: int,
+    description: str,
+) -> str:
+    key = "|".join((
+        str(user_id),
+        day_key(day),
+        str(amount_cents),
+        str(category_id),
+        normalize_description(description),
+    ))
+    return _digest(key.encode("utf-8"))
+
+def content_hash(*values) -> str:
+    key = "\x1f".join("\x00" if v is None else str(v) for v in values)
+    return _digest(key.encode("utf-8"))
+
+def category_hash(name: str, type: str, color: str, icon: Optional[str]) -> str:
+    return content_hash(name, type, color, icon)
+
+def transaction_hash(amount_cents: int, currency: str, description: str, date_ms: int, category_id: int) -> str:
+    return content_hash(amount_cents, currency, description, date_ms, category_id)
+
+# SQL functions registered on every connection (db.connect_db): a single UPDATE
+# can recompute the hashes from the row's own columns. Dates are epoch ms.
+# PostgreSQL has the same functions in app/postgres.sql.
+SQL_FUNCTIONS = {
+    "category_hash": (4, category_hash),
+    "transaction_hash": (5, transaction_hash),
+    "transaction_fingerprint": (
+        5, lambda user_id, date_ms, amount_cents, category_id, description: transaction_fingerprint(
+            user_id, from_ms(date_ms), amount_cents, category_id, description)
+    ),
+}
+
+async def find_duplicate(db, user_id: int, fingerprint: str, exclude_id: Optional[int] = None):
+    """Oldest transaction with the same fingerprint (index point lookup)."""
+    cursor = await db.execute(
+        """SELECT id, sync_id FROM transactions
+           WHERE user_id = ? AND fingerprint = ? AND id != ?
+           ORDER BY id LIMIT 1""",
+        (user_id, fingerprint, exclude_id or 0)
+    )
+    return await cursor.fetchone()
@@ -0,0 +1,409 @@
+"""
+Bank statement import (CSV / OFX).
+
+The upload is copied to IMPORT_DIR in fixed-size chunks and parsed lazily from
+disk, so memory use does not depend on statement size. Rows are mapped to
+categories by the user's import rules, checked against existing transactions
+through the (user_id, fingerprint) index and inserted IMPORT_BATCH_SIZE rows
+per database transaction. A row is a duplicate when its fingerprint is
+already stored or appeared earlier in the statement: identical lines of one
+file collapse to a single transaction, whatever the batch boundaries. Imports run as "import" jobs (app/jobs.py), so
+progress is available at /api/jobs/{id} and an interrupted import resumes
+after a restart; rows committed before the interruption are then recognized
+as duplicates.
+"""
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, TextIO
+import asyncio
+import csv
+import logging
+import os
+import re
+import uuid
+
+from .db import get_db, DB_PATH
+from .auth import get_current_user
+from .fingerprints import transaction_fingerprint, transaction_hash, amount_to_cents
+from .changes import log_changes, TRANSACTIONS, INSERT
+from .currency import BASE_CURRENCY
+from .timestamps import now_ms, day_ms
+from .locks import user_write_transaction
+from .jobs import job_handler, enqueue, get_user_job, JobContext
+from .models import User, ImportFormat, Job, ImportRule, ImportRuleCreate
+from . import metrics
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+IMPORT_DIR = os.getenv("IMPORT_DIR", str(Path(DB_PATH).parent / "imports"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "2000"))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+# csv.Sniffer очень медленный на больших образцах
+SNIFF_SIZE = 4096
+# Держимся ниже SQLITE_MAX_VARIABLE_NUMBER старых сборок (999)
+SQL_VARS_PER_QUERY = 500
+
+DATE_COLUMNS = ("date", "booking date", "transaction date", "posting date", "дата", "дата операции")
+AMOUNT_COLUMNS = ("amount", "sum", "value", "сумма", "сумма операции")
+DESCRIPTION_COLUMNS = ("description", "memo", "details", "payee", "name", "описание", "назначение платежа")
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%m/%d/%Y", "%Y/%m/%d", "%d.%m.%y")
+
+NO_DESCRIPTION = "(no description)"
+
+class StatementFormatError(ValueError):
+    pass
+
+class StatementRow(NamedTuple):
+    day: str            # YYYY-MM-DD
+    amount: Decimal     # со знаком: < 0 — расход
+    description: str
+
+def parse_amount(raw: str) -> Decimal:
+    text = re.sub(r"[^\d,.\-+()]", "", raw or "")
+    negative = text.startswith("(") and text.endswith(")")
+    text = text.strip("()")
+    if "," in text and "." in text:
+        # Десятичный разделитель — тот, что встречается последним
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+    elif text.count(",") == 1:
+        text = text.replace(",", ".")
+    else:
+        text = text.replace(",", "")
+    value = Decimal(text)
+    return -value if negative else value
+
+def parse_day(raw: str, date_format: Optional[str] = None) -> str:
+    text = (raw or "").strip()
+    if date_format:
+        head, formats = text, (date_format,)
+    else:
+        # Время после даты ("05.01.2024 13:45") не нужно
+        head, formats = re.split(r"[\sT]", text, 1)[0], DATE_FORMATS
+    for fmt in formats:
+        try:
+            return datetime.strptime(head, fmt).date().isoformat()
+        except ValueError:
+            continue
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).date().isoformat()
+    except ValueError:
+        raise ValueError(f"Unrecognized date: {raw!r}")
+
+def _find_column(header: List[str], candidates, override: Optional[str]) -> int:
+    normalized = [h.strip().casefold() for h in header]
+    names = (override.casefold(),) if override else candidates
+    for name in names:
+        if name in normalized:
+            return normalized.index(name)
+    raise StatementFormatError(f"CSV column not found, expected one of: {', '.join(names)}")
+
+def iter_csv(stream: TextIO, options: Dict[str, Optional[str]]) -> Iterator[Optional[StatementRow]]:
+    """Yields a StatementRow per data line, or None for a line that can't be parsed."""
+    sample = stream.read(SNIFF_SIZE)
+    stream.seek(0)
+    if options.get("delimiter"):
+        dialect = csv.excel
+        delimiter = options["delimiter"]
+    else:
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+            delimiter = dialect.delimiter
+        except csv.Error:
+            dialect, delimiter = csv.excel, ","
+
+    reader = csv.reader(stream, dialect, delimiter=delimiter)
+    header = next(reader, None)
+    if not header:
+        raise StatementFormatError("CSV file is empty")
+
+    date_idx = _find_column(header, DATE_COLUMNS, options.get("date_column"))
+    amount_idx = _find_column(header, AMOUNT_COLUMNS, options.get("amount_column"))
+    desc_idx = _find_column(header, DESCRIPTION_COLUMNS, options.get("description_column"))
+
+    for record in reader:
+        if not record or not any(field.strip() for field in record):
+            continue
+        try:
+            yield StatementRow(
+                day=parse_day(record[date_idx], options.get("date_format")),
+                amount=parse_amount(record[amount_idx]),
+                description=record[desc_idx].strip(),
+            )
+        except (IndexError, ValueError, InvalidOperation):
+            yield None
+
+_OFX_TAG = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+
+def _ofx_row(fields: Dict[str, str]) -> Optional[StatementRow]:
+    try:
+        posted = fields["DTPOSTED"]
+        day = f"{posted[0:4]}-{posted[4:6]}-{posted[6:8]}"
+        datetime.strptime(day, "%Y-%m-%d")
+        description = " ".join(
+            dict.fromkeys(v for v in (fields.get("NAME"), fields.get("MEMO")) if v)
+        )
+        return StatementRow(day=day, amount=parse_amount(fields["TRNAMT"]), description=description)
+    except (KeyError, ValueError, InvalidOperation):
+        return None
+
+def iter_ofx(stream: TextIO) -> Iterator[Optional[StatementRow]]:
+    """Streaming OFX reader for both SGML (1.x) and XML (2.x) statements."""
+    buffer = ""
+    current: Optional[Dict[str, str]] = None
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        buffer += chunk
+        # Хвост после последнего '<' может быть неполным тегом — дочитаем его позже
+        cut = buffer.rfind("<") if chunk else len(buffer)
+        if cut <= 0 and chunk:
+            continue
+        for match in _OFX_TAG.finditer(buffer, 0, cut):
+            closing, tag, value = match.group(1), match.group(2).upper(), match.group(3).strip()
+            if tag == "STMTTRN":
+                if current is not None:
+                    yield _ofx_row(current)
+                current = None if closing else {}
+            elif current is not None and not closing and value:
+                current[tag] = value
+        buffer = buffer[cut:]
+        if not chunk:
+            break
+    if current is not None:
+        yield _ofx_row(current)
+
+def _take(rows: Iterator[Optional[StatementRow]], size: int) -> List[Optional[StatementRow]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            break
+    return batch
+
+async def load_rules(db, user_id: int) -> List[tuple]:
+    cursor = await db.execute(
+        "SELECT pattern, category_id FROM import_rules WHERE user_id = ? ORDER BY priority DESC, id",
+        (user_id,)
+    )
+    return [(row["pattern"].casefold(), row["category_id"]) for row in await cursor.fetchall()]
+
+def categorize(row: StatementRow, rules: List[tuple],
+               expense_category_id: Optional[int], income_category_id: Optional[int]) -> Optional[int]:
+    description = row.description.casefold()
+    for pattern, category_id in rules:
+        if pattern in description:
+            return category_id
+    return expense_category_id if row.amount < 0 else income_category_id
+
+async def existing_fingerprints(db, user_id: int, fingerprints: List[str]) -> set:
+    found = set()
+    unique = list(set(fingerprints))
+    for start in range(0, len(unique), SQL_VARS_PER_QUERY):
+        chunk = unique[start:start + SQL_VARS_PER_QUERY]
+        cursor = await db.execute(
+            f"""SELECT fingerprint FROM transactions
+                WHERE user_id = ? AND fingerprint IN ({','.join('?' * len(chunk))})""",
+            [user_id, *chunk]
+        )
+        found.update(row["fingerprint"] for row in await cursor.fetchall())
+    return found
+
+@job_handler("import")
+async def run_import(ctx: JobContext, payload: dict) -> dict:
+    """Parses the spooled statement and ingests it batch by batch."""
+    db, user_id = ctx.db, ctx.user_id
+    path = Path(payload["path"])
+    fmt = ImportFormat(payload["format"])
+    options = payload["options"]
+    counts = {"rows_read": 0, "rows_imported": 0, "rows_duplicate": 0, "rows_skipped": 0}
+    started = datetime.utcnow()
+    try:
+        rules = await load_rules(db, user_id)
+        size = path.stat().st_size or 1
+
+        with open(path, encoding="utf-8-sig", errors="replace", newline="") as stream:
+            rows = iter_csv(stream, options) if fmt == ImportFormat.CSV else iter_ofx(stream)
+            while True:
+                batch = await asyncio.to_thread(_take, rows, IMPORT_BATCH_SIZE)
+                if not batch:
+                    break
+                counts["rows_read"] += len(batch)
+
+                now = now_ms()
+                prepared = []
+                for row in batch:
+                    category_id = categorize(row, rules, options["expense_category_id"],
+                                             options["income_category_id"]) if row else None
+                    if row is None or category_id is None or row.amount == 0:
+                        counts["rows_skipped"] += 1
+                        continue
+                    amount_cents = amount_to_cents(abs(row.amount))
+                    description = row.description or NO_DESCRIPTION
+                    fingerprint = transaction_fingerprint(user_id, row.day, amount_cents, category_id, description)
+                    day = day_ms(date.fromisoformat(row.day))
+                    prepared.append((user_id, category_id, amount_cents, BASE_CURRENCY, description, day,
+                                     str(uuid.uuid4()), now, now,
+                                     transaction_hash(amount_cents, BASE_CURRENCY, description, day, category_id),
+                                     fingerprint))
+
+                # Пачка пишется под тем же замком, что и sync этого пользователя
+                async with user_write_transaction(db, user_id):
+                    # Ранние пачки уже в базе; внутри пачки повтор отсекается так же
+                    seen = await existing_fingerprints(db, user_id, [p[-1] for p in prepared])
+                    fresh = []
+                    for p in prepared:
+                        if p[-1] not in seen:
+                            seen.add(p[-1])
+                            fresh.append(p)
+                    counts["rows_duplicate"] += len(prepared) - len(fresh)
+                    counts["rows_imported"] += len(fresh)
+
+                    await db.executemany(
+                        """INSERT INTO transactions (user_id, category_id, amount_cents, currency, description,
+                                                     date, sync_id, created_at, updated_at, content_hash, fingerprint)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                        fresh
+                    )
+                    await log_changes(db, user_id, TRANSACTIONS, [p[6] for p in fresh], INSERT)
+                    # progress() коммитит вставку вместе с прогрессом
+                    await ctx.progress(stream.buffer.tell() / size, **counts)
+    except Exception:
+        if ctx.final_attempt:
+            path.unlink(missing_ok=True)
+        raise
+
+    path.unlink(missing_ok=True)
+    elapsed = (datetime.utcnow() - started).total_seconds()
+    metrics.inc("import.rows_imported", counts["rows_imported"])
+    logger.info(f"📥 Import {ctx.id} for user {user_id}: {counts} in {elapsed:.2f}s")
+    return counts
+
+async def _spool_upload(upload: UploadFile, path: Path) -> int:
+    size = 0
+    with open(path, "wb") as out:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > IMPORT_MAX_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Statement is larger than {IMPORT_MAX_BYTES} bytes"
+                )
+            out.write(chunk)
+    return size
+
+async def _check_category(db, user_id: int, category_id: Optional[int]):
+    if category_id is None:
+        return
+    cursor = await db.execute(
+        "SELECT id FROM categories WHERE id = ? AND user_id = ?",
+        (category_id, user_id)
+    )
+    if not await cursor.fetchone():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Category not found or doesn't belong to user"
+        )
+
+@router.post("/", response_model=Job, status_code=status.HTTP_202_ACCEPTED)
+async def import_statement(
+    file: UploadFile = File(...),
+    format: Optional[ImportFormat] = Form(None),
+    expense_category_id: Optional[int] = Form(None),
+    income_category_id: Optional[int] = Form(None),
+    delimiter: Optional[str] = Form(None),
+    date_column: Optional[str] = Form(None),
+    amount_column: Optional[str] = Form(None),
+    description_column: Optional[str] = Form(None),
+    date_format: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    if format is None:
+        suffix = Path(file.filename or "").suffix.lower()
+        format = ImportFormat.OFX if suffix in (".ofx", ".qfx") else ImportFormat.CSV
+
+    await _check_category(db, current_user.id, expense_category_id)
+    await _check_category(db, current_user.id, income_category_id)
+
+    Path(IMPORT_DIR).mkdir(parents=True, exist_ok=True)
+    path = Path(IMPORT_DIR) / f"{uuid.uuid4()}.{format.value}"
+    try:
+        await _spool_upload(file, path)
+    except Exception:
+        path.unlink(missing_ok=True)
+        raise
+
+    options = {
+        "expense_category_id": expense_category_id,
+        "income_category_id": income_category_id,
+        "delimiter": delimiter,
+        "date_column": date_column,
+        "amount_column": amount_column,
+        "description_column": description_column,
+        "date_format": date_format,
+    }
+    job_id = await enqueue(db, current_user.id, "import", {
+        "path": str(path),
+        "format": format.value,
+        "filename": file.filename,
+        "options": options,
+    })
+    await db.commit()
+
+    return await get_user_job(db, current_user.id, job_id)
+
+@router.get("/rules", response_model=List[ImportRule])
+async def get_rules(current_user: User = Depends(get_current_user), db = Depends(get_db)):
+    cursor = await db.execute(
+        """SELECT id, user_id, pattern, category_id, priority, created_at, updated_at
+           FROM import_rules WHERE user_id = ? ORDER BY priority DESC, id""",
+        (current_user.id,)
+    )
+    return [ImportRule(**dict(row)) for row in await cursor.fetchall()]
+
+@router.post("/rules", response_model=ImportRule)
+async def create_rule(
+    rule: ImportRuleCreate,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    await _check_category(db, current_user.id, rule.category_id)
+    now = datetime.utcnow().isoformat()
+    cursor = await db.execute(
+        """INSERT INTO import_rules (user_id, pattern, category_id, priority, created_at, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?)
+           RETURNING id, user_id, pattern, category_id, priority, created_at, updated_at""",
+        (current_user.id, rule.pattern.strip(), rule.category_id, rule.priority, now, now)
+    )
+    row = await cursor.fetchone()
+    await db.commit()
+    return ImportRule(**dict(row))
+
+@router.delete("/rules/{rule_id}")
+async def delete_rule(
+    rule_id: int,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    cursor = await db.execute(
+        "DELETE FROM import_rules WHERE id = ? AND user_id = ?",
+        (rule_id, current_user.id)
+    )
+    await db.commit()
+    if cursor.rowcount == 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Import rule not found"
+        )
+    return {"message": "Import rule deleted successfully"}
@@ -0,0 +1,287 @@
+"""
+Persistent background jobs.
+
+Jobs live in the `jobs` table, so queued and interrupted work survives a
+service restart. Each uvicorn worker runs JOB_WORKERS coroutines that claim
+jobs atomically (BEGIN IMMEDIATE + UPDATE ... RETURNING), highest priority
+first, while no user has more than JOB_USER_CONCURRENCY jobs running.
+A running job holds a lease that is renewed while it works; when a process
+dies the lease expires and another worker picks the job up again. Failed jobs
+are retried with exponential backoff up to max_attempts.
+
+Handlers are registered with @job_handler("kind") and receive a JobContext
+with their own database connection and a progress() reporter.
+"""
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+
+from .db import get_db, connect_db
+from .auth import get_current_user
+from .models import User, Job
+from . import metrics
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_USER_CONCURRENCY = int(os.getenv("JOB_USER_CONCURRENCY", "1"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+JOB_COLUMNS = """id, kind, priority, status, progress, progress_info, result, error,
+                 attempts, max_attempts, created_at, started_at, finished_at, updated_at"""
+
+_handlers: Dict[str, Callable[["JobContext", dict], Awaitable[Optional[dict]]]] = {}
+_wakeup = asyncio.Event()
+_workers: List[asyncio.Task] = []
+
+def _now(offset_seconds: float = 0) -> str:
+    return (datetime.utcnow() + timedelta(seconds=offset_seconds)).isoformat(timespec="milliseconds")
+
+def job_handler(kind: str):
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+class JobContext:
+    def __init__(self, db, row):
+        self.db = db
+        self.id = row["id"]
+        self.user_id = row["user_id"]
+        self.attempt = row["attempts"]
+        self.final_attempt = row["attempts"] >= row["max_attempts"]
+
+    async def progress(self, fraction: float, **info):
+        """Store progress (0..1 plus arbitrary counters) and renew the lease."""
+        await self.db.execute(
+            """UPDATE jobs SET progress = ?, progress_info = ?, locked_until = ?, updated_at = ?
+               WHERE id = ? AND locked_by = ?""",
+            (min(max(fraction, 0.0), 1.0), json.dumps(info), _now(JOB_LEASE_SECONDS), _now(),
+             self.id, WORKER_ID)
+        )
+        await self.db.commit()
+
+async def enqueue(db, user_id: int, kind: str, payload: dict,
+                  priority: int = 0, max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+    """Insert a queued job. The caller commits; workers of this process are woken up."""
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job_id = str(uuid.uuid4())
+    now = _now()
+    await db.execute(
+        """INSERT INTO jobs (id, user_id, kind, priority, status, payload, max_attempts,
+                             run_after, created_at, updated_at)
+           VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)""",
+        (job_id, user_id, kind, priority, json.dumps(payload), max_attempts, now, now, now)
+    )
+    _wakeup.set()
+    metrics.inc(f"jobs.enqueued.{kind}")
+    return job_id
+
+async def _requeue_expired(db):
+    """Jobs whose worker stopped renewing the lease go back to the queue."""
+    cursor = await db.execute(
+        """UPDATE jobs SET status = 'queued', locked_by = NULL, locked_until = NULL, updated_at = ?
+           WHERE status = 'running' AND locked_until < ?""",
+        (_now(), _now())
+    )
+    if cursor.rowcount:
+        logger.warning(f"⚠️  Requeued {cursor.rowcount} job(s) with expired leases")
+
+async def _claim(db):
+    kinds = list(_handlers)
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        await _requeue_expired(db)
+        now = _now()
+        # status проверяется и снаружи: в PostgreSQL воркеры разных процессов
+        # могут выбрать один id, выигрывает первый UPDATE
+        cursor = await db.execute(
+            f"""UPDATE jobs
+                SET status = 'running', attempts = attempts + 1, locked_by = ?, locked_until = ?,
+                    started_at = COALESCE(started_at, ?), updated_at = ?
+                WHERE id = (
+                    SELECT j.id FROM jobs j
+                    WHERE j.status = 'queued' AND j.run_after <= ?
+                      AND j.kind IN ({','.join('?' * len(kinds))})
+                      AND (SELECT COUNT(*) FROM jobs r
+                           WHERE r.user_id = j.user_id AND r.status = 'running') < ?
+                    ORDER BY j.priority DESC, j.run_after, j.created_at
+                    LIMIT 1)
+                  AND status = 'queued'
+                RETURNING id, user_id, kind, payload, attempts, max_attempts""",
+            (WORKER_ID, _now(JOB_LEASE_SECONDS), now, now, now, *kinds, JOB_USER_CONCURRENCY)
+        )
+        row = await cursor.fetchone()
+        await db.commit()
+        return row
+    except Exception:
+        await db.rollback()
+        raise
+
+async def _keep_lease(db, job_id: str):
+    # Продление раз в треть аренды: одна неудача (database is locked) ещё не отдаёт
+    # задачу другому воркеру, следующая попытка будет до истечения locked_until
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            await db.execute(
+                "UPDATE jobs SET locked_until = ? WHERE id = ? AND locked_by = ?",
+                (_now(JOB_LEASE_SECONDS), job_id, WORKER_ID)
+            )
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            metrics.inc("jobs.lease_errors")
+            logger.warning(f"⚠️  Job {job_id}: lease renewal failed, retrying: {e}")
+
+async def _finish(db, job_id: str, **fields):
+    fields["updated_at"] = _now()
+    fields["locked_by"] = None
+    fields["locked_until"] = None
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    await db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id])
+    await db.commit()
+
+async def _run(row):
+    kind = row["kind"]
+    db = await connect_db()
+    lease_db = await connect_db()
+    lease = asyncio.create_task(_keep_lease(lease_db, row["id"]))
+    started = asyncio.get_running_loop().time()
+    try:
+        ctx = JobContext(db, row)
+        result = await _handlers[kind](ctx, json.loads(row["payload"]))
+        await _finish(db, row["id"], status="done", progress=1.0, finished_at=_now(),
+                      result=json.dumps(result) if result is not None else None, error=None)
+        metrics.inc(f"jobs.done.{kind}")
+        logger.info(f"✅ Job {row['id']} ({kind}) done")
+    except asyncio.CancelledError:
+        # Shutdown: hand the job back without spending an attempt
+        await db.rollback()
+        await _finish(db, row["id"], status="queued", attempts=row["attempts"] - 1)
+        raise
+    except Exception as e:
+        await db.rollback()
+        if row["attempts"] < row["max_attempts"]:
+            delay = JOB_RETRY_BASE_SECONDS * 2 ** (row["attempts"] - 1)
+            await _finish(db, row["id"], status="queued", run_after=_now(delay), error=str(e))
+            logger.warning(f"⚠️  Job {row['id']} ({kind}) failed, retry in {delay:.0f}s: {e}")
+        else:
+            await _finish(db, row["id"], status="failed", finished_at=_now(), error=str(e))
+            metrics.inc(f"jobs.failed.{kind}")
+            logger.error(f"❌ Job {row['id']} ({kind}) failed: {e}")
+    finally:
+        lease.cancel()
+        metrics.observe(f"jobs.duration.{kind}", asyncio.get_running_loop().time() - started)
+        await lease_db.close()
+        await db.close()
+
+async def _worker(number: int):
+    db = await connect_db()
+    try:
+        while True:
+            try:
+                row = await _claim(db)
+            except Exception as e:
+                logger.error(f"❌ Job worker {number} could not claim: {e}")
+                row = None
+            if row is None:
+                _wakeup.clear()
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await _run(row)
+            except Exception as e:
+                # _finish не записал итог (например, database is locked): задачу вернёт
+                # истёкшая аренда, а воркер продолжает работать
+                metrics.inc("jobs.worker_errors")
+                logger.error(f"❌ Job worker {number}: job {row['id']} not finished: {e}")
+    finally:
+        await db.close()
+
+def start_workers():
+    for number in range(JOB_WORKERS):
+        _workers.append(asyncio.create_task(_worker(number)))
+    logger.info(f"⚙️  Started {JOB_WORKERS} job worker(s) as {WORKER_ID}")
+
+async def stop_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+def job_from_row(row) -> Job:
+    data = dict(row)
+    data["progress_info"] = json.loads(data["progress_info"]) if data["progress_info"] else {}
+    data["result"] = json.loads(data["result"]) if data["result"] else None
+    return Job(**data)
+
+async def get_user_job(db, user_id: int, job_id: str) -> Job:
+    cursor = await db.execute(
+        f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ? AND user_id = ?",
+        (job_id, user_id)
+    )
+    row = await cursor.fetchone()
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    return job_from_row(row)
+
+@router.get("/", response_model=List[Job])
+async def get_jobs(
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(50, ge=1, le=500),
+    db = Depends(get_db)
+):
+    cursor = await db.execute(
+        f"""SELECT {JOB_COLUMNS} FROM jobs WHERE user_id = ?
+            ORDER BY created_at DESC LIMIT ?""",
+        (current_user.id, limit)
+    )
+    return [job_from_row(row) for row in await cursor.fetchall()]
+
+@router.get("/{job_id}", response_model=Job)
+async def get_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    return await get_user_job(db, current_user.id, job_id)
+
+@router.post("/{job_id}/cancel", response_model=Job)
+async def cancel_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    cursor = await db.execute(
+        """UPDATE jobs SET status = 'cancelled', finished_at = ?, updated_at = ?
+           WHERE id = ? AND user_id = ? AND status = 'queued'""",
+        (_now(), _now(), job_id, current_user.id)
+    )
+    await db.commit()
+    job = await get_user_job(db, current_user.id, job_id)
+    if cursor.rowcount == 0:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Job is {job.status}, only queued jobs can be cancelled"
+        )
+    return job
@@ -0,0 +1,131 @@
+"""
+Incremental parsing of large JSON request bodies.
+
+A sync push is one JSON object whose big members are arrays of records.
+Instead of `await request.json()` (raw body + JSON tree + models in memory at
+once, nothing written before the last byte arrives) the body is read chunk
+by chunk; each array element is decoded with JSONDecoder.raw_decode as soon
+as it is complete, validated, and handed out in batches of `batch_size`.
+Memory holds one network chunk plus one batch, and the caller writes a batch
+while the rest of the body is still uploading.
+
+Batches come in body order. A caller whose records reference each other
+across arrays (transactions -> categories) retries the records whose parent
+had not arrived yet once the body is done.
+"""
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+import codecs
+import json
+
+WHITESPACE = " \t\n\r"
+
+_decoder = json.JSONDecoder()
+
+class JsonStreamError(ValueError):
+    """The body is not a JSON object of the expected shape."""
+
+class _Reader:
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self.chunks = chunks.__aiter__()
+        self.text = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    async def fill(self) -> bool:
+        """Append the next chunk (dropping what is consumed); False at the end of the body."""
+        if self.eof:
+            return False
+        try:
+            chunk = await self.chunks.__anext__()
+            more = self.text.decode(chunk)
+        except StopAsyncIteration:
+            self.eof = True
+            more = self.text.decode(b"", final=True)
+        except UnicodeDecodeError as e:
+            raise JsonStreamError(f"Body is not UTF-8: {e}") from e
+        self.buf = self.buf[self.pos:] + more
+        self.pos = 0
+        return True
+
+    async def peek(self) -> str:
+        """Next non-whitespace character, '' at the end of the body."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not await self.fill():
+                return ""
+
+    async def expect(self, chars: str) -> str:
+        char = await self.peek()
+        if not char or char not in chars:
+            raise JsonStreamError(f"Expected one of {chars!r} at offset {self.pos}, got {char or 'end of body'!r}")
+        self.pos += 1
+        return char
+
+    async def value(self) -> Any:
+        await self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # Число в самом конце буфера может продолжиться в следующем куске
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise JsonStreamError(str(e)) from e
+            await self.fill()
+
+async def stream_sections(
+    chunks: AsyncIterator[bytes],
+    sections: Dict[str, Callable[[Any], Any]],
+    batch_size: int,
+    fields: Optional[Dict[str, Any]] = None,
+    parse_field: Optional[Callable[[str, Any], Any]] = None,
+) -> AsyncIterator[Tuple[str, List[Any]]]:
+    """Yield (section, batch) for the top-level arrays named in `sections`.
+
+    Each element is passed through its section's callable (model validation)
+    as soon as it is read. Other top-level members go into `fields`, through
+    `parse_field(key, value)` when given: an invalid member fails before the
+    batches that follow it are handed out.
+    """
+    reader = _Reader(chunks)
+    await reader.expect("{")
+    if await reader.peek() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            key = await reader.value()
+            if not isinstance(key, str):
+                raise JsonStreamError("Object keys must be strings")
+            await reader.expect(":")
+            if key in sections and await reader.peek() == "[":
+                reader.pos += 1
+                parse = sections[key]
+                batch: List[Any] = []
+                if await reader.peek() == "]":
+                    reader.pos += 1
+                else:
+                    while True:
+                        batch.append(parse(await reader.value()))
+                        if len(batch) >= batch_size:
+                            yield key, batch
+                            batch = []
+                        if await reader.expect(",]") == "]":
+                            break
+                if batch:
+                    yield key, batch
+            else:
+                value = await reader.value()
+                if parse_field is not None:
+                    value = parse_field(key, value)
+                if fields is not None:
+                    fields[key] = value
+            if await reader.expect(",}") == "}":
+                break
+    if await reader.peek():
+        raise JsonStreamError("Unexpected data after the JSON object")
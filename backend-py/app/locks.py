@@ -0,0 +1,100 @@
+"""
+Per-user write serialization.
+
+Two devices of the same user syncing at once used to race inside SQLite:
+both transactions started deferred, read, and then fought over the write
+lock until one hit the busy timeout. Writers of one user now queue before
+touching the database:
+
+1. an asyncio.Lock per user inside the worker process, so coroutines wait
+   without holding threads or connections;
+2. an advisory flock() on a lock file shared by all uvicorn workers (users
+   are hashed onto LOCK_STRIPES files). The kernel queues the waiters and
+   releases the lock if the process dies.
+
+Inside the lock callers open their transaction with BEGIN IMMEDIATE, so the
+SQLite write lock is taken up front instead of being upgraded mid-way.
+Wait times go to the `locks.user_write.wait` metric.
+
+On PostgreSQL the flock only queues the workers of one host; the
+transaction of user_write_transaction also takes pg_advisory_xact_lock(user
+id), which serializes the user's writers across hosts until commit.
+"""
+from contextlib import asynccontextmanager
+from pathlib import Path
+import asyncio
+import fcntl
+import os
+import time
+import weakref
+
+from .db import DB_PATH
+from .storage import POSTGRES
+from . import metrics
+
+LOCK_DIR = os.getenv("LOCK_DIR", str(Path(DB_PATH).parent / "locks"))
+LOCK_STRIPES = int(os.getenv("LOCK_STRIPES", "256"))
+
+# Locks live while someone holds or waits for them
+_user_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def _lock_path(user_id: int) -> Path:
+    return Path(LOCK_DIR) / f"user-{user_id % LOCK_STRIPES}.lock"
+
+async def _flock(fd: int):
+    """Exclusive flock on fd; on failure or cancellation fd is closed."""
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return
+    except BlockingIOError:
+        pass
+    except BaseException:
+        os.close(fd)
+        raise
+    # Blocking wait in a thread: the kernel wakes us, no polling
+    waiter = asyncio.ensure_future(asyncio.to_thread(fcntl.flock, fd, fcntl.LOCK_EX))
+    try:
+        await asyncio.shield(waiter)
+    except asyncio.CancelledError:
+        # The thread still gets the lock eventually; closing the file releases it
+        waiter.add_done_callback(lambda _: os.close(fd))
+        raise
+    except BaseException:
+        os.close(fd)
+        raise
+
+@asynccontextmanager
+async def user_write_lock(user_id: int):
+    """Serialize writers of one user across coroutines and worker processes."""
+    lock = _user_locks.get(user_id)
+    if lock is None:
+        lock = _user_locks[user_id] = asyncio.Lock()
+
+    started = time.perf_counter()
+    async with lock:
+        path = _lock_path(user_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        await _flock(fd)
+        waited = time.perf_counter() - started
+        metrics.observe("locks.user_write.wait", waited)
+        if waited > 0.001:
+            metrics.inc("locks.user_write.contended")
+        try:
+            yield
+        finally:
+            os.close(fd)
+
+@asynccontextmanager
+async def user_write_transaction(db, user_id: int):
+    """user_write_lock plus BEGIN IMMEDIATE on `db`: commits on exit, rolls back on error."""
+    async with user_write_lock(user_id):
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            if POSTGRES:
+                await db.execute("SELECT pg_advisory_xact_lock(?)", (user_id,))
+            yield
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
@@ -4,15 +4,24 @@ from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer
 from contextlib import asynccontextmanager
 import uvicorn
+import asyncio
 import os
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 
-from .db import init_db, get_db
+from .db import init_db, close_db, get_db
 from .auth import router as auth_router, get_current_user
 from .categories import router as categories_router
 from .transactions import router as transactions_router
+from .recurring import router as recurring_router
+from .reports import router as reports_router
 from .sync import router as sync_router
+from .importer import router as import_router
+from .batch import router as batch_router
+from .jobs import router as jobs_router, start_workers, stop_workers
+from .backup import router as backup_router, backup_scheduler, BACKUP_INTERVAL_HOURS
+from .replica import replica_refresher, REPLICA_INTERVAL_SECONDS
+from .metrics import router as metrics_router
 from .models import User
 
 # Configure logging
@@ -28,9 +37,19 @@ async def lifespan(app: FastAPI):
     logger.info("🚀 Starting Budget PWA Backend...")
     await init_db()
     logger.info("✅ Database initialized")
+    start_workers()
+    background = []
+    if BACKUP_INTERVAL_HOURS > 0:
+        background.append(asyncio.create_task(backup_scheduler()))
+    if REPLICA_INTERVAL_SECONDS > 0:
+        background.append(asyncio.create_task(replica_refresher()))
     yield
     # Shutdown
     logger.info("🛑 Shutting down Budget PWA Backend...")
+    for task in background:
+        task.cancel()
+    await stop_workers()
+    await close_db()
 
 # Create FastAPI app
 app = FastAPI(
@@ -61,22 +80,28 @@ security = HTTPBearer()
 app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(categories_router, prefix="/api/categories", tags=["Categories"])
 app.include_router(transactions_router, prefix="/api/transactions", tags=["Transactions"])
+app.include_router(recurring_router, prefix="/api/recurring", tags=["Recurring"])
+app.include_router(reports_router, prefix="/api/reports", tags=["Reports"])
 app.include_router(sync_router, prefix="/api/sync", tags=["Sync"])
+app.include_router(import_router, prefix="/api/import", tags=["Import"])
+app.include_router(jobs_router, prefix="/api/jobs", tags=["Jobs"])
+app.include_router(batch_router, prefix="/api/batch", tags=["Batch"])
+app.include_router(backup_router, prefix="/api/admin/backups", tags=["Admin"])
+app.include_router(metrics_router, prefix="/api/metrics", tags=["Admin"])
 
 @app.get("/")
 async def root():
     return {
         "message": "Budget PWA API",
         "version": "1.0.0",
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
         "status": "running"
     }
 
 @app.get("/api/health")
-async def health():
+async def health(db = Depends(get_db)):
     try:
         # Test database connection
-        db = await get_db()
         await db.execute("SELECT 1")
         db_status = "healthy"
     except Exception as e:
@@ -85,7 +110,7 @@ async def health():
         
     return {
         "status": "healthy" if db_status == "healthy" else "unhealthy",
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
         "version": "1.0.0",
         "services": {
             "database": db_status,
@@ -109,7 +134,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
         status_code=exc.status_code,
         content={
             "error": exc.detail,
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
             "path": str(request.url)
         }
     )
@@ -121,7 +146,7 @@ async def general_exception_handler(request: Request, exc: Exception):
         status_code=500,
         content={
             "error": "Internal server error",
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
             "path": str(request.url)
         }
     )
@@ -0,0 +1,57 @@
+from fastapi import APIRouter, Depends
+from contextlib import contextmanager
+from typing import Dict
+import threading
+import time
+
+from .auth import get_admin_user
+from .models import User
+
+router = APIRouter()
+
+# In-process metrics registry. Values are per worker process; with several
+# uvicorn workers each one reports its own numbers.
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, float] = {}
+_timings: Dict[str, dict] = {}
+
+def inc(name: str, value: float = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def set_gauge(name: str, value: float):
+    with _lock:
+        _gauges[name] = value
+
+def observe(name: str, seconds: float):
+    """Record a duration sample (count / total / max / last)."""
+    with _lock:
+        t = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+        t["count"] += 1
+        t["total"] += seconds
+        t["max"] = max(t["max"], seconds)
+        t["last"] = seconds
+
+@contextmanager
+def timed(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+def snapshot() -> dict:
+    with _lock:
+        timings = {}
+        for name, t in _timings.items():
+            timings[name] = dict(t, avg=t["total"] / t["count"] if t["count"] else 0.0)
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": timings,
+        }
+
+@router.get("/")
+async def get_metrics(admin: User = Depends(get_admin_user)):
+    return snapshot()
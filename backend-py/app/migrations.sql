@@ -53,24 +53,8 @@ CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date);
 CREATE INDEX IF NOT EXISTS idx_transactions_sync_id ON transactions(sync_id);
 CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions(user_id, date);
 
--- Triggers for automatic timestamp updates
-CREATE TRIGGER IF NOT EXISTS update_users_timestamp 
-AFTER UPDATE ON users FOR EACH ROW
-BEGIN
-    UPDATE users SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
-END;
-
-CREATE TRIGGER IF NOT EXISTS update_categories_timestamp 
-AFTER UPDATE ON categories FOR EACH ROW
-BEGIN
-    UPDATE categories SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
-END;
-
-CREATE TRIGGER IF NOT EXISTS update_transactions_timestamp 
-AFTER UPDATE ON transactions FOR EACH ROW
-BEGIN
-    UPDATE transactions SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
-END;
+-- updated_at is set by the application on every write (no AFTER UPDATE triggers:
+-- each one rewrote the row a second time)
 
 -- Insert default categories for new users (this will be handled by application logic)
 -- We don't do automatic inserts here to keep the schema clean
\ No newline at end of file
@@ -1,9 +1,17 @@
-from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List
-from datetime import datetime
+from pydantic import AfterValidator, BaseModel, EmailStr, Field
+from typing import Annotated, Optional, List, Literal, Any, Dict
+from datetime import date, datetime, timezone
 from decimal import Decimal
 from enum import Enum
 
+from .currency import BASE_CURRENCY
+
+# Время в API всегда с зоной: наивное (из клиента или из TEXT-колонок jobs) считается UTC,
+# поэтому ответы сериализуются с Z / +00:00
+UtcDatetime = Annotated[datetime, AfterValidator(
+    lambda value: value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+)]
+
 class UserBase(BaseModel):
     email: EmailStr
 
@@ -16,8 +24,8 @@ class UserLogin(BaseModel):
 
 class User(UserBase):
     id: int
-    created_at: datetime
-    updated_at: datetime
+    created_at: UtcDatetime
+    updated_at: UtcDatetime
     
     class Config:
         from_attributes = True
@@ -49,8 +57,8 @@ class CategoryUpdate(BaseModel):
 class Category(CategoryBase):
     id: int
     user_id: int
-    created_at: datetime
-    updated_at: datetime
+    created_at: UtcDatetime
+    updated_at: UtcDatetime
     sync_id: str
     
     class Config:
@@ -59,8 +67,9 @@ class Category(CategoryBase):
 class TransactionBase(BaseModel):
     amount: Decimal = Field(..., gt=0, decimal_places=2)
     description: str = Field(..., min_length=1, max_length=500)
-    date: datetime
+    date: UtcDatetime
     category_id: int
+    currency: str = Field(BASE_CURRENCY, pattern=r"^[A-Z]{3}$")
 
 class TransactionCreate(TransactionBase):
     pass
@@ -68,41 +77,190 @@ class TransactionCreate(TransactionBase):
 class TransactionUpdate(BaseModel):
     amount: Optional[Decimal] = Field(None, gt=0, decimal_places=2)
     description: Optional[str] = Field(None, min_length=1, max_length=500)
-    date: Optional[datetime] = None
+    date: Optional[UtcDatetime] = None
     category_id: Optional[int] = None
+    currency: Optional[str] = Field(None, pattern=r"^[A-Z]{3}$")
 
 class Transaction(TransactionBase):
     id: int
     user_id: int
-    created_at: datetime
-    updated_at: datetime
+    created_at: UtcDatetime
+    updated_at: UtcDatetime
     sync_id: str
     category: Optional[Category] = None
     
     class Config:
         from_attributes = True
 
+class DuplicateMode(str, Enum):
+    ALLOW = "allow"      # сохранить как есть
+    REJECT = "reject"    # отклонить дубликат
+    MERGE = "merge"      # вернуть уже существующую запись
+
+class DuplicateGroup(BaseModel):
+    fingerprint: str
+    count: int
+    transactions: List[Transaction]
+
 class SyncData(BaseModel):
     categories: List[Category] = []
     transactions: List[Transaction] = []
-    last_sync: Optional[datetime] = None
+    last_sync: Optional[UtcDatetime] = None
+
+class RecordPatch(BaseModel):
+    """Changed fields of one record. Categories: name, type, color, icon;
+    transactions: amount, description, date, category_sync_id."""
+    sync_id: str
+    updated_at: UtcDatetime                                 # время изменения всех полей патча
+    fields: Dict[str, Any]
+    field_updated_at: Dict[str, UtcDatetime] = {}           # если у поля своё время изменения
+    created_at: Optional[UtcDatetime] = None                # в ответе: запись новая с since_seq
+    deleted: bool = False                                # в ответе: запись удалена
 
 class SyncRequest(BaseModel):
-    last_sync: Optional[datetime] = None
+    # Параметры идут до массивов: неверный параметр отклоняется (422) до первой записи
+    last_sync: Optional[UtcDatetime] = None
+    # ответ с патчами (изменения после since_seq) вместо полных списков
+    delta: bool = False
+    since_seq: Optional[int] = None                      # seq из прошлого ответа
     categories: List[Category] = []
     transactions: List[Transaction] = []
+    category_patches: List[RecordPatch] = []
+    transaction_patches: List[RecordPatch] = []
 
 class SyncResponse(BaseModel):
     categories: List[Category]
     transactions: List[Transaction]
+    category_patches: List[RecordPatch] = []
+    transaction_patches: List[RecordPatch] = []
     conflicts: List[dict] = []
-    last_sync: datetime
+    last_sync: UtcDatetime
+    seq: int = 0                                         # последний seq из change_log
+    written: int = 0                                     # записи push, изменившие строку
+    skipped: int = 0                                     # записи push без изменений
 
 class StatsResponse(BaseModel):
+    currency: str                                        # валюта всех сумм ответа
     total_income: Decimal
     total_expense: Decimal
     balance: Decimal
     categories_stats: List[dict]
     monthly_stats: List[dict]
-    period_start: datetime
-    period_end: datetime
+    period_start: UtcDatetime
+    period_end: UtcDatetime
+
+class ReportsResponse(BaseModel):
+    period_start: UtcDatetime
+    period_end: UtcDatetime
+    type: CategoryType                                   # для rolling/top/weekday
+    currency: str                                        # валюта всех сумм ответа
+    monthly: Optional[List[dict]] = None
+    rolling: Optional[List[dict]] = None
+    top: Optional[List[dict]] = None
+    weekday: Optional[List[dict]] = None
+
+class ImportFormat(str, Enum):
+    CSV = "csv"
+    OFX = "ofx"
+
+class ImportRuleCreate(BaseModel):
+    pattern: str = Field(..., min_length=1, max_length=200)
+    category_id: int
+    priority: int = 0
+
+class ImportRule(ImportRuleCreate):
+    id: int
+    user_id: int
+    created_at: UtcDatetime
+    updated_at: UtcDatetime
+
+class RecurringFrequency(str, Enum):
+    DAILY = "daily"
+    WEEKLY = "weekly"
+    MONTHLY = "monthly"      # 31-е число в коротких месяцах — последний день месяца
+    YEARLY = "yearly"
+
+class RecurringCreate(BaseModel):
+    amount: Decimal = Field(..., gt=0, decimal_places=2)
+    description: str = Field(..., min_length=1, max_length=500)
+    category_id: int
+    currency: str = Field(BASE_CURRENCY, pattern=r"^[A-Z]{3}$")
+    freq: RecurringFrequency
+    every: int = Field(1, ge=1, le=366)                  # каждые N дней / недель / месяцев / лет
+    start_date: date
+    end_date: Optional[date] = None
+
+class Recurring(RecurringCreate):
+    id: int
+    user_id: int
+    next_due: Optional[date] = None                      # None: расписание закончилось
+    created_at: UtcDatetime
+    updated_at: UtcDatetime
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    priority: int
+    status: str                  # queued | running | done | failed | cancelled
+    progress: float              # 0..1
+    progress_info: dict = {}
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    attempts: int
+    max_attempts: int
+    created_at: UtcDatetime
+    started_at: Optional[UtcDatetime] = None
+    finished_at: Optional[UtcDatetime] = None
+    updated_at: UtcDatetime
+
+# /api/transactions/bulk, /api/categories/bulk: одна транзакция на запрос
+BULK_MAX_ITEMS = 500
+
+class CategoryBulkCreate(BaseModel):
+    items: List[CategoryCreate] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class CategoryUpdateItem(CategoryUpdate):
+    id: int
+
+class CategoryBulkUpdate(BaseModel):
+    items: List[CategoryUpdateItem] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class TransactionBulkCreate(BaseModel):
+    items: List[TransactionCreate] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class TransactionUpdateItem(TransactionUpdate):
+    id: int
+
+class TransactionBulkUpdate(BaseModel):
+    items: List[TransactionUpdateItem] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class BulkDelete(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class BulkItemResult(BaseModel):
+    index: int                                           # позиция в items / ids
+    id: Optional[int] = None
+    status: int                                          # HTTP-код, как у запроса на одну запись
+    detail: Optional[str] = None
+    changed: bool = False
+
+class BulkResponse(BaseModel):
+    results: List[BulkItemResult]
+    succeeded: int
+    failed: int
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    method: Literal["GET"] = "GET"
+    path: str = Field(..., max_length=2000)   # "/api/transactions/?limit=50"
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem] = Field(..., min_length=1, max_length=20)
+
+class BatchResult(BaseModel):
+    id: Optional[str] = None
+    status: int
+    body: Any = None
+
+class BatchResponse(BaseModel):
+    results: List[BatchResult]
@@ -0,0 +1,275 @@
+"""
+PostgreSQL connections with the part of aiosqlite's API the app uses.
+
+Modules hand plain SQL to `db`; on DATABASE_URL=postgresql://... that `db`
+is a Connection from here, one per request, taken from an asyncpg pool:
+
+- `?` and `:name` parameters become $1..$n (translated once per statement text,
+  a name used twice is one parameter, as in SQLite);
+- statements that return rows are fetched, the others executed, and
+  rowcount comes from the command tag;
+- as with Python's sqlite3, INSERT / UPDATE / DELETE open a transaction that
+  lasts until commit() or rollback(). BEGIN opens a REPEATABLE READ one (the
+  one-snapshot reads of /api/batch and sync), BEGIN IMMEDIATE a READ
+  COMMITTED one: writers of a user are already queued by app/locks.py;
+- numeric values (SUM over BIGINT, arithmetic with 1.0) come back as int or
+  float, as SQLite returns them; the schema itself has no NUMERIC columns;
+- set_trace_callback() sees every statement (app/querybudget.py).
+"""
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, List, NamedTuple, Optional, Sequence, Tuple
+import asyncio
+import logging
+import os
+import re
+
+import asyncpg
+
+from .storage import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+
+SCHEMA_PATH = Path(__file__).with_name("postgres.sql")
+# Ключ advisory-замка на время init_schema (замки пользователей — их id, они > 0)
+SCHEMA_LOCK = -1
+
+_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_COMMAND = re.compile(r"\s*(?:--[^\n]*\n\s*)*(\w+)(?:\s+(\w+))?")
+_RETURNING = re.compile(r"\bRETURNING\b", re.IGNORECASE)
+_COUNT = re.compile(r"(\d+)$")
+
+_ROWS = {"SELECT", "WITH", "VALUES", "SHOW", "EXPLAIN"}
+_DML = {"INSERT", "UPDATE", "DELETE"}
+
+class Statement(NamedTuple):
+    query: str                  # SQL with $n parameters
+    names: Tuple[str, ...]      # parameter name per $n, "" for positional ones
+    command: str                # first keyword, upper case
+    mode: str                   # second keyword of BEGIN (IMMEDIATE, DEFERRED, ...)
+    returns_rows: bool
+
+@lru_cache(maxsize=2048)
+def translate(sql: str) -> Statement:
+    """Statement for `sql`; quoted strings, identifiers and comments are left alone."""
+    out: List[str] = []
+    names: List[str] = []
+    numbers = {}
+    i, n = 0, len(sql)
+    while i < n:
+        char = sql[i]
+        if char in "'\"":
+            end = i + 1
+            while True:
+                end = sql.find(char, end)
+                if end == -1:
+                    end = n - 1
+                    break
+                if sql.startswith(char * 2, end):
+                    end += 2
+                    continue
+                break
+            out.append(sql[i:end + 1])
+            i = end + 1
+            continue
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = n if end == -1 else end
+            out.append(sql[i:end])
+            i = end
+            continue
+        if sql.startswith("::", i):
+            out.append("::")
+            i += 2
+            continue
+        if char == "?":
+            names.append("")
+            out.append(f"${len(names)}")
+        elif char == ":" and _NAME.match(sql, i + 1):
+            name = _NAME.match(sql, i + 1).group()
+            if name not in numbers:
+                names.append(name)
+                numbers[name] = len(names)
+            out.append(f"${numbers[name]}")
+            i += 1 + len(name)
+            continue
+        else:
+            out.append(char)
+        i += 1
+
+    match = _COMMAND.match(sql)
+    command = match.group(1).upper() if match else ""
+    mode = (match.group(2) or "").upper() if match else ""
+    returns_rows = command in _ROWS or bool(_RETURNING.search(sql))
+    return Statement("".join(out), tuple(names), command, mode, returns_rows)
+
+def _args(statement: Statement, parameters: Any) -> List[Any]:
+    if isinstance(parameters, dict):
+        return [parameters[name] for name in statement.names]
+    return list(parameters or ())
+
+class Cursor:
+    """Rows of one statement, already fetched (asyncpg Records: by index and by name)."""
+
+    def __init__(self, rows: List[asyncpg.Record], rowcount: int):
+        self._rows = rows
+        self._position = 0
+        self.rowcount = rowcount
+        self.lastrowid = None
+
+    async def fetchone(self) -> Optional[asyncpg.Record]:
+        if self._position >= len(self._rows):
+            return None
+        self._position += 1
+        return self._rows[self._position - 1]
+
+    async def fetchmany(self, size: int) -> List[asyncpg.Record]:
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    async def fetchall(self) -> List[asyncpg.Record]:
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> asyncpg.Record:
+        row = await self.fetchone()
+        if row is None:
+            raise StopAsyncIteration
+        return row
+
+class Connection:
+    """One pooled connection; close() rolls back what is not committed and releases it."""
+
+    def __init__(self, conn: asyncpg.Connection, pool: asyncpg.Pool):
+        self._conn = conn
+        self._pool = pool
+        self._transaction: Optional[asyncpg.transaction.Transaction] = None
+        self._trace: Optional[Callable[[str], None]] = None
+        self.row_factory = None
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._transaction is not None
+
+    async def _begin(self, isolation: str = "read_committed"):
+        if self._transaction is not None:
+            raise asyncpg.InterfaceError("cannot start a transaction within a transaction")
+        transaction = self._conn.transaction(isolation=isolation)
+        await transaction.start()
+        self._transaction = transaction
+
+    async def execute(self, sql: str, parameters: Any = ()) -> Cursor:
+        statement = translate(sql)
+        if self._trace is not None:
+            self._trace(sql)
+        if statement.command == "BEGIN":
+            await self._begin("read_committed" if statement.mode in ("IMMEDIATE", "EXCLUSIVE")
+                              else "repeatable_read")
+            return Cursor([], -1)
+        if statement.command in ("COMMIT", "END"):
+            await self.commit()
+            return Cursor([], -1)
+        if statement.command == "ROLLBACK":
+            await self.rollback()
+            return Cursor([], -1)
+
+        if statement.command in _DML and self._transaction is None:
+            await self._begin()
+        args = _args(statement, parameters)
+        if statement.returns_rows:
+            rows = await self._conn.fetch(statement.query, *args)
+            return Cursor(rows, len(rows) if statement.command in _DML else -1)
+        status = await self._conn.execute(statement.query, *args)
+        count = _COUNT.search(status or "")
+        return Cursor([], int(count.group(1)) if count and statement.command in _DML else -1)
+
+    async def executemany(self, sql: str, seq_of_parameters: Sequence[Any]) -> Cursor:
+        statement = translate(sql)
+        rows = [_args(statement, parameters) for parameters in seq_of_parameters]
+        if self._trace is not None:
+            self._trace(sql)
+        if not rows:
+            return Cursor([], 0)
+        if statement.command in _DML and self._transaction is None:
+            await self._begin()
+        await self._conn.executemany(statement.query, rows)
+        return Cursor([], len(rows))
+
+    async def executescript(self, sql: str):
+        await self.commit()
+        await self._conn.execute(sql)
+
+    async def commit(self):
+        transaction, self._transaction = self._transaction, None
+        if transaction is not None:
+            await transaction.commit()
+
+    async def rollback(self):
+        transaction, self._transaction = self._transaction, None
+        if transaction is not None:
+            await transaction.rollback()
+
+    async def set_trace_callback(self, callback: Optional[Callable[[str], None]]):
+        self._trace = callback
+
+    async def create_function(self, *args, **kwargs):
+        # Функции заведены в app/postgres.sql
+        pass
+
+    async def close(self):
+        try:
+            if self._transaction is not None and not self._conn.is_closed():
+                await self.rollback()
+        finally:
+            self._transaction = None
+            await self._pool.release(self._conn)
+
+def _number(text: str):
+    return int(text) if text.lstrip("-").isdigit() else float(text)
+
+async def _setup(conn: asyncpg.Connection):
+    await conn.set_type_codec("numeric", encoder=str, decoder=_number, schema="pg_catalog", format="text")
+
+_pool: Optional[asyncpg.Pool] = None
+_pool_loop: Optional[asyncio.AbstractEventLoop] = None
+
+async def get_pool() -> asyncpg.Pool:
+    """The pool of the running event loop (tests and CLIs run their own loops)."""
+    global _pool, _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool_loop is not loop:
+        _pool = await asyncpg.create_pool(DATABASE_URL, min_size=PG_POOL_MIN, max_size=PG_POOL_MAX,
+                                          init=_setup)
+        _pool_loop = loop
+    return _pool
+
+async def close_pool():
+    global _pool, _pool_loop
+    if _pool is not None and _pool_loop is asyncio.get_running_loop():
+        await _pool.close()
+    _pool, _pool_loop = None, None
+
+async def connect() -> Connection:
+    pool = await get_pool()
+    return Connection(await pool.acquire(), pool)
+
+async def init_schema():
+    """Apply app/postgres.sql; workers starting together take turns on an advisory lock."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT pg_advisory_lock($1)", SCHEMA_LOCK)
+        try:
+            await conn.execute(SCHEMA_PATH.read_text(encoding="utf-8"))
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", SCHEMA_LOCK)
+        if await conn.fetchval("SELECT lower('Ä') <> 'ä'"):
+            logger.warning("⚠️  lower() of this database does not fold non-ASCII letters (LC_CTYPE "
+                           "is not UTF-8): fingerprints will differ from the ones computed in Python")
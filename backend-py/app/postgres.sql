@@ -0,0 +1,180 @@
+-- PostgreSQL schema (DATABASE_URL=postgresql://..., see app/storage.py).
+--
+-- The same tables as db/migrate.sql after all MIGRATIONS of app/db.py: times
+-- are BIGINT epoch ms, amounts BIGINT cents. A new SQLite migration updates
+-- this file too; everything here is idempotent and runs on every start.
+--
+-- The database needs a UTF-8 LC_CTYPE (e.g. createdb -T template0 --locale=C.UTF-8):
+-- lower() in transaction_fingerprint must fold Cyrillic like Python's str.lower().
+
+CREATE TABLE IF NOT EXISTS users (
+  id            BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  email         TEXT UNIQUE NOT NULL,
+  password_hash TEXT NOT NULL,
+  created_at    BIGINT NOT NULL DEFAULT 0,
+  updated_at    BIGINT NOT NULL DEFAULT 0
+);
+
+-- sync_id в порядке байтов, как сравнивает Python: на нём держится merge-join в app/sync.py
+CREATE TABLE IF NOT EXISTS categories (
+  id             BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  user_id        BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  name           TEXT NOT NULL,
+  type           TEXT NOT NULL CHECK(type IN ('income','expense')),
+  color          TEXT NOT NULL,
+  icon           TEXT,
+  active         INTEGER NOT NULL DEFAULT 1,
+  sync_id        TEXT COLLATE "C" NOT NULL UNIQUE,
+  field_versions TEXT,                          -- JSON {поле: epoch ms}
+  created_at     BIGINT NOT NULL DEFAULT 0,
+  updated_at     BIGINT NOT NULL DEFAULT 0,
+  deleted_at     BIGINT,
+  content_hash   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_categories_user ON categories(user_id);
+CREATE INDEX IF NOT EXISTS idx_categories_updated ON categories(updated_at);
+CREATE INDEX IF NOT EXISTS idx_categories_deleted ON categories(deleted_at);
+
+CREATE TABLE IF NOT EXISTS transactions (
+  id             BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  user_id        BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  category_id    BIGINT NOT NULL REFERENCES categories(id) ON DELETE RESTRICT,
+  description    TEXT NOT NULL,
+  sync_id        TEXT COLLATE "C" NOT NULL UNIQUE,
+  fingerprint    TEXT,
+  field_versions TEXT,
+  currency       TEXT NOT NULL,
+  amount_cents   BIGINT NOT NULL DEFAULT 0,
+  date           BIGINT NOT NULL DEFAULT 0,
+  created_at     BIGINT NOT NULL DEFAULT 0,
+  updated_at     BIGINT NOT NULL DEFAULT 0,
+  deleted_at     BIGINT,
+  content_hash   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tx_user ON transactions(user_id);
+CREATE INDEX IF NOT EXISTS idx_tx_category ON transactions(category_id);
+CREATE INDEX IF NOT EXISTS idx_tx_updated ON transactions(updated_at);
+CREATE INDEX IF NOT EXISTS idx_tx_deleted ON transactions(deleted_at);
+CREATE INDEX IF NOT EXISTS idx_tx_user_date ON transactions(user_id, date);
+CREATE INDEX IF NOT EXISTS idx_tx_user_fingerprint ON transactions(user_id, fingerprint);
+
+CREATE TABLE IF NOT EXISTS currency_rates (
+  currency  TEXT NOT NULL,
+  day       TEXT NOT NULL,                      -- YYYY-MM-DD
+  rate      DOUBLE PRECISION NOT NULL CHECK(rate > 0),
+  PRIMARY KEY (currency, day)
+);
+CREATE TABLE IF NOT EXISTS currency_rate_imports (
+  id           BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  source       TEXT NOT NULL,
+  rows         INTEGER NOT NULL,
+  imported_at  TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS import_rules (
+  id           BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  user_id      BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  pattern      TEXT NOT NULL,
+  category_id  BIGINT NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+  priority     INTEGER NOT NULL DEFAULT 0,
+  created_at   TEXT NOT NULL,
+  updated_at   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_import_rules_user ON import_rules(user_id, priority);
+
+CREATE TABLE IF NOT EXISTS recurring_transactions (
+  id            BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  user_id       BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  category_id   BIGINT NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+  amount_cents  BIGINT NOT NULL,
+  currency      TEXT NOT NULL,
+  description   TEXT NOT NULL,
+  freq          TEXT NOT NULL CHECK(freq IN ('daily','weekly','monthly','yearly')),
+  every         INTEGER NOT NULL DEFAULT 1,
+  start_date    TEXT NOT NULL,
+  end_date      TEXT,
+  next_due      TEXT,
+  created_at    BIGINT NOT NULL,
+  updated_at    BIGINT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_recurring_due ON recurring_transactions(user_id, next_due) WHERE next_due IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS jobs (
+  id             TEXT PRIMARY KEY,
+  user_id        BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  kind           TEXT NOT NULL,
+  priority       INTEGER NOT NULL DEFAULT 0,
+  status         TEXT NOT NULL,
+  payload        TEXT NOT NULL DEFAULT '{}',
+  result         TEXT,
+  progress       DOUBLE PRECISION NOT NULL DEFAULT 0,
+  progress_info  TEXT,
+  error          TEXT,
+  attempts       INTEGER NOT NULL DEFAULT 0,
+  max_attempts   INTEGER NOT NULL DEFAULT 3,
+  run_after      TEXT NOT NULL,
+  locked_by      TEXT,
+  locked_until   TEXT,
+  created_at     TEXT NOT NULL,
+  started_at     TEXT,
+  finished_at    TEXT,
+  updated_at     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, priority, run_after);
+CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_id, status);
+CREATE INDEX IF NOT EXISTS idx_jobs_user_created ON jobs(user_id, created_at);
+
+CREATE TABLE IF NOT EXISTS change_log (
+  seq         BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  user_id     BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  table_name  TEXT NOT NULL,
+  sync_id     TEXT COLLATE "C" NOT NULL,
+  op          TEXT NOT NULL,
+  fields      TEXT,
+  changed_at  BIGINT NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_change_log_user_seq ON change_log(user_id, seq);
+
+-- Functions that app/fingerprints.py registers on SQLite connections (SQL_FUNCTIONS).
+-- The results must equal the Python ones byte for byte: the app computes the
+-- hashes of inserts in Python and the UPDATEs recompute them in SQL.
+
+-- One value of content_hash(): UTF-8 text, NUL byte for NULL
+CREATE OR REPLACE FUNCTION content_hash_part(TEXT) RETURNS BYTEA
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+  SELECT CASE WHEN $1 IS NULL THEN '\x00'::bytea ELSE convert_to($1, 'UTF8') END
+$$;
+
+CREATE OR REPLACE FUNCTION category_hash(TEXT, TEXT, TEXT, TEXT) RETURNS TEXT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+  SELECT left(encode(sha256(
+    content_hash_part($1) || '\x1f'::bytea || content_hash_part($2) || '\x1f'::bytea
+    || content_hash_part($3) || '\x1f'::bytea || content_hash_part($4)
+  ), 'hex'), 24)
+$$;
+
+-- (amount_cents, currency, description, date_ms, category_id)
+CREATE OR REPLACE FUNCTION transaction_hash(BIGINT, TEXT, TEXT, BIGINT, BIGINT) RETURNS TEXT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+  SELECT left(encode(sha256(
+    content_hash_part($1::text) || '\x1f'::bytea || content_hash_part($2) || '\x1f'::bytea
+    || content_hash_part($3) || '\x1f'::bytea || content_hash_part($4::text) || '\x1f'::bytea
+    || content_hash_part($5::text)
+  ), 'hex'), 24)
+$$;
+
+-- (user_id, date_ms, amount_cents, category_id, description): normalize_description() + day_key()
+CREATE OR REPLACE FUNCTION transaction_fingerprint(BIGINT, BIGINT, BIGINT, BIGINT, TEXT) RETURNS TEXT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+  SELECT left(encode(sha256(convert_to(
+    $1::text || '|' || to_char(to_timestamp($2 / 1000.0) AT TIME ZONE 'UTC', 'YYYY-MM-DD')
+    || '|' || $3::text || '|' || $4::text || '|'
+    || lower(regexp_replace(regexp_replace(coalesce($5, ''), '^\s+|\s+$', '', 'g'), '\s+', ' ', 'g')),
+    'UTF8')), 'hex'), 24)
+$$;
+
+-- SQLite's json_remove(doc, '$.a', '$.b') for the flat field_versions objects
+CREATE OR REPLACE FUNCTION json_remove(TEXT, VARIADIC TEXT[]) RETURNS TEXT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+  SELECT ($1::jsonb - ARRAY(SELECT substr(path, 3) FROM unnest($2) AS path))::text
+$$;
@@ -0,0 +1,234 @@
+"""
+SQL statement budgets per endpoint.
+
+QUERY_BUDGETS caps the CRUD routes, including the user lookup of
+get_current_user. The request connection (db.get_db) of a capped route counts
+the statements it runs through the sqlite3 trace callback; other routes
+(sync, batch, reports) are not traced. Transaction control (BEGIN / COMMIT /
+ROLLBACK) is not counted. Only the number and the last RECENT_STATEMENTS
+texts are kept. A request over its budget is logged with them, and the
+db.statements.over_budget.* counters in /api/metrics/ record it.
+
+Regression check against a throw-away database, error paths included. It
+also re-posts an identical /api/sync/ body, which must write nothing and
+keep the seq. Exits 1 when a route goes over or the re-sync writes; needs
+httpx from the `dev` extra:
+    python -m app.querybudget
+"""
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+import logging
+import os
+import sys
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# (method, route) -> max SQL statements per request
+QUERY_BUDGETS: Dict[Tuple[str, str], int] = {
+    ("GET", "/api/categories/"): 2,
+    ("POST", "/api/categories/"): 3,                        # user, INSERT ... WHERE NOT EXISTS, change_log
+    ("GET", "/api/categories/{category_id}"): 2,
+    ("PUT", "/api/categories/{category_id}"): 3,            # user, UPDATE ... RETURNING, change_log | re-read
+    ("DELETE", "/api/categories/{category_id}"): 3,         # user, DELETE ... RETURNING, change_log
+    ("GET", "/api/transactions/"): 3,                       # user, due recurring probe, SELECT
+    ("POST", "/api/transactions/"): 4,                      # + duplicate lookup when DUPLICATE_MODE != allow
+    ("GET", "/api/transactions/{transaction_id}"): 2,
+    ("PUT", "/api/transactions/{transaction_id}"): 3,
+    ("DELETE", "/api/transactions/{transaction_id}"): 3,
+}
+
+_NOT_COUNTED = ("BEGIN", "COMMIT", "ROLLBACK", "--")
+
+# Statement texts kept for the over-budget warning (the count itself is exact)
+RECENT_STATEMENTS = 20
+
+class StatementCount:
+    """Statements of one request connection: how many, and the last RECENT_STATEMENTS of them."""
+
+    def __init__(self):
+        self.count = 0
+        self.recent: Deque[str] = deque(maxlen=RECENT_STATEMENTS)
+
+    def __call__(self, sql: str):
+        # Вызывается в потоке aiosqlite, пока запрос ждёт выражение.
+        # Действия внешних ключей (CASCADE, RESTRICT) повторяют текст своего выражения — не считаются
+        if sql.lstrip().upper().startswith(_NOT_COUNTED) or (self.recent and self.recent[-1] == sql):
+            return
+        self.count += 1
+        self.recent.append(sql)
+
+async def count_statements(db, scope: dict) -> Optional[StatementCount]:
+    """Count the statements `db` runs from now on, for a route in QUERY_BUDGETS; None otherwise."""
+    if route_key(scope) not in QUERY_BUDGETS:
+        return None
+    statements = StatementCount()
+    await db.set_trace_callback(statements)
+    return statements
+
+def route_key(scope: dict) -> Optional[Tuple[str, str]]:
+    """(method, route template) of a routed request: '/api/categories/7' -> '/api/categories/{category_id}'."""
+    if scope.get("route") is None:
+        return None
+    # route.path без префикса include_router, поэтому шаблон восстанавливается из path_params
+    segments = scope["path"].split("/")
+    for name, value in scope.get("path_params", {}).items():
+        segments = [f"{{{name}}}" if segment == str(value) else segment for segment in segments]
+    return scope["method"], "/".join(segments)
+
+def check_budget(scope: dict, statements: Optional[StatementCount]):
+    if statements is None:
+        return
+    from . import metrics
+
+    key = route_key(scope)
+    name = f"{key[0]} {key[1]}"
+    metrics.inc(f"db.statements.{name}", statements.count)
+    budget = QUERY_BUDGETS[key]
+    if statements.count > budget:
+        metrics.inc(f"db.statements.over_budget.{name}")
+        skipped = statements.count - len(statements.recent)
+        logger.warning(f"⚠️ {name}: {statements.count} SQL statements, budget {budget}: "
+                       + ("… | " if skipped else "")
+                       + " | ".join(" ".join(sql.split())[:80] for sql in statements.recent))
+
+# Сценарий проверки: (метод, путь, тело, ожидаемый статус, имя для id ответа).
+# "{name}" в пути и в теле заменяется сохранённым id
+SCENARIO: List[Tuple[str, str, Optional[dict], int, Optional[str]]] = [
+    ("POST", "/api/categories/", {"name": "Food", "type": "expense", "color": "#FF0000"}, 200, "food"),
+    ("POST", "/api/categories/", {"name": "Rent", "type": "expense", "color": "#00FF00"}, 200, "rent"),
+    ("POST", "/api/categories/", {"name": "Food", "type": "expense", "color": "#FF0000"}, 400, None),
+    ("GET", "/api/categories/", None, 200, None),
+    ("GET", "/api/categories/{food}", None, 200, None),
+    ("PUT", "/api/categories/{food}", {"color": "#0000FF"}, 200, None),
+    ("PUT", "/api/categories/{food}", {"color": "#0000FF"}, 200, None),
+    ("PUT", "/api/categories/{food}", {"name": "Rent"}, 400, None),
+    ("PUT", "/api/categories/0", {"name": "Other"}, 404, None),
+    ("POST", "/api/transactions/", {"amount": "12.50", "description": "Lunch",
+                                    "date": "2026-01-15T12:00:00", "category_id": "{food}"}, 200, "lunch"),
+    ("POST", "/api/transactions/", {"amount": "1.00", "description": "Nope",
+                                    "date": "2026-01-15T12:00:00", "category_id": 0}, 400, None),
+    ("GET", "/api/transactions/", None, 200, None),
+    ("GET", "/api/transactions/{lunch}", None, 200, None),
+    ("PUT", "/api/transactions/{lunch}", {"amount": "13.00", "category_id": "{rent}"}, 200, None),
+    ("PUT", "/api/transactions/{lunch}", {"amount": "13.00"}, 200, None),
+    ("PUT", "/api/transactions/{lunch}", {"category_id": 0}, 400, None),
+    ("PUT", "/api/transactions/0", {"amount": "1.00"}, 404, None),
+    ("DELETE", "/api/categories/{rent}", None, 400, None),
+    ("DELETE", "/api/transactions/{lunch}", None, 200, None),
+    ("DELETE", "/api/transactions/{lunch}", None, 404, None),
+    ("DELETE", "/api/categories/{rent}", None, 200, None),
+]
+
+def _fill(value, ids: Dict[str, int]):
+    if isinstance(value, dict):
+        return {k: _fill(v, ids) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill(v, ids) for v in value]
+    if isinstance(value, str) and value.startswith("{") and value.endswith("}"):
+        return ids[value[1:-1]]
+    return value
+
+def run_scenario(client, headers: dict, report: Callable[[str, str, int, int], None],
+                 scenario: List[Tuple[str, str, Optional[dict], int, Optional[str]]] = SCENARIO,
+                 responses: Optional[List[dict]] = None) -> Dict[Tuple[str, str], int]:
+    """Run `scenario`; returns the most statements seen per budgeted route.
+
+    With `responses`, every request and its answer are appended to it."""
+    from . import metrics
+
+    ids: Dict[str, int] = {}
+    worst: Dict[Tuple[str, str], int] = {}
+    for method, path, body, expected, save_as in scenario:
+        path = path.format(**ids)
+        body = _fill(body, ids)
+        before = metrics.snapshot()["counters"]
+        response = client.request(method, path, json=body, headers=headers)
+        if response.status_code != expected:
+            raise AssertionError(f"{method} {path}: {response.status_code} {response.text}")
+        if responses is not None:
+            responses.append({"request": f"{method} {path}", "status": response.status_code,
+                              "body": response.json()})
+        if save_as:
+            ids[save_as] = response.json()["id"]
+        for name, value in metrics.snapshot()["counters"].items():
+            spent = int(value - before.get(name, 0))
+            route_method, _, route = name[len("db.statements."):].partition(" ")
+            key = (route_method, route)
+            if spent and name.startswith("db.statements.") and key in QUERY_BUDGETS:
+                worst[key] = max(worst.get(key, 0), spent)
+                report(method, path, spent, QUERY_BUDGETS[key])
+    return worst
+
+# Push со всеми видами записей. Повтор того же тела ничего не пишет:
+# written == 0, seq из change_log не двигается
+_GIFTS = {"id": 0, "user_id": 0, "name": "Gifts", "type": "expense", "color": "#123456",
+          "sync_id": "00000000-0000-4000-8000-0000000000a1",
+          "created_at": "2026-01-01T00:00:00Z", "updated_at": "2026-01-01T00:00:00Z"}
+RESYNC_BODY = {
+    "delta": True, "since_seq": 0,
+    "categories": [_GIFTS],
+    "transactions": [
+        {"id": 0, "user_id": 0, "amount": "25.00", "description": "Flowers", "date": "2026-01-05T10:00:00Z",
+         "category_id": 0, "category": _GIFTS, "sync_id": "00000000-0000-4000-8000-0000000000a2",
+         "created_at": "2026-01-05T10:00:00Z", "updated_at": "2026-01-05T10:00:00Z"},
+    ],
+    "category_patches": [
+        {"sync_id": _GIFTS["sync_id"], "updated_at": "2026-01-02T00:00:00Z", "fields": {"icon": "🎁"}},
+    ],
+    "transaction_patches": [
+        {"sync_id": "00000000-0000-4000-8000-0000000000a2", "updated_at": "2026-01-06T00:00:00Z",
+         "fields": {"amount": "30.00", "description": "Flowers and card"}},
+    ],
+}
+
+def check_resync(client, headers: dict) -> List[str]:
+    """POST RESYNC_BODY twice; problems of the repeat (empty when it wrote nothing)."""
+    first = client.post("/api/sync/", json=RESYNC_BODY, headers=headers)
+    again = client.post("/api/sync/", json=RESYNC_BODY, headers=headers)
+    if first.status_code != 200 or again.status_code != 200:
+        return [f"POST /api/sync/: {first.status_code}, {again.status_code} {again.text[:200]}"]
+    first, again = first.json(), again.json()
+    problems = []
+    if first["written"] == 0:
+        problems.append("first push wrote nothing")
+    if again["written"] != 0:
+        problems.append(f"repeated push wrote {again['written']} record(s)")
+    if again["seq"] != first["seq"]:
+        problems.append(f"repeated push moved seq {first['seq']} -> {again['seq']}")
+    return problems
+
+def main(argv: List[str]) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DB_PATH"] = os.path.join(tmp, "budget.db")
+        try:
+            from fastapi.testclient import TestClient
+        except ImportError:
+            print("httpx is required: pip install -e \".[dev]\"")
+            return 2
+        from .main import app
+
+        with TestClient(app) as client:
+            credentials = {"email": "budget@example.com", "password": "query-budget"}
+            client.post("/api/auth/register", json=credentials)
+            token = client.post("/api/auth/login", json=credentials).json()["access_token"]
+
+            def report(method: str, path: str, spent: int, budget: int):
+                print(f"{'OVER' if spent > budget else 'ok':<5} {method:<7} {path:<32} {spent:>3} / {budget}")
+
+            headers = {"Authorization": f"Bearer {token}"}
+            worst = run_scenario(client, headers, report)
+            resync = check_resync(client, headers)
+            for problem in resync:
+                print(f"RESYNC {problem}")
+
+    over = [key for key, spent in worst.items() if spent > QUERY_BUDGETS[key]]
+    missing = [key for key in QUERY_BUDGETS if key not in worst]
+    for method, route in missing:
+        print(f"not exercised: {method} {route}")
+    print(f"{len(worst)} routes checked, {len(over)} over budget, "
+          f"identical re-sync: {'ok' if not resync else 'FAILED'}")
+    return 1 if over or missing or resync else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
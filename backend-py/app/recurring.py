@@ -0,0 +1,220 @@
+"""
+Recurring transactions: templates (schedule + amount, currency, category,
+description) that turn into ordinary transactions when they come due.
+
+There is no background loop over users. Due instances are materialized
+lazily, for the user at hand, at the start of GET /api/transactions/ and
+before the pull of POST /api/sync/. When nothing is due that is one probe on
+the (user_id, next_due) partial index, so the cost is O(due items). The
+catch-up itself runs on its own connection: it is occasional work outside
+the request's statement budget (app/querybudget.py).
+
+next_due is the first date not created yet. The instances and the new
+next_due are written in one user_write_transaction, so two requests never
+create the same date twice, and a transaction the user deleted stays
+deleted. An instance's sync_id is uuid5(template id, date): every device
+sees the same record for it.
+"""
+from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional
+import logging
+import os
+import uuid
+
+from .db import get_db, connect_db
+from .auth import get_current_user
+from .changes import log_changes, TRANSACTIONS, INSERT
+from .locks import user_write_transaction
+from .fingerprints import amount_to_cents, cents_to_amount, transaction_fingerprint, transaction_hash
+from .timestamps import now_ms, day_ms, from_ms
+from .models import User, Recurring, RecurringCreate
+from . import metrics
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+RECURRING_BATCH = int(os.getenv("RECURRING_BATCH", "200"))
+
+RECURRING_COLUMNS = """id, user_id, category_id, amount_cents, currency, description, freq, every,
+       start_date, end_date, next_due, created_at, updated_at"""
+
+def _add_months(day: date, months: int, dom: int) -> date:
+    m = day.year * 12 + day.month - 1 + months
+    year, month = m // 12, m % 12 + 1
+    last = (date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)).day
+    return date(year, month, min(dom, last))
+
+def occurrence(t, n: int) -> date:
+    """n-th date of a template's schedule; 31st of the month falls back to the month's last day."""
+    start = date.fromisoformat(t["start_date"])
+    step = n * t["every"]
+    if t["freq"] == "daily":
+        return start + timedelta(days=step)
+    if t["freq"] == "weekly":
+        return start + timedelta(weeks=step)
+    return _add_months(start, step * (12 if t["freq"] == "yearly" else 1), start.day)
+
+def first_on_or_after(t, day: date) -> int:
+    start = date.fromisoformat(t["start_date"])
+    if day <= start:
+        return 0
+    span = {"daily": 1, "weekly": 7}.get(t["freq"])
+    if span:
+        n = -(-(day - start).days // (span * t["every"]))
+    else:
+        months = (day.year - start.year) * 12 + day.month - start.month
+        n = max(0, months // (t["every"] * (12 if t["freq"] == "yearly" else 1)))
+    while occurrence(t, n) < day:
+        n += 1
+    return n
+
+def instance_sync_id(template_id: int, day: date) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"recurring:{template_id}:{day.isoformat()}"))
+
+def _due(t, day: date) -> Optional[str]:
+    """YYYY-MM-DD of the first occurrence on or after `day`, None past end_date."""
+    due = occurrence(t, first_on_or_after(t, day)).isoformat()
+    if t["end_date"] and due > t["end_date"]:
+        return None
+    return due
+
+def recurring_from_row(row) -> dict:
+    data = dict(row)
+    data["amount"] = cents_to_amount(data.pop("amount_cents"))
+    data["created_at"] = from_ms(data["created_at"])
+    data["updated_at"] = from_ms(data["updated_at"])
+    return data
+
+async def materialize_due(db, user_id: int) -> int:
+    """Create the user's transactions due up to today (UTC); returns how many were created.
+
+    Skipped on a connection that is already in a transaction: /api/batch
+    sub-requests read one shared snapshot and must not write."""
+    if db.in_transaction:
+        return 0
+    today = datetime.now(timezone.utc).date().isoformat()
+    cursor = await db.execute(
+        "SELECT 1 FROM recurring_transactions WHERE user_id = ? AND next_due <= ? LIMIT 1",
+        (user_id, today)
+    )
+    if await cursor.fetchone() is None:
+        return 0
+    writer = await connect_db()
+    try:
+        created = await _materialize(writer, user_id, today)
+    finally:
+        await writer.close()
+    metrics.inc("recurring.created", created)
+    logger.info(f"🔁 Recurring: {created} transactions created for user {user_id}")
+    return created
+
+async def _materialize(db, user_id: int, today: str) -> int:
+    created = 0
+    async with user_write_transaction(db, user_id):
+        while True:
+            # Re-read under the lock: another request may have done the work
+            cursor = await db.execute(
+                f"""SELECT {RECURRING_COLUMNS} FROM recurring_transactions
+                    WHERE user_id = ? AND next_due <= ? ORDER BY next_due, id LIMIT ?""",
+                (user_id, today, RECURRING_BATCH)
+            )
+            templates = await cursor.fetchall()
+            if not templates:
+                break
+            now = now_ms()
+            rows, sync_ids, schedule = [], [], []
+            for t in templates:
+                last = min(today, t["end_date"]) if t["end_date"] else today
+                n = first_on_or_after(t, date.fromisoformat(t["next_due"]))
+                day = occurrence(t, n)
+                while day.isoformat() <= last:
+                    sync_id = instance_sync_id(t["id"], day)
+                    date_ms = day_ms(day)
+                    rows.append((user_id, t["category_id"], t["amount_cents"], t["currency"], t["description"],
+                                 date_ms, sync_id, now, now,
+                                 transaction_fingerprint(user_id, day, t["amount_cents"], t["category_id"],
+                                                         t["description"]),
+                                 transaction_hash(t["amount_cents"], t["currency"], t["description"],
+                                                  date_ms, t["category_id"])))
+                    sync_ids.append(sync_id)
+                    n += 1
+                    day = occurrence(t, n)
+                schedule.append((_due(t, date.fromisoformat(today) + timedelta(days=1)), now, t["id"]))
+            if rows:
+                await db.executemany(
+                    """INSERT INTO transactions (user_id, category_id, amount_cents, currency, description, date,
+                                                 sync_id, created_at, updated_at, fingerprint, content_hash)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    rows
+                )
+                await log_changes(db, user_id, TRANSACTIONS, sync_ids, INSERT)
+            await db.executemany(
+                "UPDATE recurring_transactions SET next_due = ?, updated_at = ? WHERE id = ?",
+                schedule
+            )
+            created += len(rows)
+    return created
+
+@router.get("/", response_model=List[Recurring])
+async def get_recurring(current_user: User = Depends(get_current_user), db = Depends(get_db)):
+    cursor = await db.execute(
+        f"SELECT {RECURRING_COLUMNS} FROM recurring_transactions WHERE user_id = ? ORDER BY id",
+        (current_user.id,)
+    )
+    return [recurring_from_row(row) for row in await cursor.fetchall()]
+
+@router.post("/", response_model=Recurring)
+async def create_recurring(
+    recurring: RecurringCreate,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    if recurring.end_date is not None and recurring.end_date < recurring.start_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end_date is before start_date"
+        )
+    cursor = await db.execute(
+        "SELECT 1 FROM categories WHERE id = ? AND user_id = ?",
+        (recurring.category_id, current_user.id)
+    )
+    if await cursor.fetchone() is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Category not found or doesn't belong to user"
+        )
+    now = now_ms()
+    # Первая дата — start_date; прошедшие даты создаст materialize_due
+    cursor = await db.execute(
+        f"""INSERT INTO recurring_transactions (user_id, category_id, amount_cents, currency, description, freq,
+                                                every, start_date, end_date, next_due, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING {RECURRING_COLUMNS}""",
+        (current_user.id, recurring.category_id, amount_to_cents(recurring.amount), recurring.currency,
+         recurring.description, recurring.freq.value, recurring.every, recurring.start_date.isoformat(),
+         recurring.end_date.isoformat() if recurring.end_date else None, recurring.start_date.isoformat(),
+         now, now)
+    )
+    row = await cursor.fetchone()
+    await db.commit()
+    return recurring_from_row(row)
+
+@router.delete("/{recurring_id}")
+async def delete_recurring(
+    recurring_id: int,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """Stops the schedule; transactions it already created stay."""
+    cursor = await db.execute(
+        "DELETE FROM recurring_transactions WHERE id = ? AND user_id = ?",
+        (recurring_id, current_user.id)
+    )
+    await db.commit()
+    if cursor.rowcount == 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Recurring transaction not found"
+        )
+    return {"message": "Recurring transaction deleted successfully"}
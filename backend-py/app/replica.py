@@ -0,0 +1,173 @@
+"""
+Local read replica of the SQLite database for analytics.
+
+Stats, reports and the /api/sync/status counts scan a user's rows. With
+REPLICA_INTERVAL_SECONDS > 0 they read a copy of DB_PATH at REPLICA_PATH, so
+they no longer share the primary file with latency-sensitive writes.
+
+One refresher per host keeps the copy current. Every uvicorn worker runs the
+loop, and a flock on REPLICA_PATH.lock picks the worker that copies. Each
+interval it reads PRAGMA data_version on its own connection to the primary.
+The value changes only when another connection has committed:
+
+- unchanged: the copy still equals the primary, only its mtime is bumped;
+- changed: the primary is copied with the online backup API (app/backup.py)
+  into a new file, which then replaces REPLICA_PATH. Open readers finish on
+  the old file. Unlike a backup the copy is not throttled: by default it
+  takes the whole file in one step (REPLICA_PAGES_PER_STEP = -1), without
+  pauses, and a restart by a concurrent write finishes in one step at once.
+
+The mtime of REPLICA_PATH is the moment the copy was known to match the
+primary. The lag is now - mtime. get_read_db serves a request from the copy
+only while the lag is at most REPLICA_MAX_LAG_SECONDS, otherwise from the
+primary, which it opens only then. A read can therefore miss writes younger
+than that bound.
+
+Metrics: gauge replica.lag_seconds; counters replica.reads,
+replica.fallbacks, replica.refreshes, replica.failures; timing
+replica.refresh.
+"""
+from contextlib import asynccontextmanager
+from fastapi import Request
+from pathlib import Path
+from typing import AsyncIterator, Optional
+import asyncio
+import fcntl
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+from .db import DB_PATH, SHARED_DB_STATE, REQUEST_DB_STATE, connect_db, request_db
+from .storage import POSTGRES
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+REPLICA_PATH = os.getenv("REPLICA_PATH", str(Path(DB_PATH).with_suffix(".replica.db")))
+REPLICA_INTERVAL_SECONDS = float(os.getenv("REPLICA_INTERVAL_SECONDS", "0"))  # 0 = no replica
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+REPLICA_PAGES_PER_STEP = int(os.getenv("REPLICA_PAGES_PER_STEP", "-1"))  # -1 = whole file in one step
+
+def replica_enabled() -> bool:
+    return REPLICA_INTERVAL_SECONDS > 0 and not POSTGRES
+
+def replica_lag() -> Optional[float]:
+    """Seconds since the copy last matched the primary; None when there is no copy."""
+    try:
+        return max(time.time() - os.stat(REPLICA_PATH).st_mtime, 0.0)
+    except FileNotFoundError:
+        return None
+
+class _Refresher:
+    """The primary connection and the data_version it saw at the last refresh."""
+
+    def __init__(self):
+        self.source: Optional[sqlite3.Connection] = None
+        self.data_version: Optional[int] = None
+
+    def refresh(self) -> bool:
+        """Bring REPLICA_PATH up to date. Blocking; returns True when it copied."""
+        from .backup import _copy_online
+
+        checked_at = time.time()
+        if self.source is None:
+            self.source = sqlite3.connect(DB_PATH, timeout=5, check_same_thread=False)
+        version = self.source.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.data_version and os.path.exists(REPLICA_PATH):
+            os.utime(REPLICA_PATH, (checked_at, checked_at))
+            return False
+
+        target = Path(REPLICA_PATH)
+        fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=target.name + ".", suffix=".tmp")
+        os.close(fd)
+        try:
+            # Копия содержит всё, что было закоммичено до checked_at
+            _copy_online(DB_PATH, tmp, check=False, pages_per_step=REPLICA_PAGES_PER_STEP,
+                         step_sleep=0, max_restarts=1)
+            os.utime(tmp, (checked_at, checked_at))
+            os.replace(tmp, REPLICA_PATH)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        self.data_version = version
+        return True
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+
+async def replica_refresher():
+    """Background task: refresh the copy every REPLICA_INTERVAL_SECONDS."""
+    if POSTGRES:
+        logger.info("📚 DATABASE_URL is PostgreSQL: the SQLite read replica is off")
+        return
+    Path(REPLICA_PATH).parent.mkdir(parents=True, exist_ok=True)
+    logger.info(f"📚 Read replica {REPLICA_PATH}: every {REPLICA_INTERVAL_SECONDS}s, "
+                f"max lag {REPLICA_MAX_LAG_SECONDS}s")
+    lock_file = open(REPLICA_PATH + ".lock", "w")
+    leader = False
+    refresher = _Refresher()
+    try:
+        while True:
+            if not leader:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    leader = True
+                except BlockingIOError:
+                    pass
+            if leader:
+                started = time.perf_counter()
+                try:
+                    if await asyncio.to_thread(refresher.refresh):
+                        metrics.inc("replica.refreshes")
+                        metrics.observe("replica.refresh", time.perf_counter() - started)
+                except Exception as e:
+                    metrics.inc("replica.failures")
+                    logger.error(f"❌ Read replica refresh failed: {e}")
+                    refresher.close()
+            lag = replica_lag()
+            if lag is not None:
+                metrics.set_gauge("replica.lag_seconds", round(lag, 3))
+            await asyncio.sleep(REPLICA_INTERVAL_SECONDS)
+    finally:
+        refresher.close()
+        lock_file.close()
+
+@asynccontextmanager
+async def _primary(request: Request) -> AsyncIterator:
+    # Подключение, уже открытое для запроса (get_current_user), иначе своё
+    db = getattr(request.state, REQUEST_DB_STATE, None)
+    if db is not None:
+        yield db
+        return
+    async with request_db(request) as db:
+        yield db
+
+async def get_read_db(request: Request) -> AsyncIterator:
+    """FastAPI dependency for analytics reads: the replica while it is fresh enough, else the primary.
+
+    A primary connection is used only then: the one the request already
+    holds (the user lookup of get_current_user), otherwise one opened and
+    counted against the request's budget. /api/batch sub-requests keep the
+    batch's shared connection (one snapshot)."""
+    if not replica_enabled() or getattr(request.state, SHARED_DB_STATE, None) is not None:
+        async with _primary(request) as db:
+            yield db
+        return
+    lag = replica_lag()
+    if lag is not None:
+        metrics.set_gauge("replica.lag_seconds", round(lag, 3))
+    if lag is None or lag > REPLICA_MAX_LAG_SECONDS:
+        metrics.inc("replica.fallbacks")
+        async with _primary(request) as db:
+            yield db
+        return
+    metrics.inc("replica.reads")
+    replica = await connect_db(replica=REPLICA_PATH)
+    try:
+        yield replica
+    finally:
+        await replica.close()
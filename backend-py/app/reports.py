@@ -0,0 +1,229 @@
+"""
+Reports for the /reports page.
+
+Each report is one SQL statement over the (user_id, date) index; comparisons
+with earlier periods and rolling sums are window functions over a numeric
+period key instead of one query per month or per day:
+
+  monthly  — totals per category and month with the previous month and the
+             same month a year earlier (RANGE frames, so gaps in the data do
+             not shift the comparison)
+  rolling  — spend per day with rolling 30- and 90-day sums
+  top      — top-N categories with rank and share of the total
+  weekday  — average spend per day of week over the calendar days of the period
+
+Amounts are converted to `?currency=` (BASE_CURRENCY by default) with the
+rate of each transaction's day, see app/currency.py. SQL sums integer cents;
+totals become decimal strings only in the response.
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+import logging
+import os
+
+from .replica import get_read_db
+from .auth import get_current_user
+from .models import User, CategoryType, ReportsResponse
+from .fingerprints import cents_to_amount
+from .timestamps import day_ms, sql_day, sql_month_key, sql_weekday, sql_next_day, sql_day_number
+from .currency import BASE_CURRENCY, FX_JOIN, CONVERTED_CENTS, MissingRateError, prepare_conversion
+from . import metrics
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+REPORTS = ("monthly", "rolling", "top", "weekday")
+
+# Границы периода: даты хранятся в epoch ms, а rolling строит ряд по всем дням периода
+EARLIEST_DATE = date(1970, 1, 1)
+LATEST_DATE = date(9998, 12, 31)
+REPORTS_MAX_DAYS = int(os.getenv("REPORTS_MAX_DAYS", "3700"))   # ~10 лет
+
+def _month_index(day: date) -> int:
+    return day.year * 12 + day.month - 1
+
+def _history_start(start: date) -> date:
+    """First day of the month a year before `start`: the monthly windows look that far back."""
+    return date(start.year - 1, start.month, 1)
+
+# Номер месяца как число: окна RANGE N PRECEDING отсчитывают календарные месяцы
+MONTH_KEY = sql_month_key("t.date")
+
+async def monthly_report(db, user_id: int, start: date, end: date) -> List[dict]:
+    # Год истории до начала периода нужен только для окон, в ответ не попадает
+    history_start = _history_start(start)
+    cursor = await db.execute(
+        f"""WITH monthly AS (
+               SELECT t.category_id, {MONTH_KEY} AS month_key,
+                      SUM({CONVERTED_CENTS}) AS total, COUNT(*) AS count
+               FROM transactions t {FX_JOIN}
+               WHERE t.user_id = ? AND t.date >= ? AND t.date < ?
+               GROUP BY t.category_id, month_key
+           ), compared AS (
+               SELECT m.*,
+                      SUM(m.total) OVER (PARTITION BY m.category_id ORDER BY m.month_key
+                                         RANGE BETWEEN 1 PRECEDING AND 1 PRECEDING) AS prev_month,
+                      SUM(m.total) OVER (PARTITION BY m.category_id ORDER BY m.month_key
+                                         RANGE BETWEEN 12 PRECEDING AND 12 PRECEDING) AS prev_year
+               FROM monthly m
+           )
+           SELECT x.*, c.name, c.type, c.color
+           FROM compared x JOIN categories c ON c.id = x.category_id
+           WHERE x.month_key >= ?
+           ORDER BY x.month_key, c.type, x.total DESC""",
+        (user_id, day_ms(history_start), day_ms(end + timedelta(days=1)), _month_index(start))
+    )
+    result = []
+    async for row in cursor:
+        total, prev_month, prev_year = row["total"], row["prev_month"], row["prev_year"]
+        result.append({
+            "month": f"{row['month_key'] // 12:04d}-{row['month_key'] % 12 + 1:02d}",
+            "category_id": row["category_id"],
+            "category_name": row["name"],
+            "category_type": row["type"],
+            "category_color": row["color"],
+            "total": cents_to_amount(total),
+            "count": row["count"],
+            "prev_month": cents_to_amount(prev_month) if prev_month is not None else None,
+            "prev_year": cents_to_amount(prev_year) if prev_year is not None else None,
+            "mom_change": round(total / prev_month - 1, 4) if prev_month else None,
+            "yoy_change": round(total / prev_year - 1, 4) if prev_year else None,
+        })
+    return result
+
+async def rolling_report(db, user_id: int, start: date, end: date, category_type: CategoryType) -> List[dict]:
+    # Плотный ряд дней (рекурсивный CTE), чтобы окна считались и по дням без трат
+    history_start = start - timedelta(days=89)
+    cursor = await db.execute(
+        f"""WITH RECURSIVE days(day) AS (
+               SELECT CAST(? AS TEXT) UNION ALL SELECT {sql_next_day('day')} FROM days WHERE day < ?
+           ), daily AS (
+               SELECT {sql_day('t.date')} AS day, SUM({CONVERTED_CENTS}) AS total
+               FROM transactions t JOIN categories c ON c.id = t.category_id {FX_JOIN}
+               WHERE t.user_id = ? AND c.type = ? AND t.date >= ? AND t.date < ?
+               -- не "day": PostgreSQL сначала ищет это имя среди колонок (fx.day)
+               GROUP BY {sql_day('t.date')}
+           ), rolled AS (
+               SELECT d.day, COALESCE(s.total, 0) AS total,
+                      SUM(COALESCE(s.total, 0)) OVER (ORDER BY {sql_day_number('d.day')}
+                          RANGE BETWEEN 29 PRECEDING AND CURRENT ROW) AS rolling_30,
+                      SUM(COALESCE(s.total, 0)) OVER (ORDER BY {sql_day_number('d.day')}
+                          RANGE BETWEEN 89 PRECEDING AND CURRENT ROW) AS rolling_90
+               FROM days d LEFT JOIN daily s ON s.day = d.day
+           )
+           SELECT * FROM rolled WHERE day >= ? ORDER BY day""",
+        (history_start.isoformat(), end.isoformat(), user_id, category_type.value,
+         day_ms(history_start), day_ms(end + timedelta(days=1)), start.isoformat())
+    )
+    return [
+        {"date": row["day"], "total": cents_to_amount(row["total"]),
+         "rolling_30": cents_to_amount(row["rolling_30"]), "rolling_90": cents_to_amount(row["rolling_90"])}
+        async for row in cursor
+    ]
+
+async def top_report(db, user_id: int, start: date, end: date, category_type: CategoryType,
+                     limit: int) -> List[dict]:
+    cursor = await db.execute(
+        f"""SELECT * FROM (
+               SELECT c.id, c.name, c.color, c.icon, SUM({CONVERTED_CENTS}) AS total, COUNT(*) AS count,
+                      RANK() OVER (ORDER BY SUM({CONVERTED_CENTS}) DESC) AS rank,
+                      SUM({CONVERTED_CENTS}) * 1.0 / SUM(SUM({CONVERTED_CENTS})) OVER () AS share
+               FROM transactions t JOIN categories c ON c.id = t.category_id {FX_JOIN}
+               WHERE t.user_id = ? AND c.type = ? AND t.date >= ? AND t.date < ?
+               GROUP BY c.id
+           ) ranked WHERE rank <= ? ORDER BY rank, name""",
+        (user_id, category_type.value, day_ms(start), day_ms(end + timedelta(days=1)), limit)
+    )
+    return [
+        {"rank": row["rank"], "category_id": row["id"], "category_name": row["name"],
+         "category_color": row["color"], "category_icon": row["icon"],
+         "total": cents_to_amount(row["total"]), "count": row["count"], "share": round(row["share"], 4)}
+        async for row in cursor
+    ]
+
+async def weekday_report(db, user_id: int, start: date, end: date, category_type: CategoryType) -> List[dict]:
+    cursor = await db.execute(
+        f"""SELECT {sql_weekday('t.date')} AS weekday,
+                  SUM({CONVERTED_CENTS}) AS total, COUNT(*) AS count
+           FROM transactions t JOIN categories c ON c.id = t.category_id {FX_JOIN}
+           WHERE t.user_id = ? AND c.type = ? AND t.date >= ? AND t.date < ?
+           GROUP BY weekday""",
+        (user_id, category_type.value, day_ms(start), day_ms(end + timedelta(days=1)))
+    )
+    totals = {row["weekday"]: (row["total"], row["count"]) async for row in cursor}
+    # Сколько раз каждый день недели встречается в периоде (0 = воскресенье, как в sql_weekday)
+    days = (end - start).days + 1
+    first = (start.weekday() + 1) % 7
+    result = []
+    for weekday in range(7):
+        occurrences = days // 7 + (1 if (weekday - first) % 7 < days % 7 else 0)
+        total, count = totals.get(weekday, (0, 0))
+        result.append({
+            "weekday": weekday,
+            "days": occurrences,
+            "total": cents_to_amount(total),
+            "count": count,
+            "average": cents_to_amount(round(total / occurrences) if occurrences else 0),
+        })
+    return result
+
+@router.get("/", response_model=ReportsResponse)
+async def get_reports(
+    current_user: User = Depends(get_current_user),
+    start_date: Optional[date] = Query(None, ge=EARLIEST_DATE, le=LATEST_DATE),
+    end_date: Optional[date] = Query(None, ge=EARLIEST_DATE, le=LATEST_DATE),
+    type: CategoryType = Query(CategoryType.EXPENSE),
+    top: int = Query(5, ge=1, le=50),
+    reports: Optional[str] = Query(None, description="Comma-separated subset of: " + ", ".join(REPORTS)),
+    currency: Optional[str] = Query(None, pattern=r"^[A-Za-z]{3}$"),
+    db = Depends(get_read_db)
+):
+    # По умолчанию — последние 12 месяцев, включая текущий
+    end = end_date or date.today()
+    first_month = _month_index(end) - 11
+    start = start_date or date(first_month // 12, first_month % 12 + 1, 1)
+    if start > end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start_date must not be after end_date"
+        )
+    if (end - start).days >= REPORTS_MAX_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The period must not be longer than {REPORTS_MAX_DAYS} days"
+        )
+    wanted = [name.strip() for name in reports.split(",")] if reports else list(REPORTS)
+    unknown = [name for name in wanted if name not in REPORTS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown reports: {', '.join(unknown)}"
+        )
+
+    # Курсы на все дни периода, включая историю для окон monthly/rolling
+    target = (currency or BASE_CURRENCY).upper()
+    try:
+        await prepare_conversion(db, current_user.id, _history_start(start),
+                                 end + timedelta(days=1), target)
+    except MissingRateError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+    builders = {
+        "monthly": lambda: monthly_report(db, current_user.id, start, end),
+        "rolling": lambda: rolling_report(db, current_user.id, start, end, type),
+        "top": lambda: top_report(db, current_user.id, start, end, type, top),
+        "weekday": lambda: weekday_report(db, current_user.id, start, end, type),
+    }
+    result = {}
+    for name in wanted:
+        with metrics.timed(f"reports.{name}"):
+            result[name] = await builders[name]()
+
+    return ReportsResponse(
+        period_start=datetime.combine(start, datetime.min.time()),
+        period_end=datetime.combine(end, datetime.max.time()),
+        type=type,
+        currency=target,
+        **result
+    )
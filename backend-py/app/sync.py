@@ -1,263 +1,642 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List, Dict, Any
-from datetime import datetime
-import uuid
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+from typing import List, Dict, Any, AsyncIterator, Iterable, Iterator, Optional, Set, Tuple, Type, TypeVar
+from datetime import datetime, timezone
+from itertools import islice
+import asyncio
+import json
 import logging
+import os
+import sys
+import tempfile
 
 from .db import get_db
+from .replica import get_read_db
 from .auth import get_current_user
-from .models import User, Category, Transaction, SyncRequest, SyncResponse
+from .fingerprints import (
+    transaction_fingerprint, find_duplicate, amount_to_cents, cents_to_amount, DUPLICATE_MODE,
+    category_hash, transaction_hash,
+)
+from .models import (
+    User, Category, Transaction, SyncRequest, SyncResponse, DuplicateMode,
+    CategoryBase, TransactionBase, RecordPatch,
+)
+from .changes import (
+    log_change, latest_change, changes_since, RecordChange,
+    CATEGORIES, TRANSACTIONS, INSERT, UPDATE,
+)
+from .locks import user_write_transaction
+from .recurring import materialize_due
+from .transactions import TRANSACTION_COLUMNS, transaction_from_row
+from .categories import category_from_row
+from .timestamps import to_ms, from_ms
+from .wire import encode_sync_response, SYNC_RESPONSES
+from .jsonstream import stream_sections, JsonStreamError
+from . import metrics
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-async def resolve_conflicts_lww(server_item: dict, client_item: dict) -> dict:
-    """Last-Writer-Wins conflict resolution"""
-    server_updated = datetime.fromisoformat(server_item["updated_at"].replace('Z', '+00:00'))
-    client_updated = datetime.fromisoformat(client_item["updated_at"].replace('Z', '+00:00'))
-    
-    if client_updated > server_updated:
-        return client_item
-    else:
-        return server_item
-
-async def sync_categories(db, user_id: int, client_categories: List[Category]) -> tuple[List[Category], List[dict]]:
-    """Sync categories between client and server"""
-    conflicts = []
-    
-    # Get all server categories
-    cursor = await db.execute(
-        """SELECT id, user_id, name, type, color, icon, sync_id, created_at, updated_at 
-           FROM categories WHERE user_id = ?""",
-        (user_id,)
+# Fields merged one by one (each has its own version in field_versions)
+CATEGORY_FIELDS = ("name", "type", "color", "icon")
+TRANSACTION_FIELDS = ("amount", "currency", "description", "date", "category_id")
+
+# Server columns a merge needs, read by merge_join
+CATEGORY_MERGE_COLUMNS = "id, sync_id, name, type, color, icon, updated_at, field_versions, content_hash"
+TRANSACTION_MERGE_COLUMNS = (
+    "id, sync_id, amount_cents, currency, description, date, category_id, updated_at, field_versions, content_hash"
+)
+
+# SQLite limit on host parameters per statement (IN lists are chunked)
+SQL_VARS_PER_QUERY = 500
+
+# Client records reconciled per sorted chunk: bounds memory whatever the account size
+SYNC_MERGE_CHUNK = min(int(os.getenv("SYNC_MERGE_CHUNK", "400")), SQL_VARS_PER_QUERY - 1)
+
+# Records of a push body written per transaction while the rest is still uploading
+SYNC_PUSH_BATCH = int(os.getenv("SYNC_PUSH_BATCH", "1000"))
+
+# Arrays of a SyncRequest body; each record is validated as soon as it is parsed
+PUSH_SECTIONS = {
+    "categories": Category.model_validate,
+    "category_patches": RecordPatch.model_validate,
+    "transactions": Transaction.model_validate,
+    "transaction_patches": RecordPatch.model_validate,
+}
+
+# Deferred records (transactions before their category) kept in memory up to this many bytes, then on disk
+SYNC_DEFERRED_MEMORY = int(os.getenv("SYNC_DEFERRED_MEMORY", str(8 * 1024 * 1024)))
+
+def parse_option(key: str, value: Any) -> Any:
+    """A top-level member of the push body other than PUSH_SECTIONS, validated as soon as it is read."""
+    if key not in SyncRequest.model_fields:
+        return value
+    return getattr(SyncRequest.model_validate({key: value}), key)
+
+class DeferredRecords:
+    """Push records whose category had not arrived yet, retried once the body is done.
+
+    Kept as JSON lines in a SpooledTemporaryFile, so a body that sends all its
+    categories last costs SYNC_DEFERRED_MEMORY bytes at most, the rest is on
+    disk. Only the fields the client sent are kept (merges use model_fields_set).
+    """
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=SYNC_DEFERRED_MEMORY, mode="w+", encoding="utf-8")
+        self.count = 0
+
+    def append(self, item: Tuple[str, BaseModel]):
+        section, record = item
+        self.file.write(f"{section}\t{record.model_dump_json(exclude_unset=True)}\n")
+        self.count += 1
+
+    def batches(self, section: str, size: int) -> Iterator[List[Any]]:
+        """The deferred records of `section`, in body order, validated again, `size` at a time."""
+        parse = PUSH_SECTIONS[section]
+        self.file.seek(0)
+        batch: List[Any] = []
+        for line in self.file:
+            name, _, data = line.partition("\t")
+            if name != section:
+                continue
+            batch.append(parse(json.loads(data)))
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def close(self):
+        self.file.close()
+
+def _utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def _same(a, b) -> bool:
+    if isinstance(a, datetime) and isinstance(b, datetime):
+        return _utc(a) == _utc(b)
+    return a == b
+
+def _fingerprint(user_id: int, category_id: int, txn) -> str:
+    return transaction_fingerprint(user_id, txn.date, amount_to_cents(txn.amount), category_id, txn.description)
+
+def _category_hash(category) -> str:
+    return category_hash(category.name, category.type.value, category.color, category.icon)
+
+def _transaction_hash(txn, category_id: int) -> str:
+    return transaction_hash(amount_to_cents(txn.amount), txn.currency, txn.description, to_ms(txn.date), category_id)
+
+def _patch_times(patch: RecordPatch) -> Dict[str, int]:
+    """Edit time of each patched field, epoch ms like the columns it is compared with."""
+    return {f: to_ms(patch.field_updated_at.get(f, patch.updated_at)) for f in patch.fields}
+
+def _row_patch(item: BaseModel, fields: Tuple[str, ...]) -> RecordPatch:
+    """A full row from an older client is a patch of every field it sent, at its updated_at."""
+    return RecordPatch(sync_id=item.sync_id, updated_at=item.updated_at,
+                       fields={f: getattr(item, f) for f in fields if f in item.model_fields_set})
+
+def merge_fields(model: Type[BaseModel], fields: Tuple[str, ...], row: dict,
+                 patch_fields: Dict[str, Any], patch_times: Dict[str, int]):
+    """Field-level Last-Writer-Wins.
+
+    A client value wins when it was written after the server's value of the
+    same field; untouched fields never conflict. Returns the merged record,
+    the changed values, the new field_versions and the rejected fields.
+    Raises ValidationError when the merged record is not valid.
+    """
+    versions = json.loads(row["field_versions"] or "{}")
+    current = model(**{f: row[f] for f in fields})
+    candidate = model(**{**current.model_dump(), **patch_fields})
+
+    changes, rejected = {}, {}
+    for field in patch_fields:
+        new, old = getattr(candidate, field), getattr(current, field)
+        if _same(new, old):
+            continue
+        server_time = versions.get(field) or row["updated_at"]
+        if patch_times[field] > server_time:
+            changes[field] = new
+            versions[field] = patch_times[field]
+        else:
+            rejected[field] = {"client": new, "server": old}
+
+    merged = model(**{**current.model_dump(), **changes})
+    return merged, changes, versions, rejected
+
+async def _write_changes(db, table: str, row: dict, columns: Dict[str, Any],
+                         versions: dict, times: List[int]):
+    """UPDATE only the changed columns; updated_at moves to the newest applied edit."""
+    columns = dict(columns)
+    columns["field_versions"] = json.dumps(versions)
+    columns["updated_at"] = max([row["updated_at"], *times])
+    assignments = ", ".join(f"{name} = ?" for name in columns)
+    await db.execute(
+        f"UPDATE {table} SET {assignments} WHERE id = ?",
+        [*columns.values(), row["id"]]
     )
-    server_categories = {row["sync_id"]: dict(row) for row in await cursor.fetchall()}
-    
-    # Process client categories
-    client_sync_ids = set()
-    for client_cat in client_categories:
-        client_sync_ids.add(client_cat.sync_id)
+
+def _field_conflict(kind: str, sync_id: str, rejected: dict) -> dict:
+    return {"type": "field", "table": kind, "sync_id": sync_id, "fields": rejected}
+
+def _invalid(kind: str, sync_id: str, error: str) -> dict:
+    return {"type": "invalid", "table": kind, "sync_id": sync_id, "error": error}
+
+T = TypeVar("T")
+
+async def merge_join(db, table: str, columns: str, user_id: int,
+                     items: Iterable[T]) -> AsyncIterator[Tuple[T, Optional[Any]]]:
+    """Pair every client record with its server row (None when the server has none).
+
+    The batch is cut into chunks of SYNC_MERGE_CHUNK; each chunk is sorted by
+    sync_id and merged against the rows of its keys, read in sync_id order
+    over the unique sync_id index. Only keys present in the batch are read and
+    peak memory is one chunk, not the account. A key repeated in the batch is
+    read again, because the caller has just written it.
+    """
+    point = f"SELECT {columns} FROM {table} WHERE user_id = ? AND sync_id = ?"
+    pending = iter(items)
+    while True:
+        chunk = sorted(islice(pending, SYNC_MERGE_CHUNK), key=lambda item: item.sync_id)
+        if not chunk:
+            return
+        keys = sorted({item.sync_id for item in chunk})
+        cursor = await db.execute(
+            f"""SELECT {columns} FROM {table}
+                WHERE user_id = ? AND sync_id IN ({','.join('?' * len(keys))}) ORDER BY sync_id""",
+            (user_id, *keys)
+        )
+        rows = await cursor.fetchall()
+        position, previous = 0, None
+        for item in chunk:
+            key = item.sync_id
+            if key == previous:
+                row = await (await db.execute(point, (user_id, key))).fetchone()
+            else:
+                while position < len(rows) and rows[position]["sync_id"] < key:
+                    position += 1
+                row = rows[position] if position < len(rows) and rows[position]["sync_id"] == key else None
+            previous = key
+            yield item, row
+
+async def _category_id(db, user_id: int, sync_id: Optional[str], cache: Dict[str, Optional[int]]) -> Optional[int]:
+    """Server id of a category the client knows by sync_id (one lookup per sync)."""
+    if sync_id not in cache:
+        cursor = await db.execute(
+            "SELECT id FROM categories WHERE sync_id = ? AND user_id = ?", (sync_id, user_id)
+        )
+        row = await cursor.fetchone()
+        cache[sync_id] = row["id"] if row else None
+    return cache[sync_id]
+
+async def merge_category(db, user_id: int, row, patch: RecordPatch, conflicts: List[dict],
+                         echoed: Dict[str, Set[str]], counts: Dict[str, int]):
+    """Apply a category patch to its server row."""
+    unknown = set(patch.fields) - set(CATEGORY_FIELDS)
+    if unknown:
+        conflicts.append(_invalid("category", patch.sync_id, f"Unknown fields: {sorted(unknown)}"))
+        return
+    times = _patch_times(patch)
+    try:
+        merged, changes, versions, rejected = merge_fields(
+            CategoryBase, CATEGORY_FIELDS, row, patch.fields, times
+        )
+    except ValidationError as e:
+        conflicts.append(_invalid("category", patch.sync_id, str(e)))
+        return
+
+    if changes:
+        columns = {f: merged.type.value if f == "type" else getattr(merged, f) for f in changes}
+        columns["content_hash"] = _category_hash(merged)
+        await _write_changes(db, "categories", row, columns, versions, [times[f] for f in changes])
+        await log_change(db, user_id, CATEGORIES, patch.sync_id, UPDATE, changes)
+    counts["written" if changes else "skipped"] += 1
+    if rejected:
+        conflicts.append(_field_conflict("category", patch.sync_id, rejected))
+    echoed[patch.sync_id] = set(patch.fields) - set(rejected)
+
+async def sync_categories(db, user_id: int, client_categories: List[Category],
+                          patches: List[RecordPatch]) -> Tuple[List[dict], Dict[str, Set[str]], Dict[str, int]]:
+    """Sync categories between client and server.
+
+    Returns the conflicts, per sync_id the fields the client already has, and
+    the number of records written and skipped as unchanged.
+    """
+    conflicts: List[dict] = []
+    echoed: Dict[str, Set[str]] = {}
+    counts = {"written": 0, "skipped": 0}
+
+    async for client_cat, row in merge_join(db, "categories", CATEGORY_MERGE_COLUMNS, user_id, client_categories):
+        if row is not None and row["content_hash"] == _category_hash(client_cat):
+            # Same content as the server row: nothing to merge or write
+            echoed[client_cat.sync_id] = set(CATEGORY_FIELDS) & client_cat.model_fields_set
+            counts["skipped"] += 1
+            continue
+        if row is not None:
+            await merge_category(db, user_id, row, _row_patch(client_cat, CATEGORY_FIELDS), conflicts, echoed,
+                                 counts)
+            continue
+        # Create new category
+        await db.execute(
+            """INSERT INTO categories (user_id, name, type, color, icon, sync_id, created_at, updated_at,
+                                       content_hash)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (user_id, client_cat.name, client_cat.type.value, client_cat.color,
+             client_cat.icon, client_cat.sync_id, 
+             to_ms(client_cat.created_at), to_ms(client_cat.updated_at), _category_hash(client_cat))
+        )
+        await log_change(db, user_id, CATEGORIES, client_cat.sync_id, INSERT)
+        echoed[client_cat.sync_id] = set(CATEGORY_FIELDS)
+        counts["written"] += 1
+
+    async for patch, row in merge_join(db, "categories", CATEGORY_MERGE_COLUMNS, user_id, patches):
+        if row is None:
+            conflicts.append({"type": "unknown", "table": "category", "sync_id": patch.sync_id})
+        else:
+            await merge_category(db, user_id, row, patch, conflicts, echoed, counts)
+
+    return conflicts, echoed, counts
+
+async def merge_transaction(db, user_id: int, row, patch: RecordPatch, conflicts: List[dict],
+                            echoed: Dict[str, Set[str]], counts: Dict[str, int],
+                            category_ids: Dict[str, Optional[int]], defer: bool = False) -> bool:
+    """Apply a transaction patch to its server row.
+
+    With `defer`, a patch pointing to an unknown category is left alone and
+    False is returned, so the caller can retry it later."""
+    row = {**dict(row), "amount": cents_to_amount(row["amount_cents"]), "date": from_ms(row["date"])}
+
+    fields = dict(patch.fields)
+    times = _patch_times(patch)
+    if "category_sync_id" in fields:
+        # Clients know categories by sync_id, the column holds the server id
+        category_id = await _category_id(db, user_id, fields.pop("category_sync_id"), category_ids)
+        if category_id is None:
+            if defer:
+                return False
+            conflicts.append(_invalid("transaction", patch.sync_id, "Category not found"))
+            return True
+        fields["category_id"] = category_id
+        times["category_id"] = times.pop("category_sync_id")
+
+    unknown = set(fields) - set(TRANSACTION_FIELDS)
+    if unknown:
+        conflicts.append(_invalid("transaction", patch.sync_id, f"Unknown fields: {sorted(unknown)}"))
+        return True
+    try:
+        merged, changes, versions, rejected = merge_fields(
+            TransactionBase, TRANSACTION_FIELDS, row, fields, times
+        )
+    except ValidationError as e:
+        conflicts.append(_invalid("transaction", patch.sync_id, str(e)))
+        return True
+
+    if changes:
+        columns = {}
+        for f in changes:
+            value = getattr(merged, f)
+            if f == "amount":
+                columns["amount_cents"] = amount_to_cents(value)
+            else:
+                columns[f] = to_ms(value) if f == "date" else value
+        columns["fingerprint"] = _fingerprint(user_id, merged.category_id, merged)
+        columns["content_hash"] = _transaction_hash(merged, merged.category_id)
+        await _write_changes(db, "transactions", row, columns, versions, [times[f] for f in changes])
+        await log_change(db, user_id, TRANSACTIONS, patch.sync_id, UPDATE, changes)
+    counts["written" if changes else "skipped"] += 1
+    if rejected:
+        conflicts.append(_field_conflict("transaction", patch.sync_id, rejected))
+    echoed[patch.sync_id] = {
+        "category_sync_id" if f == "category_id" else f for f in fields if f not in rejected
+    }
+    return True
+
+async def sync_transactions(db, user_id: int, client_transactions: List[Transaction],
+                            patches: List[RecordPatch], deferred: Optional[DeferredRecords] = None
+                            ) -> Tuple[List[dict], Dict[str, Set[str]], Dict[str, int]]:
+    """Sync transactions between client and server.
+
+    Returns the conflicts, per sync_id the fields the client already has, and
+    the number of records written and skipped as unchanged. Records whose category is not on the server go to `deferred` (as
+    ("transactions" | "transaction_patches", record)) when it is given.
+    """
+    conflicts: List[dict] = []
+    echoed: Dict[str, Set[str]] = {}
+    counts = {"written": 0, "skipped": 0}
+    category_ids: Dict[str, Optional[int]] = {}
+
+    async for client_txn, row in merge_join(db, "transactions", TRANSACTION_MERGE_COLUMNS, user_id,
+                                            client_transactions):
+        if row is not None and row["content_hash"] == _transaction_hash(client_txn, client_txn.category_id):
+            # Same content as the server row: nothing to merge or write
+            echoed[client_txn.sync_id] = {
+                "category_sync_id" if f == "category_id" else f
+                for f in TRANSACTION_FIELDS if f in client_txn.model_fields_set
+            }
+            counts["skipped"] += 1
+            continue
+        if row is not None:
+            if not await merge_transaction(db, user_id, row, _row_patch(client_txn, TRANSACTION_FIELDS),
+                                           conflicts, echoed, counts, category_ids, deferred is not None):
+                deferred.append(("transactions", client_txn))
+            continue
+
+        # Create new transaction
+        # First, verify category exists (map sync_id to actual id)
+        category_id = await _category_id(
+            db, user_id, client_txn.category.sync_id if client_txn.category else None, category_ids
+        )
+        if category_id is None and deferred is not None:
+            deferred.append(("transactions", client_txn))
+            continue
+        if category_id is None:
+            # Category not found, skip this transaction or create default category
+            logger.warning(f"Category not found for transaction {client_txn.sync_id}")
+            continue
         
-        if client_cat.sync_id in server_categories:
-            # Update existing category (check for conflicts)
-            server_cat = server_categories[client_cat.sync_id]
-            
-            # Check if there's a conflict
-            server_updated = datetime.fromisoformat(server_cat["updated_at"].replace('Z', '+00:00'))
-            client_updated = client_cat.updated_at
-            
-            if abs((server_updated - client_updated).total_seconds()) > 1:  # 1 second tolerance
-                # Conflict detected
-                resolved = await resolve_conflicts_lww(server_cat, client_cat.dict())
+        fingerprint = _fingerprint(user_id, category_id, client_txn)
+        if DUPLICATE_MODE != DuplicateMode.ALLOW:
+            duplicate = await find_duplicate(db, user_id, fingerprint)
+            if duplicate:
+                # The client gets the server list back and replaces its copy
                 conflicts.append({
-                    "type": "category",
-                    "sync_id": client_cat.sync_id,
-                    "server_version": server_cat,
-                    "client_version": client_cat.dict(),
-                    "resolved_version": resolved
+                    "type": "duplicate",
+                    "sync_id": client_txn.sync_id,
+                    "duplicate_of": duplicate["sync_id"],
+                    "resolution": DUPLICATE_MODE.value
                 })
-                
-                if resolved == client_cat.dict():
-                    # Update server with client version
-                    await db.execute(
-                        """UPDATE categories 
-                           SET name = ?, type = ?, color = ?, icon = ?, updated_at = ?
-                           WHERE sync_id = ? AND user_id = ?""",
-                        (client_cat.name, client_cat.type.value, client_cat.color,
-                         client_cat.icon, client_cat.updated_at.isoformat(),
-                         client_cat.sync_id, user_id)
-                    )
-            else:
-                # No conflict, update server
-                await db.execute(
-                    """UPDATE categories 
-                       SET name = ?, type = ?, color = ?, icon = ?, updated_at = ?
-                       WHERE sync_id = ? AND user_id = ?""",
-                    (client_cat.name, client_cat.type.value, client_cat.color,
-                     client_cat.icon, client_cat.updated_at.isoformat(),
-                     client_cat.sync_id, user_id)
-                )
-        else:
-            # Create new category
-            await db.execute(
-                """INSERT INTO categories (user_id, name, type, color, icon, sync_id, created_at, updated_at)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                (user_id, client_cat.name, client_cat.type.value, client_cat.color,
-                 client_cat.icon, client_cat.sync_id, 
-                 client_cat.created_at.isoformat(), client_cat.updated_at.isoformat())
-            )
-    
-    # Get all categories after sync
+                continue
+        
+        await db.execute(
+            """INSERT INTO transactions (user_id, category_id, amount_cents, currency, description, date, sync_id,
+                                         created_at, updated_at, fingerprint, content_hash)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (user_id, category_id, amount_to_cents(client_txn.amount), client_txn.currency, client_txn.description,
+             to_ms(client_txn.date), client_txn.sync_id,
+             to_ms(client_txn.created_at), to_ms(client_txn.updated_at),
+             fingerprint, _transaction_hash(client_txn, category_id))
+        )
+        await log_change(db, user_id, TRANSACTIONS, client_txn.sync_id, INSERT)
+        echoed[client_txn.sync_id] = {"amount", "currency", "description", "date", "category_sync_id"}
+        counts["written"] += 1
+
+    async for patch, row in merge_join(db, "transactions", TRANSACTION_MERGE_COLUMNS, user_id, patches):
+        if row is None and deferred is not None:
+            # Its transaction may itself wait for a category
+            deferred.append(("transaction_patches", patch))
+        elif row is None:
+            conflicts.append({"type": "unknown", "table": "transaction", "sync_id": patch.sync_id})
+        elif not await merge_transaction(db, user_id, row, patch, conflicts, echoed, counts, category_ids,
+                                         deferred is not None):
+            deferred.append(("transaction_patches", patch))
+
+    return conflicts, echoed, counts
+
+async def load_categories(db, user_id: int) -> List[Category]:
     cursor = await db.execute(
         """SELECT id, user_id, name, type, color, icon, sync_id, created_at, updated_at 
            FROM categories WHERE user_id = ? ORDER BY name""",
         (user_id,)
     )
-    
-    final_categories = []
-    for row in await cursor.fetchall():
-        final_categories.append(Category(**dict(row)))
-    
-    return final_categories, conflicts
+    return [Category(**category_from_row(row)) for row in await cursor.fetchall()]
 
-async def sync_transactions(db, user_id: int, client_transactions: List[Transaction]) -> tuple[List[Transaction], List[dict]]:
-    """Sync transactions between client and server"""
-    conflicts = []
-    
-    # Get all server transactions
+async def load_transactions(db, user_id: int) -> List[Transaction]:
     cursor = await db.execute(
-        """SELECT id, user_id, category_id, amount, description, date, sync_id, created_at, updated_at 
-           FROM transactions WHERE user_id = ?""",
+        f"""SELECT {TRANSACTION_COLUMNS}
+            FROM transactions t
+            LEFT JOIN categories c ON t.category_id = c.id
+            WHERE t.user_id = ? 
+            ORDER BY t.date DESC""",
         (user_id,)
     )
-    server_transactions = {row["sync_id"]: dict(row) for row in await cursor.fetchall()}
-    
-    # Process client transactions
-    client_sync_ids = set()
-    for client_txn in client_transactions:
-        client_sync_ids.add(client_txn.sync_id)
-        
-        if client_txn.sync_id in server_transactions:
-            # Update existing transaction (check for conflicts)
-            server_txn = server_transactions[client_txn.sync_id]
-            
-            # Check if there's a conflict
-            server_updated = datetime.fromisoformat(server_txn["updated_at"].replace('Z', '+00:00'))
-            client_updated = client_txn.updated_at
-            
-            if abs((server_updated - client_updated).total_seconds()) > 1:  # 1 second tolerance
-                # Conflict detected
-                resolved = await resolve_conflicts_lww(server_txn, client_txn.dict())
-                conflicts.append({
-                    "type": "transaction",
-                    "sync_id": client_txn.sync_id,
-                    "server_version": server_txn,
-                    "client_version": client_txn.dict(),
-                    "resolved_version": resolved
-                })
-                
-                if resolved == client_txn.dict():
-                    # Update server with client version
-                    await db.execute(
-                        """UPDATE transactions 
-                           SET category_id = ?, amount = ?, description = ?, date = ?, updated_at = ?
-                           WHERE sync_id = ? AND user_id = ?""",
-                        (client_txn.category_id, float(client_txn.amount), client_txn.description,
-                         client_txn.date.isoformat(), client_txn.updated_at.isoformat(),
-                         client_txn.sync_id, user_id)
-                    )
-            else:
-                # No conflict, update server
-                await db.execute(
-                    """UPDATE transactions 
-                       SET category_id = ?, amount = ?, description = ?, date = ?, updated_at = ?
-                       WHERE sync_id = ? AND user_id = ?""",
-                    (client_txn.category_id, float(client_txn.amount), client_txn.description,
-                     client_txn.date.isoformat(), client_txn.updated_at.isoformat(),
-                     client_txn.sync_id, user_id)
-                )
-        else:
-            # Create new transaction
-            # First, verify category exists (map sync_id to actual id)
-            cursor = await db.execute(
-                "SELECT id FROM categories WHERE sync_id = ? AND user_id = ?",
-                (client_txn.category.sync_id if client_txn.category else None, user_id)
-            )
-            category_row = await cursor.fetchone()
-            
-            if category_row:
-                category_id = category_row["id"]
-            else:
-                # Category not found, skip this transaction or create default category
-                logger.warning(f"Category not found for transaction {client_txn.sync_id}")
-                continue
-            
-            await db.execute(
-                """INSERT INTO transactions (user_id, category_id, amount, description, date, sync_id, created_at, updated_at)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                (user_id, category_id, float(client_txn.amount), client_txn.description,
-                 client_txn.date.isoformat(), client_txn.sync_id,
-                 client_txn.created_at.isoformat(), client_txn.updated_at.isoformat())
-            )
-    
-    # Get all transactions after sync with category info
-    cursor = await db.execute(
-        """SELECT t.id, t.user_id, t.category_id, t.amount, t.description, 
-                  t.date, t.sync_id, t.created_at, t.updated_at,
-                  c.name as category_name, c.type as category_type, 
-                  c.color as category_color, c.icon as category_icon
+    return [transaction_from_row(row) for row in await cursor.fetchall()]
+
+async def _rows_by_sync_id(db, query: str, user_id: int, sync_ids: List[str]) -> Dict[str, Any]:
+    rows = {}
+    for start in range(0, len(sync_ids), SQL_VARS_PER_QUERY):
+        chunk = sync_ids[start:start + SQL_VARS_PER_QUERY]
+        cursor = await db.execute(query.format(marks=",".join("?" * len(chunk))), (user_id, *chunk))
+        for row in await cursor.fetchall():
+            rows[row["sync_id"]] = row
+    return rows
+
+def _change_patch(sync_id: str, change: RecordChange, row, values: Dict[str, Any],
+                  skip: Set[str]) -> Optional[RecordPatch]:
+    """Patch for one logged change, minus the fields the client has just sent."""
+    if change.deleted:
+        if change.created:
+            return None   # created and deleted since the client's seq: never seen
+        return RecordPatch(sync_id=sync_id, updated_at=from_ms(change.changed_at), fields={}, deleted=True)
+    if row is None:
+        return None
+
+    versions = json.loads(row["field_versions"] or "{}")
+    updated_at = row["updated_at"]
+    patch = RecordPatch(sync_id=sync_id, updated_at=from_ms(updated_at), fields={},
+                        created_at=from_ms(row["created_at"]) if change.created else None)
+    for name, value in values.items():
+        version_key = "category_id" if name == "category_sync_id" else name
+        if name in skip or (change.fields is not None and version_key not in change.fields):
+            continue
+        patch.fields[name] = value
+        changed_at = versions.get(version_key) or updated_at
+        if changed_at != updated_at:
+            patch.field_updated_at[name] = from_ms(changed_at)
+    return patch if patch.fields else None
+
+async def category_patches(db, user_id: int, changes: Dict[str, RecordChange],
+                           echoed: Dict[str, Set[str]]) -> List[RecordPatch]:
+    rows = await _rows_by_sync_id(
+        db,
+        """SELECT sync_id, name, type, color, icon, created_at, updated_at, field_versions
+           FROM categories WHERE user_id = ? AND sync_id IN ({marks})""",
+        user_id, list(changes)
+    )
+    patches = []
+    for sync_id, change in changes.items():
+        row = rows.get(sync_id)
+        values = {f: row[f] for f in CATEGORY_FIELDS} if row else {}
+        patch = _change_patch(sync_id, change, row, values, echoed.get(sync_id, set()))
+        if patch:
+            patches.append(patch)
+    return patches
+
+async def transaction_patches(db, user_id: int, changes: Dict[str, RecordChange],
+                              echoed: Dict[str, Set[str]]) -> List[RecordPatch]:
+    rows = await _rows_by_sync_id(
+        db,
+        """SELECT t.sync_id, t.amount_cents, t.currency, t.description, t.date, c.sync_id AS category_sync_id,
+                  t.created_at, t.updated_at, t.field_versions
            FROM transactions t
-           LEFT JOIN categories c ON t.category_id = c.id
-           WHERE t.user_id = ? 
-           ORDER BY t.date DESC""",
-        (user_id,)
+           JOIN categories c ON t.category_id = c.id
+           WHERE t.user_id = ? AND t.sync_id IN ({marks})""",
+        user_id, list(changes)
     )
-    
-    final_transactions = []
-    for row in await cursor.fetchall():
-        transaction_data = {
-            "id": row["id"],
-            "user_id": row["user_id"],
-            "category_id": row["category_id"],
-            "amount": float(row["amount"]),
+    patches = []
+    for sync_id, change in changes.items():
+        row = rows.get(sync_id)
+        values = {
+            "amount": cents_to_amount(row["amount_cents"]),
+            "currency": row["currency"],
             "description": row["description"],
-            "date": datetime.fromisoformat(row["date"].replace('Z', '+00:00')),
-            "sync_id": row["sync_id"],
-            "created_at": datetime.fromisoformat(row["created_at"].replace('Z', '+00:00')),
-            "updated_at": datetime.fromisoformat(row["updated_at"].replace('Z', '+00:00'))
-        }
-        
-        if row["category_name"]:
-            transaction_data["category"] = {
-                "id": row["category_id"],
-                "name": row["category_name"],
-                "type": row["category_type"],
-                "color": row["category_color"],
-                "icon": row["category_icon"]
-            }
-        
-        final_transactions.append(Transaction(**transaction_data))
-    
-    return final_transactions, conflicts
+            "date": from_ms(row["date"]),
+            "category_sync_id": row["category_sync_id"],
+        } if row else {}
+        patch = _change_patch(sync_id, change, row, values, echoed.get(sync_id, set()))
+        if patch:
+            patches.append(patch)
+    return patches
+
+async def apply_push_batch(db, user_id: int, section: str, batch: List[Any], conflicts: List[dict],
+                           echoed: Dict[str, Dict[str, Set[str]]], counts: Dict[str, int],
+                           deferred: Optional[DeferredRecords] = None):
+    """Write one batch of a push body in its own short write transaction.
+
+    Merges are idempotent (LWW per field, inserts keyed by sync_id), so a push
+    cut off halfway is completed by sending it again."""
+    # Writers of one user queue here; BEGIN IMMEDIATE takes the SQLite
+    # write lock up front instead of upgrading a read transaction
+    async with user_write_transaction(db, user_id):
+        if section == "categories":
+            found, seen, done = await sync_categories(db, user_id, batch, [])
+        elif section == "category_patches":
+            found, seen, done = await sync_categories(db, user_id, [], batch)
+        elif section == "transactions":
+            found, seen, done = await sync_transactions(db, user_id, batch, [], deferred)
+        else:
+            found, seen, done = await sync_transactions(db, user_id, [], batch, deferred)
+    conflicts.extend(found)
+    for key, value in done.items():
+        counts[key] += value
+    echoed[CATEGORIES if section.startswith("categor") else TRANSACTIONS].update(seen)
+
+# The body is read from the stream, not declared as a parameter: its schema is added by hand.
+# SyncRequest's nested models are in components through SyncResponse
+SYNC_REQUEST_BODY = {
+    "required": True,
+    "content": {"application/json": {"schema": {
+        key: value
+        for key, value in SyncRequest.model_json_schema(ref_template="#/components/schemas/{model}").items()
+        if key != "$defs"
+    }}},
+}
 
-@router.post("/", response_model=SyncResponse)
+@router.post("/", response_model=SyncResponse, responses=SYNC_RESPONSES,
+             openapi_extra={"requestBody": SYNC_REQUEST_BODY})
 async def sync_data(
-    sync_request: SyncRequest,
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
 ):
-    db = await get_db()
+    """Body: SyncRequest. It is parsed while it uploads and written in batches of SYNC_PUSH_BATCH.
+
+    last_sync, delta and since_seq are validated as soon as they are read: sent
+    before the arrays (SyncRequest's field order), an invalid one is rejected
+    with 422 before anything is written."""
     all_conflicts = []
+    echoed: Dict[str, Dict[str, Set[str]]] = {CATEGORIES: {}, TRANSACTIONS: {}}
+    deferred = DeferredRecords()
+    counts = {"written": 0, "skipped": 0}
+    options: Dict[str, Any] = {}
     
     try:
-        # Start transaction
-        await db.execute("BEGIN")
-        
-        # Sync categories first
-        final_categories, category_conflicts = await sync_categories(
-            db, current_user.id, sync_request.categories
-        )
-        all_conflicts.extend(category_conflicts)
+        async for section, batch in stream_sections(request.stream(), PUSH_SECTIONS, SYNC_PUSH_BATCH,
+                                                    options, parse_option):
+            await apply_push_batch(db, current_user.id, section, batch, all_conflicts, echoed, counts, deferred)
+        # Transactions that came before their category in the body
+        if deferred.count:
+            metrics.inc("sync.rows.deferred", deferred.count)
+        for section in ("transactions", "transaction_patches"):
+            for retry in deferred.batches(section, SYNC_PUSH_BATCH):
+                await apply_push_batch(db, current_user.id, section, retry, all_conflicts, echoed, counts)
+        sync_request = SyncRequest.model_validate(options)
+        # Recurring instances due by now go out with this pull
+        await materialize_due(db, current_user.id)
+        metrics.inc("sync.rows.written", counts["written"])
+        metrics.inc("sync.rows.skipped", counts["skipped"])
+        categories_echoed, transactions_echoed = echoed[CATEGORIES], echoed[TRANSACTIONS]
         
-        # Sync transactions
-        final_transactions, transaction_conflicts = await sync_transactions(
-            db, current_user.id, sync_request.transactions
-        )
-        all_conflicts.extend(transaction_conflicts)
-        
-        # Commit transaction
-        await db.commit()
+        # One read transaction: the lists and the seq describe the same state
+        await db.execute("BEGIN")
+        seq, _ = await latest_change(db, current_user.id)
+        if sync_request.delta and sync_request.since_seq is not None:
+            # Only what the change log recorded after the client's seq
+            changes = await changes_since(db, current_user.id, sync_request.since_seq)
+            response = SyncResponse(
+                categories=[],
+                transactions=[],
+                category_patches=await category_patches(
+                    db, current_user.id, changes[CATEGORIES], categories_echoed),
+                transaction_patches=await transaction_patches(
+                    db, current_user.id, changes[TRANSACTIONS], transactions_echoed),
+                conflicts=all_conflicts,
+                last_sync=datetime.now(timezone.utc),
+                seq=seq,
+                **counts
+            )
+        else:
+            response = SyncResponse(
+                categories=await load_categories(db, current_user.id),
+                transactions=await load_transactions(db, current_user.id),
+                conflicts=all_conflicts,
+                last_sync=datetime.now(timezone.utc),
+                seq=seq,
+                **counts
+            )
+        await db.rollback()
         
         logger.info(f"✅ Sync completed for user {current_user.id}: "
-                   f"{len(final_categories)} categories, {len(final_transactions)} transactions, "
-                   f"{len(all_conflicts)} conflicts")
+                   f"{len(response.categories) + len(response.category_patches)} categories, "
+                   f"{len(response.transactions) + len(response.transaction_patches)} transactions, "
+                   f"{len(all_conflicts)} conflicts, {counts['written']} written, {counts['skipped']} unchanged")
         
-        return SyncResponse(
-            categories=final_categories,
-            transactions=final_transactions,
-            conflicts=all_conflicts,
-            last_sync=datetime.utcnow()
-        )
+        # JSON, columnar JSON or MessagePack, compressed per Accept-Encoding
+        return encode_sync_response(request, response)
         
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    except JsonStreamError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid sync body: {e}")
     except Exception as e:
         await db.rollback()
         logger.error(f"❌ Sync failed for user {current_user.id}: {e}")
@@ -265,28 +644,22 @@ async def sync_data(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Sync failed: {str(e)}"
         )
+    finally:
+        deferred.close()
 
 @router.get("/status")
-async def get_sync_status(current_user: User = Depends(get_current_user)):
-    db = await get_db()
-    
-    # Get last sync timestamp (we'll use the latest updated_at from user's data)
-    cursor = await db.execute(
-        """SELECT MAX(updated_at) as last_sync FROM (
-               SELECT updated_at FROM categories WHERE user_id = ?
-               UNION ALL
-               SELECT updated_at FROM transactions WHERE user_id = ?
-           )""",
-        (current_user.id, current_user.id)
-    )
-    row = await cursor.fetchone()
+async def get_sync_status(
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db),
+    read_db = Depends(get_read_db)
+):
     
-    last_sync = None
-    if row["last_sync"]:
-        last_sync = datetime.fromisoformat(row["last_sync"].replace('Z', '+00:00'))
+    # Latest change: one seek on idx_change_log_user_seq, on the primary (seq is exact)
+    seq, changed_at = await latest_change(db, current_user.id)
+    last_sync = from_ms(changed_at)
     
-    # Get counts
-    cursor = await db.execute(
+    # Counts may lag behind by up to REPLICA_MAX_LAG_SECONDS (app/replica.py)
+    cursor = await read_db.execute(
         """SELECT 
                (SELECT COUNT(*) FROM categories WHERE user_id = ?) as categories_count,
                (SELECT COUNT(*) FROM transactions WHERE user_id = ?) as transactions_count""",
@@ -296,7 +669,97 @@ async def get_sync_status(current_user: User = Depends(get_current_user)):
     
     return {
         "last_sync": last_sync.isoformat() if last_sync else None,
+        "seq": seq,
         "categories_count": counts["categories_count"],
         "transactions_count": counts["transactions_count"],
-        "server_time": datetime.utcnow().isoformat()
-    }
\ No newline at end of file
+        "server_time": datetime.now(timezone.utc).isoformat()
+    }
+async def _bench(rows: int, batch: int) -> Dict[str, float]:
+    """Reconcile a `batch`-record push (half updates, half new) against a `rows`-transaction account."""
+    import sqlite3
+    import tempfile
+    import time
+    import tracemalloc
+    import uuid
+    from decimal import Decimal
+    from pathlib import Path
+    import aiosqlite
+    from .db import SCHEMA_CANDIDATES, apply_migrations
+    from .timestamps import now_ms
+
+    schema = next(Path(p) for p in SCHEMA_CANDIDATES if Path(p).exists())
+    with tempfile.TemporaryDirectory() as tmp:
+        async with aiosqlite.connect(Path(tmp) / "bench.db") as db:
+            db.row_factory = sqlite3.Row
+            await db.executescript(schema.read_text(encoding="utf-8"))
+            await apply_migrations(db)
+            now = now_ms()
+            await db.execute(
+                "INSERT INTO users (id, email, password_hash, created_at, updated_at) VALUES (1, 'b@e.nch', '-', ?, ?)",
+                (now, now)
+            )
+            categories = [
+                Category(id=i + 1, user_id=1, name=f"Category {i}", type="expense", color="#3B82F6",
+                         sync_id=str(uuid.uuid4()), created_at=from_ms(now), updated_at=from_ms(now))
+                for i in range(20)
+            ]
+            await db.executemany(
+                """INSERT INTO categories (id, user_id, name, type, color, sync_id, created_at, updated_at)
+                   VALUES (?, 1, ?, 'expense', ?, ?, ?, ?)""",
+                [(c.id, c.name, c.color, c.sync_id, now, now) for c in categories]
+            )
+            sync_ids = [str(uuid.uuid4()) for _ in range(rows)]
+            await db.executemany(
+                """INSERT INTO transactions (user_id, category_id, amount_cents, description, date, sync_id,
+                                             created_at, updated_at)
+                   VALUES (1, ?, ?, ?, ?, ?, ?, ?)""",
+                [(i % 20 + 1, i % 10000 + 100, f"Payment #{i}", now - i * 3600_000, sync_id, now, now)
+                 for i, sync_id in enumerate(sync_ids)]
+            )
+            await db.commit()
+
+            later = from_ms(now + 60_000)
+            client = [
+                Transaction(id=0, user_id=1, category_id=categories[i % 20].id,
+                            amount=Decimal(i % 10000) / 100 + 2, description=f"Edited #{i}",
+                            date=from_ms(now), sync_id=sync_ids[i * 2] if i % 2 else str(uuid.uuid4()),
+                            created_at=later, updated_at=later, category=categories[i % 20])
+                for i in range(batch)
+            ]
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            await db.execute("BEGIN IMMEDIATE")
+            conflicts, _, _ = await sync_transactions(db, 1, client, [])
+            await db.commit()
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            # Для сравнения: словарь всего счёта, как строила прежняя сверка
+            tracemalloc.start()
+            cursor = await db.execute(
+                f"SELECT {TRANSACTION_MERGE_COLUMNS} FROM transactions WHERE user_id = 1"
+            )
+            account = {row["sync_id"]: dict(row) for row in await cursor.fetchall()}
+            account_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del account
+    return {"ms": elapsed * 1000, "peak_kib": peak / 1024, "account_dict_kib": account_peak / 1024,
+            "conflicts": len(conflicts)}
+
+def main(argv: List[str]) -> int:
+    if not argv or argv[0] != "bench":
+        print("usage: python -m app.sync bench [account rows] [push batch]")
+        return 2
+    rows = int(argv[1]) if len(argv) > 1 else 100_000
+    batch = int(argv[2]) if len(argv) > 2 else 2_000
+    result = asyncio.run(_bench(rows, batch))
+    print(f"{rows} transactions on the server, push of {batch} (chunk {SYNC_MERGE_CHUNK})")
+    print(f"reconcile: {result['ms']:.1f} ms, peak {result['peak_kib']:.0f} KiB, "
+          f"{result['conflicts']} conflicts")
+    print(f"whole-account dict alone: peak {result['account_dict_kib']:.0f} KiB")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,68 @@
+"""
+Time columns are INTEGER epoch milliseconds (UTC).
+
+Rows are mapped with from_ms (arithmetic, no string parsing), comparisons in
+SQL and in sync merges are integer compares, and ISO strings appear only
+when a response is serialized. Naive datetimes in this service are UTC;
+the API returns aware ones.
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+import calendar
+import time
+
+from .storage import POSTGRES
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+def to_ms(value: datetime) -> int:
+    return calendar.timegm(value.utctimetuple()) * 1000 + value.microsecond // 1000
+
+def day_ms(value: date) -> int:
+    """Midnight UTC of a day."""
+    return calendar.timegm(value.timetuple()) * 1000
+
+def from_ms(value: Optional[int]) -> Optional[datetime]:
+    """Aware UTC datetime: serialized with its offset, so clients do not read it as local time."""
+    return EPOCH + timedelta(milliseconds=value) if value is not None else None
+
+# SQL-выражения над колонками с epoch ms (UTC) для группировок, отчётов и курсов валют.
+# SQLite и PostgreSQL пишут их по-разному, см. app/storage.py
+
+def _pg_utc(column: str) -> str:
+    return f"(to_timestamp({column} / 1000) AT TIME ZONE 'UTC')"
+
+def sql_day(column: str) -> str:
+    """Day as YYYY-MM-DD text."""
+    if POSTGRES:
+        return f"to_char({_pg_utc(column)}, 'YYYY-MM-DD')"
+    return f"date({column} / 1000, 'unixepoch')"
+
+def sql_month_key(column: str) -> str:
+    """year * 12 + month - 1: consecutive months are consecutive integers."""
+    if POSTGRES:
+        return (f"(CAST(EXTRACT(YEAR FROM {_pg_utc(column)}) AS INTEGER) * 12"
+                f" + CAST(EXTRACT(MONTH FROM {_pg_utc(column)}) AS INTEGER) - 1)")
+    return (f"(CAST(strftime('%Y', {column} / 1000, 'unixepoch') AS INTEGER) * 12"
+            f" + CAST(strftime('%m', {column} / 1000, 'unixepoch') AS INTEGER) - 1)")
+
+def sql_weekday(column: str) -> str:
+    """0 = Sunday ... 6 = Saturday."""
+    if POSTGRES:
+        return f"CAST(EXTRACT(DOW FROM {_pg_utc(column)}) AS INTEGER)"
+    return f"CAST(strftime('%w', {column} / 1000, 'unixepoch') AS INTEGER)"
+
+# SQL над текстовым днём YYYY-MM-DD
+def sql_next_day(day: str) -> str:
+    if POSTGRES:
+        return f"to_char(CAST({day} AS DATE) + 1, 'YYYY-MM-DD')"
+    return f"date({day}, '+1 day')"
+
+def sql_day_number(day: str) -> str:
+    """Days as a number, for RANGE frames counted in days."""
+    if POSTGRES:
+        return f"(CAST({day} AS DATE) - DATE '1970-01-01')"
+    return f"julianday({day})"
@@ -1,25 +1,129 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import uuid
 import logging
 
 from .db import get_db
+from .replica import get_read_db
 from .auth import get_current_user
-from .models import User, Transaction, TransactionCreate, TransactionUpdate, StatsResponse
+from .fingerprints import (
+    transaction_fingerprint, find_duplicate, amount_to_cents, cents_to_amount, DUPLICATE_MODE,
+    transaction_hash,
+)
+from .changes import log_change, log_changes, TRANSACTIONS, INSERT, UPDATE, DELETE
+from .locks import user_write_transaction
+from .recurring import materialize_due
+from .storage import ROW_DIFFERS
+from .timestamps import now_ms, to_ms, day_ms, from_ms
+from .currency import BASE_CURRENCY, FX_JOIN, CONVERTED_CENTS, MissingRateError, prepare_conversion
+from .models import (
+    User, Transaction, TransactionCreate, TransactionUpdate, StatsResponse,
+    DuplicateMode, DuplicateGroup, TransactionBulkCreate, TransactionBulkUpdate, BulkDelete,
+    BulkItemResult, BulkResponse,
+)
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+TRANSACTION_COLUMNS = """t.id, t.user_id, t.category_id, t.amount_cents, t.currency, t.description,
+       t.date, t.sync_id, t.created_at, t.updated_at,
+       c.name as category_name, c.type as category_type,
+       c.color as category_color, c.icon as category_icon,
+       c.sync_id as category_sync_id, c.created_at as category_created_at,
+       c.updated_at as category_updated_at"""
+
+# TRANSACTION_COLUMNS for RETURNING of an UPDATE: no JOIN there, the category
+# comes from primary-key subqueries
+TRANSACTION_RETURNING = ", ".join(
+    ["id", "user_id", "category_id", "amount_cents", "currency", "description",
+     "date", "sync_id", "created_at", "updated_at"]
+    + [f"(SELECT c.{column} FROM categories c WHERE c.id = transactions.category_id) AS category_{column}"
+       for column in ("name", "type", "color", "icon", "sync_id", "created_at", "updated_at")]
+)
+
+# New values of an update: edited fields, the stored ones otherwise
+UPDATED_VALUES = {
+    "amount_cents": "COALESCE(:amount_cents, amount_cents)",
+    "currency": "COALESCE(:currency, currency)",
+    "description": "COALESCE(:description, description)",
+    "date": "COALESCE(:date, date)",
+    "category_id": "COALESCE(:category_id, category_id)",
+}
+
+def update_statement(edited: List[str], returning: str) -> str:
+    """UPDATE of one transaction with update_params.
+
+    One statement: category ownership, the no-op check (same values are
+    neither written nor logged), fingerprint and content_hash recomputed
+    from the new values. Edited fields fall back to the new updated_at as
+    their sync version.
+    """
+    new = UPDATED_VALUES
+    return f"""UPDATE transactions
+        SET {', '.join(f"{column} = {value}" for column, value in new.items())},
+            fingerprint = transaction_fingerprint(user_id, {new['date']}, {new['amount_cents']},
+                                                  {new['category_id']}, {new['description']}),
+            content_hash = transaction_hash({', '.join(new.values())}),
+            field_versions = json_remove(field_versions, {', '.join(f"'$.{name}'" for name in edited)}),
+            updated_at = :now
+        WHERE id = :id AND user_id = :user_id
+          AND ({', '.join(new)}) {ROW_DIFFERS} ({', '.join(new.values())})
+          AND (:category_id IS NULL
+               OR EXISTS (SELECT 1 FROM categories WHERE id = :category_id AND user_id = :user_id))
+        RETURNING {returning}"""
+
+def update_params(transaction_update: TransactionUpdate, transaction_id: int, user_id: int) -> dict:
+    return {
+        "amount_cents": amount_to_cents(transaction_update.amount)
+                        if transaction_update.amount is not None else None,
+        "currency": transaction_update.currency,
+        "description": transaction_update.description,
+        "date": to_ms(transaction_update.date) if transaction_update.date is not None else None,
+        "category_id": transaction_update.category_id,
+        "now": now_ms(),
+        "id": transaction_id,
+        "user_id": user_id,
+    }
+
+def edited_fields(transaction_update: TransactionUpdate) -> List[str]:
+    return [name for name in ("amount", "currency", "description", "date", "category_id")
+            if getattr(transaction_update, name) is not None]
+
+def transaction_from_row(row) -> Transaction:
+    """Transaction with its category from a row selected with TRANSACTION_COLUMNS."""
+    transaction_data = {
+        "id": row["id"],
+        "user_id": row["user_id"],
+        "category_id": row["category_id"],
+        "amount": cents_to_amount(row["amount_cents"]),
+        "currency": row["currency"],
+        "description": row["description"],
+        "date": from_ms(row["date"]),
+        "sync_id": row["sync_id"],
+        "created_at": from_ms(row["created_at"]),
+        "updated_at": from_ms(row["updated_at"])
+    }
+    if row["category_name"]:
+        transaction_data["category"] = {
+            "id": row["category_id"],
+            "user_id": row["user_id"],
+            "name": row["category_name"],
+            "type": row["category_type"],
+            "color": row["category_color"],
+            "icon": row["category_icon"],
+            "sync_id": row["category_sync_id"],
+            "created_at": from_ms(row["category_created_at"]),
+            "updated_at": from_ms(row["category_updated_at"])
+        }
+    return Transaction(**transaction_data)
+
 async def get_user_transaction(db, user_id: int, transaction_id: int):
     cursor = await db.execute(
-        """SELECT t.id, t.user_id, t.category_id, t.amount, t.description, 
-                  t.date, t.sync_id, t.created_at, t.updated_at,
-                  c.name as category_name, c.type as category_type, 
-                  c.color as category_color, c.icon as category_icon
-           FROM transactions t
-           LEFT JOIN categories c ON t.category_id = c.id
-           WHERE t.id = ? AND t.user_id = ?""",
+        f"""SELECT {TRANSACTION_COLUMNS}
+            FROM transactions t
+            LEFT JOIN categories c ON t.category_id = c.id
+            WHERE t.id = ? AND t.user_id = ?""",
         (transaction_id, user_id)
     )
     row = await cursor.fetchone()
@@ -34,9 +138,12 @@ async def get_transactions(
     offset: int = Query(0, ge=0),
     category_id: Optional[int] = Query(None),
     start_date: Optional[date] = Query(None),
-    end_date: Optional[date] = Query(None)
+    end_date: Optional[date] = Query(None),
+    db = Depends(get_db)
 ):
-    db = await get_db()
+    
+    # Recurring templates that came due since the last read
+    await materialize_due(db, current_user.id)
     
     # Build query with filters
     where_conditions = ["t.user_id = ?"]
@@ -47,20 +154,17 @@ async def get_transactions(
         params.append(category_id)
     
     if start_date:
-        where_conditions.append("DATE(t.date) >= ?")
-        params.append(start_date.isoformat())
+        where_conditions.append("t.date >= ?")
+        params.append(day_ms(start_date))
     
     if end_date:
-        where_conditions.append("DATE(t.date) <= ?")
-        params.append(end_date.isoformat())
+        where_conditions.append("t.date < ?")
+        params.append(day_ms(end_date + timedelta(days=1)))
     
     params.extend([limit, offset])
     
     query = f"""
-        SELECT t.id, t.user_id, t.category_id, t.amount, t.description, 
-               t.date, t.sync_id, t.created_at, t.updated_at,
-               c.name as category_name, c.type as category_type, 
-               c.color as category_color, c.icon as category_icon
+        SELECT {TRANSACTION_COLUMNS}
         FROM transactions t
         LEFT JOIN categories c ON t.category_id = c.id
         WHERE {' AND '.join(where_conditions)}
@@ -71,61 +175,86 @@ async def get_transactions(
     cursor = await db.execute(query, params)
     rows = await cursor.fetchall()
     
-    transactions = []
-    for row in rows:
-        transaction_data = {
-            "id": row["id"],
-            "user_id": row["user_id"],
-            "category_id": row["category_id"],
-            "amount": float(row["amount"]),
-            "description": row["description"],
-            "date": datetime.fromisoformat(row["date"].replace('Z', '+00:00')),
-            "sync_id": row["sync_id"],
-            "created_at": datetime.fromisoformat(row["created_at"].replace('Z', '+00:00')),
-            "updated_at": datetime.fromisoformat(row["updated_at"].replace('Z', '+00:00'))
-        }
-        
-        if row["category_name"]:
-            transaction_data["category"] = {
-                "id": row["category_id"],
-                "name": row["category_name"],
-                "type": row["category_type"],
-                "color": row["category_color"],
-                "icon": row["category_icon"]
-            }
-        
-        transactions.append(Transaction(**transaction_data))
-    
-    return transactions
+    return [transaction_from_row(row) for row in rows]
+
+@router.get("/duplicates", response_model=List[DuplicateGroup])
+async def get_duplicates(
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(100, ge=1, le=1000),
+    db = Depends(get_db)
+):
+    """Groups of transactions sharing a fingerprint.
+
+    Groups come from GROUP BY over the (user_id, fingerprint) index, no pairwise comparison.
+    """
+    cursor = await db.execute(
+        f"""SELECT {TRANSACTION_COLUMNS}, t.fingerprint
+            FROM (SELECT fingerprint FROM transactions
+                  WHERE user_id = ? AND fingerprint IS NOT NULL
+                  GROUP BY fingerprint HAVING COUNT(*) > 1
+                  LIMIT ?) d
+            JOIN transactions t ON t.user_id = ? AND t.fingerprint = d.fingerprint
+            LEFT JOIN categories c ON t.category_id = c.id
+            ORDER BY t.fingerprint, t.id""",
+        (current_user.id, limit, current_user.id)
+    )
+
+    groups = {}
+    for row in await cursor.fetchall():
+        groups.setdefault(row["fingerprint"], []).append(transaction_from_row(row))
+
+    return [
+        DuplicateGroup(fingerprint=fingerprint, count=len(items), transactions=items)
+        for fingerprint, items in groups.items()
+    ]
 
 @router.post("/", response_model=Transaction)
 async def create_transaction(
     transaction: TransactionCreate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    on_duplicate: Optional[DuplicateMode] = Query(None),
+    db = Depends(get_db)
 ):
-    db = await get_db()
     
-    # Verify category exists and belongs to user
-    cursor = await db.execute(
-        "SELECT id FROM categories WHERE id = ? AND user_id = ?",
-        (transaction.category_id, current_user.id)
+    amount_cents = amount_to_cents(transaction.amount)
+    fingerprint = transaction_fingerprint(
+        current_user.id, transaction.date, amount_cents,
+        transaction.category_id, transaction.description
     )
-    if not await cursor.fetchone():
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Category not found or doesn't belong to user"
-        )
+    mode = on_duplicate or DUPLICATE_MODE
+    if mode != DuplicateMode.ALLOW:
+        duplicate = await find_duplicate(db, current_user.id, fingerprint)
+        if duplicate and mode == DuplicateMode.REJECT:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Duplicate of transaction {duplicate['id']}"
+            )
+        if duplicate:
+            return await get_transaction(duplicate["id"], current_user, db)
     
     sync_id = str(uuid.uuid4())
+    now = now_ms()
+    date_ms = to_ms(transaction.date)
     
+    # Inserted from the user's category row: no row back means the category is not theirs
     cursor = await db.execute(
-        """INSERT INTO transactions (user_id, category_id, amount, description, date, sync_id)
-           VALUES (?, ?, ?, ?, ?, ?) 
+        """INSERT INTO transactions (user_id, category_id, amount_cents, currency, description, date, sync_id,
+                                     created_at, updated_at, fingerprint, content_hash)
+           SELECT c.user_id, c.id, ?, ?, ?, ?, ?, ?, ?, ?, ?
+           FROM categories c WHERE c.id = ? AND c.user_id = ?
            RETURNING id, created_at, updated_at""",
-        (current_user.id, transaction.category_id, float(transaction.amount), 
-         transaction.description, transaction.date.isoformat(), sync_id)
+        (amount_cents, transaction.currency, transaction.description, date_ms, sync_id, now, now, fingerprint,
+         transaction_hash(amount_cents, transaction.currency, transaction.description,
+                          date_ms, transaction.category_id),
+         transaction.category_id, current_user.id)
     )
     row = await cursor.fetchone()
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Category not found or doesn't belong to user"
+        )
+    await log_change(db, current_user.id, TRANSACTIONS, sync_id, INSERT)
     await db.commit()
     
     return Transaction(
@@ -133,19 +262,194 @@ async def create_transaction(
         user_id=current_user.id,
         category_id=transaction.category_id,
         amount=transaction.amount,
+        currency=transaction.currency,
         description=transaction.description,
         date=transaction.date,
         sync_id=sync_id,
-        created_at=row["created_at"],
-        updated_at=row["updated_at"]
+        created_at=from_ms(row["created_at"]),
+        updated_at=from_ms(row["updated_at"])
     )
 
+def bulk_response(results: List[BulkItemResult]) -> BulkResponse:
+    failed = sum(result.status >= 400 for result in results)
+    return BulkResponse(results=results, succeeded=len(results) - failed, failed=failed)
+
+# Bulk routes are declared before /{transaction_id}, which would match "bulk" too.
+# Each answers every item as the single-object route would, in one write transaction.
+@router.post("/bulk", response_model=BulkResponse)
+async def create_transactions(
+    bulk: TransactionBulkCreate,
+    current_user: User = Depends(get_current_user),
+    on_duplicate: Optional[DuplicateMode] = Query(None),
+    db = Depends(get_db)
+):
+    
+    mode = on_duplicate or DUPLICATE_MODE
+    now = now_ms()
+    prepared = []
+    for transaction in bulk.items:
+        amount_cents = amount_to_cents(transaction.amount)
+        prepared.append((amount_cents, to_ms(transaction.date), transaction_fingerprint(
+            current_user.id, transaction.date, amount_cents, transaction.category_id, transaction.description
+        )))
+    results: List[Optional[BulkItemResult]] = [None] * len(bulk.items)
+    inserted = {}    # index -> sync_id
+    merged = {}      # index -> index of an earlier item of this request with the same fingerprint
+    
+    async with user_write_transaction(db, current_user.id):
+        category_ids = list({transaction.category_id for transaction in bulk.items})
+        cursor = await db.execute(
+            f"SELECT id FROM categories WHERE user_id = ? AND id IN ({','.join('?' * len(category_ids))})",
+            [current_user.id, *category_ids]
+        )
+        owned = {row["id"] for row in await cursor.fetchall()}
+        
+        duplicates = {}
+        if mode != DuplicateMode.ALLOW:
+            fingerprints = list({fingerprint for _, _, fingerprint in prepared})
+            cursor = await db.execute(
+                f"""SELECT fingerprint, MIN(id) AS id FROM transactions
+                    WHERE user_id = ? AND fingerprint IN ({','.join('?' * len(fingerprints))})
+                    GROUP BY fingerprint""",
+                [current_user.id, *fingerprints]
+            )
+            duplicates = {row["fingerprint"]: row["id"] for row in await cursor.fetchall()}
+        
+        first = {}       # fingerprint -> first item inserted with it
+        rows = []
+        for index, (transaction, (amount_cents, date_ms, fingerprint)) in enumerate(zip(bulk.items, prepared)):
+            if transaction.category_id not in owned:
+                results[index] = BulkItemResult(
+                    index=index, status=status.HTTP_400_BAD_REQUEST,
+                    detail="Category not found or doesn't belong to user"
+                )
+                continue
+            if mode != DuplicateMode.ALLOW:
+                if fingerprint in duplicates:
+                    results[index] = (
+                        BulkItemResult(index=index, status=status.HTTP_409_CONFLICT,
+                                       detail=f"Duplicate of transaction {duplicates[fingerprint]}")
+                        if mode == DuplicateMode.REJECT
+                        else BulkItemResult(index=index, id=duplicates[fingerprint], status=status.HTTP_200_OK)
+                    )
+                    continue
+                if fingerprint in first:
+                    if mode == DuplicateMode.REJECT:
+                        results[index] = BulkItemResult(index=index, status=status.HTTP_409_CONFLICT,
+                                                        detail=f"Duplicate of item {first[fingerprint]}")
+                    else:
+                        merged[index] = first[fingerprint]
+                    continue
+                first[fingerprint] = index
+            sync_id = inserted[index] = str(uuid.uuid4())
+            rows.append((current_user.id, transaction.category_id, amount_cents, transaction.currency,
+                         transaction.description, date_ms, sync_id, now, now, fingerprint,
+                         transaction_hash(amount_cents, transaction.currency, transaction.description,
+                                          date_ms, transaction.category_id)))
+        
+        if rows:
+            await db.executemany(
+                """INSERT INTO transactions (user_id, category_id, amount_cents, currency, description, date,
+                                             sync_id, created_at, updated_at, fingerprint, content_hash)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows
+            )
+            cursor = await db.execute(
+                f"""SELECT id, sync_id FROM transactions
+                    WHERE user_id = ? AND sync_id IN ({','.join('?' * len(inserted))})""",
+                [current_user.id, *inserted.values()]
+            )
+            ids = {row["sync_id"]: row["id"] for row in await cursor.fetchall()}
+            await log_changes(db, current_user.id, TRANSACTIONS, inserted.values(), INSERT)
+    
+    for index, sync_id in inserted.items():
+        results[index] = BulkItemResult(index=index, id=ids[sync_id], status=status.HTTP_200_OK, changed=True)
+    for index, earlier in merged.items():
+        results[index] = BulkItemResult(index=index, id=results[earlier].id, status=status.HTTP_200_OK)
+    return bulk_response(results)
+
+@router.patch("/bulk", response_model=BulkResponse)
+async def update_transactions(
+    bulk: TransactionBulkUpdate,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """Partial updates; items of the same id apply in order."""
+    
+    results = []
+    logged = {}      # edited fields -> sync_ids
+    async with user_write_transaction(db, current_user.id):
+        # Ownership of every transaction and category in one query
+        ids = list({item.id for item in bulk.items})
+        category_ids = list({item.category_id for item in bulk.items if item.category_id is not None})
+        cursor = await db.execute(
+            f"""SELECT 'transaction' AS kind, id FROM transactions
+                WHERE user_id = ? AND id IN ({','.join('?' * len(ids))})
+                UNION ALL
+                SELECT 'category', id FROM categories
+                WHERE user_id = ? AND id IN ({','.join('?' * len(category_ids)) or 'NULL'})""",
+            [current_user.id, *ids, current_user.id, *category_ids]
+        )
+        owned = {(row["kind"], row["id"]) for row in await cursor.fetchall()}
+        
+        for index, item in enumerate(bulk.items):
+            if ("transaction", item.id) not in owned:
+                results.append(BulkItemResult(index=index, id=item.id, status=status.HTTP_404_NOT_FOUND,
+                                              detail="Transaction not found"))
+                continue
+            if item.category_id is not None and ("category", item.category_id) not in owned:
+                results.append(BulkItemResult(index=index, id=item.id, status=status.HTTP_400_BAD_REQUEST,
+                                              detail="Category not found or doesn't belong to user"))
+                continue
+            edited = edited_fields(item)
+            row = None
+            if edited:
+                cursor = await db.execute(update_statement(edited, "sync_id"),
+                                          update_params(item, item.id, current_user.id))
+                row = await cursor.fetchone()
+            if row is not None:
+                logged.setdefault(tuple(edited), []).append(row["sync_id"])
+            results.append(BulkItemResult(index=index, id=item.id, status=status.HTTP_200_OK,
+                                          changed=row is not None))
+        
+        for edited, sync_ids in logged.items():
+            await log_changes(db, current_user.id, TRANSACTIONS, sync_ids, UPDATE, edited)
+    
+    return bulk_response(results)
+
+@router.delete("/bulk", response_model=BulkResponse)
+async def delete_transactions(
+    bulk: BulkDelete,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    
+    ids = list(set(bulk.ids))
+    async with user_write_transaction(db, current_user.id):
+        cursor = await db.execute(
+            f"""DELETE FROM transactions WHERE user_id = ? AND id IN ({','.join('?' * len(ids))})
+                RETURNING id, sync_id""",
+            [current_user.id, *ids]
+        )
+        deleted = {row["id"]: row["sync_id"] for row in await cursor.fetchall()}
+        await log_changes(db, current_user.id, TRANSACTIONS, deleted.values(), DELETE)
+    
+    results = []
+    for index, transaction_id in enumerate(bulk.ids):
+        # A repeated id is already gone, as it would be for a second DELETE
+        if deleted.pop(transaction_id, None) is not None:
+            results.append(BulkItemResult(index=index, id=transaction_id, status=status.HTTP_200_OK, changed=True))
+        else:
+            results.append(BulkItemResult(index=index, id=transaction_id, status=status.HTTP_404_NOT_FOUND,
+                                          detail="Transaction not found"))
+    return bulk_response(results)
+
 @router.get("/{transaction_id}", response_model=Transaction)
 async def get_transaction(
     transaction_id: int,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
 ):
-    db = await get_db()
     
     transaction = await get_user_transaction(db, current_user.id, transaction_id)
     if not transaction:
@@ -154,112 +458,74 @@ async def get_transaction(
             detail="Transaction not found"
         )
     
-    transaction_data = {
-        "id": transaction["id"],
-        "user_id": transaction["user_id"],
-        "category_id": transaction["category_id"],
-        "amount": float(transaction["amount"]),
-        "description": transaction["description"],
-        "date": datetime.fromisoformat(transaction["date"].replace('Z', '+00:00')),
-        "sync_id": transaction["sync_id"],
-        "created_at": datetime.fromisoformat(transaction["created_at"].replace('Z', '+00:00')),
-        "updated_at": datetime.fromisoformat(transaction["updated_at"].replace('Z', '+00:00'))
-    }
-    
-    if transaction["category_name"]:
-        transaction_data["category"] = {
-            "id": transaction["category_id"],
-            "name": transaction["category_name"],
-            "type": transaction["category_type"],
-            "color": transaction["category_color"],
-            "icon": transaction["category_icon"]
-        }
-    
-    return Transaction(**transaction_data)
+    return transaction_from_row(transaction)
 
 @router.put("/{transaction_id}", response_model=Transaction)
 async def update_transaction(
     transaction_id: int,
     transaction_update: TransactionUpdate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
 ):
-    db = await get_db()
     
-    # Check if transaction exists
-    existing_transaction = await get_user_transaction(db, current_user.id, transaction_id)
-    if not existing_transaction:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Transaction not found"
-        )
+    edited = edited_fields(transaction_update)
+    if not edited:
+        # No fields to update, return existing transaction
+        return await get_transaction(transaction_id, current_user, db)
     
-    # Verify category if provided
-    if transaction_update.category_id:
+    # Ownership, no-op check and the response row in one statement
+    cursor = await db.execute(
+        update_statement(edited, TRANSACTION_RETURNING),
+        update_params(transaction_update, transaction_id, current_user.id)
+    )
+    row = await cursor.fetchone()
+    if row is None:
+        # Not found, someone else's category or nothing to change: one read tells which
         cursor = await db.execute(
-            "SELECT id FROM categories WHERE id = ? AND user_id = ?",
-            (transaction_update.category_id, current_user.id)
+            f"""SELECT {TRANSACTION_COLUMNS},
+                       CAST(? AS BIGINT) IS NULL
+                       OR EXISTS (SELECT 1 FROM categories WHERE id = ? AND user_id = t.user_id)
+                           AS category_ok
+                FROM transactions t
+                LEFT JOIN categories c ON t.category_id = c.id
+                WHERE t.id = ? AND t.user_id = ?""",
+            (transaction_update.category_id, transaction_update.category_id, transaction_id, current_user.id)
         )
-        if not await cursor.fetchone():
+        existing = await cursor.fetchone()
+        if existing is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Transaction not found"
+            )
+        if not existing["category_ok"]:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Category not found or doesn't belong to user"
             )
-    
-    # Build update query
-    update_fields = []
-    update_values = []
-    
-    if transaction_update.amount is not None:
-        update_fields.append("amount = ?")
-        update_values.append(float(transaction_update.amount))
-    
-    if transaction_update.description is not None:
-        update_fields.append("description = ?")
-        update_values.append(transaction_update.description)
-    
-    if transaction_update.date is not None:
-        update_fields.append("date = ?")
-        update_values.append(transaction_update.date.isoformat())
-    
-    if transaction_update.category_id is not None:
-        update_fields.append("category_id = ?")
-        update_values.append(transaction_update.category_id)
-    
-    if not update_fields:
-        # No fields to update, return existing transaction
-        return await get_transaction(transaction_id, current_user)
-    
-    update_values.extend([transaction_id, current_user.id])
-    
-    query = f"""UPDATE transactions 
-               SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP
-               WHERE id = ? AND user_id = ?"""
-    
-    await db.execute(query, update_values)
+        return transaction_from_row(existing)
+    await log_change(db, current_user.id, TRANSACTIONS, row["sync_id"], UPDATE, edited)
     await db.commit()
     
-    return await get_transaction(transaction_id, current_user)
+    return transaction_from_row(row)
 
 @router.delete("/{transaction_id}")
 async def delete_transaction(
     transaction_id: int,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
 ):
-    db = await get_db()
     
-    # Check if transaction exists
-    transaction = await get_user_transaction(db, current_user.id, transaction_id)
-    if not transaction:
+    cursor = await db.execute(
+        "DELETE FROM transactions WHERE id = ? AND user_id = ? RETURNING sync_id",
+        (transaction_id, current_user.id)
+    )
+    row = await cursor.fetchone()
+    if row is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Transaction not found"
         )
-    
-    # Delete transaction
-    await db.execute(
-        "DELETE FROM transactions WHERE id = ? AND user_id = ?",
-        (transaction_id, current_user.id)
-    )
+    await log_change(db, current_user.id, TRANSACTIONS, row["sync_id"], DELETE)
     await db.commit()
     
     return {"message": "Transaction deleted successfully"}
@@ -268,9 +534,10 @@ async def delete_transaction(
 async def get_stats(
     current_user: User = Depends(get_current_user),
     start_date: Optional[date] = Query(None),
-    end_date: Optional[date] = Query(None)
+    end_date: Optional[date] = Query(None),
+    currency: Optional[str] = Query(None, pattern=r"^[A-Za-z]{3}$"),
+    db = Depends(get_read_db)
 ):
-    db = await get_db()
     
     # Set default date range (current month if not specified)
     if not start_date:
@@ -280,37 +547,48 @@ async def get_stats(
     if not end_date:
         end_date = date.today()
     
+    # Amounts in other currencies are converted by rate of their day
+    target = (currency or BASE_CURRENCY).upper()
+    range_start, range_end = day_ms(start_date), day_ms(end_date + timedelta(days=1))
+    try:
+        await prepare_conversion(db, current_user.id, start_date, end_date + timedelta(days=1), target)
+    except MissingRateError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    
     # Get income and expense totals
     cursor = await db.execute(
-        """SELECT 
+        f"""SELECT 
                c.type,
-               SUM(t.amount) as total
+               SUM({CONVERTED_CENTS}) as total
            FROM transactions t
            JOIN categories c ON t.category_id = c.id
+           {FX_JOIN}
            WHERE t.user_id = ? 
-             AND DATE(t.date) >= ? 
-             AND DATE(t.date) <= ?
+             AND t.date >= ? 
+             AND t.date < ?
            GROUP BY c.type""",
-        (current_user.id, start_date.isoformat(), end_date.isoformat())
+        (current_user.id, range_start, range_end)
     )
     
+    # Суммы — целые центы, в Decimal переводятся только в ответе
     totals = {"income": 0, "expense": 0}
     for row in await cursor.fetchall():
-        totals[row["type"]] = float(row["total"])
+        totals[row["type"]] = row["total"]
     
     # Get category stats
     cursor = await db.execute(
-        """SELECT 
+        f"""SELECT 
                c.id, c.name, c.type, c.color,
-               SUM(t.amount) as total,
+               COALESCE(SUM({CONVERTED_CENTS}), 0) as total,
                COUNT(t.id) as count
            FROM categories c
            LEFT JOIN transactions t ON c.id = t.category_id 
-               AND DATE(t.date) >= ? AND DATE(t.date) <= ?
+               AND t.date >= ? AND t.date < ?
+           {FX_JOIN}
            WHERE c.user_id = ?
            GROUP BY c.id, c.name, c.type, c.color
-           ORDER BY total DESC""",
-        (start_date.isoformat(), end_date.isoformat(), current_user.id)
+           ORDER BY total DESC, c.id""",
+        (range_start, range_end, current_user.id)
     )
     
     categories_stats = []
@@ -320,14 +598,15 @@ async def get_stats(
             "category_name": row["name"],
             "category_type": row["type"],
             "category_color": row["color"],
-            "total": float(row["total"]) if row["total"] else 0,
+            "total": cents_to_amount(row["total"]),
             "count": row["count"]
         })
     
     return StatsResponse(
-        total_income=totals["income"],
-        total_expense=totals["expense"],
-        balance=totals["income"] - totals["expense"],
+        currency=target,
+        total_income=cents_to_amount(totals["income"]),
+        total_expense=cents_to_amount(totals["expense"]),
+        balance=cents_to_amount(totals["income"] - totals["expense"]),
         categories_stats=categories_stats,
         monthly_stats=[],  # TODO: Implement monthly breakdown
         period_start=datetime.combine(start_date, datetime.min.time()),
@@ -0,0 +1,252 @@
+"""
+Wire formats for sync responses.
+
+The default JSON body repeats every key on every row and embeds the full
+category object into each transaction. Clients that send
+
+    Accept: application/x-msgpack                      (needs `msgpack`)
+    Accept: application/vnd.budget.columnar+json
+
+get a columnar body instead: one array per column, timestamps as epoch
+milliseconds, amounts as integer cents, and transactions pointing into the
+categories arrays by index (-1 when the category is not in the list).
+Delta syncs carry their patches as lists with epoch-ms times:
+
+    {"v": 1, "last_sync": 1700000000000, "seq": 42, "written": 3, "skipped": 97, "conflicts": [...],
+     "categories":   {"id": [...], "name": [...], ...},
+     "transactions": {"id": [...], "category": [0, 2, ...], "amount_cents": [...], ...},
+     "category_patches": [...], "transaction_patches": [...]}
+
+Any format is compressed according to Accept-Encoding: zstd (needs
+`zstandard`), then gzip. Encode and compress times go to the Server-Timing
+header and to the metrics registry (sync.encode.<format>, sync.bytes.*).
+
+Bench against the current JSON on synthetic data:
+    python -m app.wire bench [transactions] [categories]
+"""
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+import gzip
+import json
+import os
+import sys
+import time
+import uuid
+
+from .fingerprints import amount_to_cents
+from .timestamps import to_ms as epoch_ms
+from .models import Category, Transaction, SyncResponse, CategoryType, RecordPatch
+from . import metrics
+
+try:
+    import msgpack
+except ImportError:  # optional: pip install budget-pwa-backend[wire]
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # optional: pip install budget-pwa-backend[wire]
+    zstandard = None
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.budget.columnar+json"
+MSGPACK = "application/x-msgpack"
+
+WIRE_COMPRESS_MIN_BYTES = int(os.getenv("WIRE_COMPRESS_MIN_BYTES", "1024"))
+WIRE_GZIP_LEVEL = int(os.getenv("WIRE_GZIP_LEVEL", "6"))
+WIRE_ZSTD_LEVEL = int(os.getenv("WIRE_ZSTD_LEVEL", "3"))
+
+COLUMNAR_VERSION = 1
+
+# OpenAPI: alternative bodies of POST /api/sync/
+SYNC_RESPONSES = {200: {"content": {COLUMNAR_JSON: {}, MSGPACK: {}}}}
+
+def _parse_header(value: str) -> Dict[str, float]:
+    """'a, b;q=0.5' -> {'a': 1.0, 'b': 0.5}"""
+    result = {}
+    for part in value.split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, val = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(val)
+                except ValueError:
+                    quality = 0.0
+        result[name.strip().lower()] = quality
+    return result
+
+def _best(offered: Dict[str, float], available: List[str]) -> Optional[str]:
+    # Among acceptable values the server's own order breaks ties
+    candidates = [(offered[name], -i, name) for i, name in enumerate(available)
+                  if offered.get(name, 0) > 0]
+    return max(candidates)[2] if candidates else None
+
+def negotiate_format(accept: str) -> str:
+    available = [MSGPACK, COLUMNAR_JSON] if msgpack else [COLUMNAR_JSON]
+    return _best(_parse_header(accept or ""), available) or JSON
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    available = ["zstd", "gzip"] if zstandard else ["gzip"]
+    return _best(_parse_header(accept_encoding or ""), available) or "identity"
+
+def _patches(patches: List[RecordPatch]) -> List[dict]:
+    return [
+        {
+            "sync_id": p.sync_id,
+            "updated_at": epoch_ms(p.updated_at),
+            "fields": jsonable_encoder(p.fields),
+            "field_updated_at": {name: epoch_ms(t) for name, t in p.field_updated_at.items()},
+            "created_at": epoch_ms(p.created_at) if p.created_at else None,
+            "deleted": p.deleted,
+        }
+        for p in patches
+    ]
+
+def columnar(response: SyncResponse) -> dict:
+    categories = response.categories
+    position = {c.id: i for i, c in enumerate(categories)}
+    transactions = response.transactions
+    return {
+        "v": COLUMNAR_VERSION,
+        "last_sync": epoch_ms(response.last_sync),
+        "seq": response.seq,
+        "written": response.written,
+        "skipped": response.skipped,
+        "conflicts": jsonable_encoder(response.conflicts),
+        "categories": {
+            "id": [c.id for c in categories],
+            "name": [c.name for c in categories],
+            "type": [c.type.value for c in categories],
+            "color": [c.color for c in categories],
+            "icon": [c.icon for c in categories],
+            "sync_id": [c.sync_id for c in categories],
+            "created_at": [epoch_ms(c.created_at) for c in categories],
+            "updated_at": [epoch_ms(c.updated_at) for c in categories],
+        },
+        "transactions": {
+            "id": [t.id for t in transactions],
+            "category": [position.get(t.category_id, -1) for t in transactions],
+            "amount_cents": [amount_to_cents(t.amount) for t in transactions],
+            "currency": [t.currency for t in transactions],
+            "description": [t.description for t in transactions],
+            "date": [epoch_ms(t.date) for t in transactions],
+            "sync_id": [t.sync_id for t in transactions],
+            "created_at": [epoch_ms(t.created_at) for t in transactions],
+            "updated_at": [epoch_ms(t.updated_at) for t in transactions],
+        },
+        "category_patches": _patches(response.category_patches),
+        "transaction_patches": _patches(response.transaction_patches),
+    }
+
+def encode(response: SyncResponse, media_type: str) -> bytes:
+    if media_type == MSGPACK:
+        return msgpack.packb(columnar(response), use_bin_type=True)
+    if media_type == COLUMNAR_JSON:
+        return json.dumps(columnar(response), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return response.model_dump_json().encode("utf-8")
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=WIRE_ZSTD_LEVEL).compress(body)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=WIRE_GZIP_LEVEL)
+    return body
+
+def encode_sync_response(request: Request, response: SyncResponse) -> Response:
+    media_type = negotiate_format(request.headers.get("accept", ""))
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+
+    started = time.perf_counter()
+    body = encode(response, media_type)
+    encoded = time.perf_counter()
+    if len(body) < WIRE_COMPRESS_MIN_BYTES:
+        encoding = "identity"
+    payload = compress(body, encoding)
+    compressed = time.perf_counter()
+
+    name = media_type.rsplit("/", 1)[1]
+    metrics.observe(f"sync.encode.{name}", encoded - started)
+    metrics.inc(f"sync.bytes.{name}", len(body))
+    metrics.inc(f"sync.bytes_sent.{name}.{encoding}", len(payload))
+    if encoding != "identity":
+        metrics.observe(f"sync.compress.{encoding}", compressed - encoded)
+
+    headers = {
+        "Vary": "Accept, Accept-Encoding",
+        "Server-Timing": (f"encode;dur={(encoded - started) * 1000:.1f}, "
+                          f"compress;dur={(compressed - encoded) * 1000:.1f}"),
+        "X-Uncompressed-Length": str(len(body)),
+    }
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=payload, media_type=media_type, headers=headers)
+
+def sample_response(transactions: int, categories: int) -> SyncResponse:
+    now = datetime.utcnow()
+    cats = [
+        Category(id=i + 1, user_id=1, name=f"Category {i}",
+                 type=CategoryType.EXPENSE if i % 4 else CategoryType.INCOME,
+                 color="#3B82F6", icon="💰", sync_id=str(uuid.uuid4()),
+                 created_at=now, updated_at=now)
+        for i in range(categories)
+    ]
+    txns = []
+    for i in range(transactions):
+        category = cats[i % categories]
+        day = now - timedelta(hours=i)
+        txns.append(Transaction(
+            id=i + 1, user_id=1, category_id=category.id,
+            amount=Decimal(i % 10000) / 100 + 1, description=f"Payment #{i % 500}",
+            date=day, sync_id=str(uuid.uuid4()), created_at=day, updated_at=day,
+            category=category))
+    return SyncResponse(categories=cats, transactions=txns, conflicts=[], last_sync=now)
+
+def bench(transactions: int, categories: int) -> List[Tuple[str, str, int, float, float]]:
+    response = sample_response(transactions, categories)
+    rows = []
+
+    # What FastAPI does for `return SyncResponse(...)` with response_model
+    started = time.perf_counter()
+    body = json.dumps(jsonable_encoder(response)).encode("utf-8")
+    rows.append(("json (current)", "identity", len(body), time.perf_counter() - started, 0.0))
+
+    formats = [JSON, COLUMNAR_JSON] + ([MSGPACK] if msgpack else [])
+    encodings = ["identity", "gzip"] + (["zstd"] if zstandard else [])
+    for media_type in formats:
+        started = time.perf_counter()
+        body = encode(response, media_type)
+        encode_time = time.perf_counter() - started
+        for encoding in encodings:
+            started = time.perf_counter()
+            payload = compress(body, encoding)
+            rows.append((media_type, encoding, len(payload), encode_time, time.perf_counter() - started))
+    return rows
+
+def main(argv: List[str]) -> int:
+    usage = "usage: python -m app.wire bench [transactions] [categories]"
+    if not argv or argv[0] != "bench":
+        print(usage)
+        return 2
+    transactions = int(argv[1]) if len(argv) > 1 else 10000
+    categories = int(argv[2]) if len(argv) > 2 else 20
+
+    rows = bench(transactions, categories)
+    baseline = rows[0][2]
+    print(f"{transactions} transactions, {categories} categories"
+          f"{'' if msgpack else ' (msgpack not installed)'}"
+          f"{'' if zstandard else ' (zstandard not installed)'}")
+    print(f"{'format':<40} {'encoding':<9} {'bytes':>10} {'ratio':>6} {'encode ms':>10} {'compress ms':>12}")
+    for media_type, encoding, size, encode_time, compress_time in rows:
+        print(f"{media_type:<40} {encoding:<9} {size:>10} {size / baseline:>6.2f} "
+              f"{encode_time * 1000:>10.1f} {compress_time * 1000:>12.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
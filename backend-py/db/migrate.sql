@@ -1,6 +1,9 @@
 PRAGMA journal_mode=WAL;
 PRAGMA foreign_keys=ON;
 
+-- Время в users/categories/transactions/change_log — INTEGER epoch ms (UTC):
+-- здесь колонки объявлены TEXT, как в первой версии схемы, миграция 7 (app/db.py) их переводит.
+
 -- users
 CREATE TABLE IF NOT EXISTS users (
   id            INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -33,9 +36,9 @@ CREATE TABLE IF NOT EXISTS transactions (
   id           INTEGER PRIMARY KEY AUTOINCREMENT,
   user_id      INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
   category_id  INTEGER NOT NULL REFERENCES categories(id) ON DELETE RESTRICT,
-  amount       NUMERIC NOT NULL,                 -- Decimal(…); хранится как NUMERIC
+  amount       NUMERIC NOT NULL,                 -- миграция 6 заменяет на amount_cents INTEGER
   description  TEXT NOT NULL,
-  date         TEXT NOT NULL,                    -- ISO8601
+  date         TEXT NOT NULL,                    -- epoch ms после миграции 7
   created_at   TEXT NOT NULL,
   updated_at   TEXT NOT NULL,
   deleted_at   TEXT,
@@ -44,4 +47,88 @@ CREATE TABLE IF NOT EXISTS transactions (
 CREATE INDEX IF NOT EXISTS idx_tx_user ON transactions(user_id);
 CREATE INDEX IF NOT EXISTS idx_tx_category ON transactions(category_id);
 CREATE INDEX IF NOT EXISTS idx_tx_updated ON transactions(updated_at);
-CREATE INDEX IF NOT EXISTS idx_tx_deleted ON transactions(deleted_at);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_tx_deleted ON transactions(deleted_at);
+CREATE INDEX IF NOT EXISTS idx_tx_user_date ON transactions(user_id, date);  -- отчёты по периодам (app/reports.py)
+-- курсы валют (app/currency.py): единиц валюты за 1 BASE_CURRENCY, действуют с day
+CREATE TABLE IF NOT EXISTS currency_rates (
+  currency  TEXT NOT NULL,
+  day       TEXT NOT NULL,                       -- YYYY-MM-DD
+  rate      REAL NOT NULL CHECK(rate > 0),
+  PRIMARY KEY (currency, day)
+) WITHOUT ROWID;
+-- каждая загрузка курсов; MAX(id) сбрасывает кэш курсов в воркерах
+CREATE TABLE IF NOT EXISTS currency_rate_imports (
+  id           INTEGER PRIMARY KEY AUTOINCREMENT,
+  source       TEXT NOT NULL,
+  rows         INTEGER NOT NULL,
+  imported_at  TEXT NOT NULL
+);
+
+-- import rules: description substring → category
+CREATE TABLE IF NOT EXISTS import_rules (
+  id           INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id      INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  pattern      TEXT NOT NULL,                    -- подстрока описания, без учёта регистра
+  category_id  INTEGER NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+  priority     INTEGER NOT NULL DEFAULT 0,       -- больший приоритет проверяется первым
+  created_at   TEXT NOT NULL,
+  updated_at   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_import_rules_user ON import_rules(user_id, priority);
+
+-- recurring templates (app/recurring.py): due dates become transactions on the next read or sync
+CREATE TABLE IF NOT EXISTS recurring_transactions (
+  id            INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id       INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  category_id   INTEGER NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+  amount_cents  INTEGER NOT NULL,
+  currency      TEXT NOT NULL,
+  description   TEXT NOT NULL,
+  freq          TEXT NOT NULL CHECK(freq IN ('daily','weekly','monthly','yearly')),
+  every         INTEGER NOT NULL DEFAULT 1,
+  start_date    TEXT NOT NULL,                   -- YYYY-MM-DD
+  end_date      TEXT,
+  next_due      TEXT,                            -- первая не созданная дата, NULL — расписание закончилось
+  created_at    INTEGER NOT NULL,
+  updated_at    INTEGER NOT NULL
+);
+-- только шаблоны с будущими датами: поиск наступивших — O(наступивших)
+CREATE INDEX IF NOT EXISTS idx_recurring_due ON recurring_transactions(user_id, next_due) WHERE next_due IS NOT NULL;
+
+-- background jobs (app/jobs.py)
+CREATE TABLE IF NOT EXISTS jobs (
+  id             TEXT PRIMARY KEY,
+  user_id        INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  kind           TEXT NOT NULL,
+  priority       INTEGER NOT NULL DEFAULT 0,
+  status         TEXT NOT NULL,                  -- queued | running | done | failed | cancelled
+  payload        TEXT NOT NULL DEFAULT '{}',     -- JSON
+  result         TEXT,                           -- JSON
+  progress       REAL NOT NULL DEFAULT 0,
+  progress_info  TEXT,                           -- JSON
+  error          TEXT,
+  attempts       INTEGER NOT NULL DEFAULT 0,
+  max_attempts   INTEGER NOT NULL DEFAULT 3,
+  run_after      TEXT NOT NULL,
+  locked_by      TEXT,
+  locked_until   TEXT,
+  created_at     TEXT NOT NULL,
+  started_at     TEXT,
+  finished_at    TEXT,
+  updated_at     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, priority, run_after);
+CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_id, status);
+CREATE INDEX IF NOT EXISTS idx_jobs_user_created ON jobs(user_id, created_at);
+
+-- append-only change log for sync (app/changes.py)
+CREATE TABLE IF NOT EXISTS change_log (
+  seq         INTEGER PRIMARY KEY AUTOINCREMENT,  -- выдаёт сервер, только растёт
+  user_id     INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  table_name  TEXT NOT NULL,                      -- categories | transactions
+  sync_id     TEXT NOT NULL,
+  op          TEXT NOT NULL,                      -- insert | update | delete
+  fields      TEXT,                               -- JSON-список изменённых полей (update)
+  changed_at  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_change_log_user_seq ON change_log(user_id, seq);
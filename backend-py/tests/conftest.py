@@ -0,0 +1,26 @@
+"""
+The app under test runs on a throw-away SQLite file. The settings are read
+when app modules are imported, so they are set here, before any test module
+imports them.
+
+DATABASE_URL, when set, is an admin DSN for the PostgreSQL half of
+test_storage.py (it creates and drops a scratch database); it is moved to
+POSTGRES_ADMIN_DSN so the in-process app does not pick it up.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+# init_db finds db/migrate.sql relative to the working directory, as the service does
+os.chdir(Path(__file__).resolve().parent.parent)
+
+_tmp = tempfile.mkdtemp(prefix="budget-tests-")
+os.environ.setdefault("POSTGRES_ADMIN_DSN", os.environ.get("DATABASE_URL", ""))
+os.environ.update(
+    DATABASE_URL="",
+    DB_PATH=os.path.join(_tmp, "budget.db"),
+    LOCK_DIR=os.path.join(_tmp, "locks"),
+    JOB_WORKERS="0",
+    REPLICA_INTERVAL_SECONDS="0",
+    BACKUP_INTERVAL_HOURS="0",
+)
@@ -0,0 +1,28 @@
+"""SQL statement budgets (app/querybudget.py) and the identical re-sync, against a throw-away database."""
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.querybudget import QUERY_BUDGETS, SCENARIO, run_scenario, check_resync
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        credentials = {"email": "budget@example.com", "password": "query-budget"}
+        client.post("/api/auth/register", json=credentials)
+        token = client.post("/api/auth/login", json=credentials).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        yield client
+
+
+def test_routes_within_budget(client):
+    worst = run_scenario(client, {}, lambda method, path, spent, budget: None, SCENARIO)
+    assert sorted(QUERY_BUDGETS) == sorted(worst), "every budgeted route is exercised"
+    over = {f"{method} {route}": (spent, QUERY_BUDGETS[(method, route)])
+            for (method, route), spent in worst.items() if spent > QUERY_BUDGETS[(method, route)]}
+    assert over == {}
+
+
+def test_identical_resync_writes_nothing(client):
+    assert check_resync(client, {}) == []
@@ -0,0 +1,48 @@
+"""
+The storage check scenarios (app/storage.py) on SQLite and PostgreSQL.
+
+Each backend runs querybudget.SCENARIO + storage.CHECK_SCENARIO in a child
+process on a fresh database. PostgreSQL needs asyncpg and an admin DSN in
+DATABASE_URL (a scratch database is created and dropped through it), and is
+skipped otherwise:
+
+    DATABASE_URL=postgresql://postgres@localhost/postgres pytest tests/test_storage.py
+"""
+import importlib.util
+import os
+
+import pytest
+
+from app.storage import backend_problems, check_backend, compare_backends
+
+ADMIN_DSN = os.environ.get("POSTGRES_ADMIN_DSN", "")
+
+needs_postgres = pytest.mark.skipif(
+    not ADMIN_DSN or importlib.util.find_spec("asyncpg") is None,
+    reason="PostgreSQL check needs asyncpg and an admin DSN in DATABASE_URL",
+)
+
+BACKENDS = ["sqlite", pytest.param("postgres", marks=needs_postgres)]
+
+
+@pytest.fixture(scope="module")
+def results():
+    """Backend -> check result, each backend run once per module."""
+    cache = {}
+
+    def run(backend: str) -> dict:
+        if backend not in cache:
+            cache[backend] = check_backend(backend, ADMIN_DSN)
+        return cache[backend]
+
+    return run
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_scenario(backend, results):
+    assert backend_problems(backend, results(backend)) == []
+
+
+@needs_postgres
+def test_backends_agree(results):
+    assert compare_backends(results("sqlite"), results("postgres")) == []
@@ -0,0 +1,159 @@
+"""
+Materialized running balances for operations.
+
+Every operation contributes its signed amount (income +, expense -) to two
+scopes: its wallet and its category, per currency. Two tables hold the result:
+
+  balances      — current total per (user, scope, key, currency)
+  balance_days  — end-of-day checkpoints: the day's delta and the cumulative
+                  balance up to that day
+
+Push updates both incrementally from the old and new versions of each
+operation, so no history is rescanned. The balance at a date is one index
+seek: the last checkpoint on or before that day. Both tables can be rebuilt
+from operations at any time:
+
+    python -m app.balances rebuild [user_id]
+"""
+import asyncio, logging, sys
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from .db import get_db, DB_PATH
+from .deps import get_claims
+
+log = logging.getLogger(__name__)
+router = APIRouter(prefix="/api/balances", tags=["balances"])
+
+SCOPES = ("wallet", "category")
+
+def contributions(op):
+    """[(scope, key, currency, day, signed_cents)] of one operation version."""
+    if not op or op["deleted_at"]:
+        return []
+    amount = op["amount_cents"] if op["type"] == "income" else -op["amount_cents"]
+    day = op["date"][:10]
+    out = [("category", op["category_id"], op["currency"], day, amount)]
+    if op["wallet"]:
+        out.append(("wallet", op["wallet"], op["currency"], day, amount))
+    return out
+
+async def _add(db, uid, scope, key, currency, day, cents, now):
+    await db.execute(
+        "INSERT INTO balances(user_id, scope, key, currency, total_cents, updated_at) VALUES(?,?,?,?,?,?) "
+        "ON CONFLICT(user_id, scope, key, currency) DO UPDATE SET "
+        "total_cents=total_cents+excluded.total_cents, updated_at=excluded.updated_at",
+        (uid, scope, key, currency, cents, now)
+    )
+    # Контрольная точка дня: накопленный итог предыдущего дня + дельта
+    await db.execute(
+        "INSERT INTO balance_days(user_id, scope, key, currency, day, delta_cents, cumulative_cents) "
+        "SELECT ?,?,?,?,?,0,COALESCE((SELECT cumulative_cents FROM balance_days "
+        "  WHERE user_id=? AND scope=? AND key=? AND currency=? AND day<? ORDER BY day DESC LIMIT 1), 0) "
+        "WHERE true ON CONFLICT DO NOTHING",  # WHERE нужен SQLite для INSERT…SELECT…ON CONFLICT
+        (uid, scope, key, currency, day, uid, scope, key, currency, day)
+    )
+    await db.execute(
+        "UPDATE balance_days SET delta_cents=delta_cents+? "
+        "WHERE user_id=? AND scope=? AND key=? AND currency=? AND day=?",
+        (cents, uid, scope, key, currency, day)
+    )
+    # Все последующие точки сдвигаются одним диапазонным UPDATE по индексу
+    await db.execute(
+        "UPDATE balance_days SET cumulative_cents=cumulative_cents+? "
+        "WHERE user_id=? AND scope=? AND key=? AND currency=? AND day>=?",
+        (cents, uid, scope, key, currency, day)
+    )
+
+async def apply_operation_change(db, uid, old, new, now):
+    """Move the balances from the old version of an operation to the new one."""
+    for scope, key, currency, day, cents in contributions(old):
+        await _add(db, uid, scope, key, currency, day, -cents, now)
+    for scope, key, currency, day, cents in contributions(new):
+        await _add(db, uid, scope, key, currency, day, cents, now)
+
+async def rebuild_balances(db, uid: Optional[str] = None):
+    """Recompute balances and checkpoints from operations (all users if uid is None)."""
+    where, args = ("WHERE user_id=?", (uid,)) if uid else ("", ())
+    await db.execute(f"DELETE FROM balances {where}", args)
+    await db.execute(f"DELETE FROM balance_days {where}", args)
+    op_filter = "deleted_at IS NULL" + (" AND user_id=?" if uid else "")
+    signed = "CASE type WHEN 'income' THEN amount_cents ELSE -amount_cents END"
+    for scope, column in (("category", "category_id"), ("wallet", "wallet")):
+        await db.execute(
+            "INSERT INTO balance_days(user_id, scope, key, currency, day, delta_cents, cumulative_cents) "
+            "SELECT user_id, ?, k, currency, day, delta, "
+            "  SUM(delta) OVER (PARTITION BY user_id, k, currency ORDER BY day) "
+            f"FROM (SELECT user_id, {column} AS k, currency, substr(date,1,10) AS day, SUM({signed}) AS delta "
+            f"      FROM operations WHERE {op_filter} AND {column} IS NOT NULL AND {column} != '' "
+            "      GROUP BY user_id, k, currency, day)",
+            (scope, *args)
+        )
+    await db.execute(
+        "INSERT INTO balances(user_id, scope, key, currency, total_cents, updated_at) "
+        "SELECT user_id, scope, key, currency, SUM(delta_cents), strftime('%Y-%m-%dT%H:%M:%SZ','now') "
+        f"FROM balance_days {where} GROUP BY user_id, scope, key, currency",
+        args
+    )
+
+async def backfill_balances(db):
+    # Первый запуск после появления таблиц: считаем всё один раз
+    if await (await db.execute("SELECT 1 FROM balances LIMIT 1")).fetchone():
+        return
+    if not await (await db.execute("SELECT 1 FROM operations LIMIT 1")).fetchone():
+        return
+    await rebuild_balances(db)
+    log.info("🔧 balances rebuilt from operations")
+
+@router.get("")
+async def get_balances(
+    scope: Optional[str] = None,
+    at: Optional[str] = None,
+    claims = Depends(get_claims),
+    db = Depends(get_db)
+):
+    """Current balances, or balances at the end of day `at` (YYYY-MM-DD)."""
+    if scope and scope not in SCOPES:
+        raise HTTPException(400, f"scope must be one of {', '.join(SCOPES)}")
+    uid = claims["uid"]
+    where, args = "WHERE user_id=?", [uid]
+    if scope:
+        where += " AND scope=?"
+        args.append(scope)
+    keys = await (await db.execute(
+        f"SELECT scope, key, currency, total_cents FROM balances {where} ORDER BY scope, key, currency",
+        args
+    )).fetchall()
+    if not at:
+        return [{"scope": r["scope"], "key": r["key"], "currency": r["currency"],
+                 "balance_cents": r["total_cents"]} for r in keys]
+
+    out = []
+    for r in keys:
+        # Последняя контрольная точка не позже `at`: один seek по первичному ключу
+        cp = await (await db.execute(
+            "SELECT cumulative_cents FROM balance_days "
+            "WHERE user_id=? AND scope=? AND key=? AND currency=? AND day<=? ORDER BY day DESC LIMIT 1",
+            (uid, r["scope"], r["key"], r["currency"], at[:10])
+        )).fetchone()
+        out.append({"scope": r["scope"], "key": r["key"], "currency": r["currency"],
+                    "balance_cents": cp["cumulative_cents"] if cp else 0})
+    return out
+
+async def _rebuild_cli(uid):
+    import aiosqlite, sqlite3
+    async with aiosqlite.connect(DB_PATH, timeout=5) as db:
+        db.row_factory = sqlite3.Row
+        await rebuild_balances(db, uid)
+        await db.commit()
+
+def main(argv):
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if not argv or argv[0] != "rebuild":
+        print("usage: python -m app.balances rebuild [user_id]")
+        return 2
+    asyncio.run(_rebuild_cli(argv[1] if len(argv) > 1 else None))
+    print("✅ balances rebuilt")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -19,9 +19,28 @@ async def init_db():
         await db.execute("PRAGMA journal_mode=WAL;")
         await db.execute("PRAGMA foreign_keys=ON;")
         await db.executescript(sql)
+        await backfill_change_log(db)
         await db.commit()
     log.info("✅ Migrations applied")
 
+CHANGE_LOG_TABLES = ("categories", "sources", "rules", "operations", "recurring")
+
+async def backfill_change_log(db):
+    # Строки, записанные до появления change_log, попадают в журнал один раз
+    cur = await db.execute("SELECT 1 FROM change_log LIMIT 1")
+    if await cur.fetchone():
+        return
+    added = 0
+    for t in CHANGE_LOG_TABLES:
+        cur = await db.execute(
+            f"INSERT INTO change_log(user_id, table_name, row_id, op, changed_at) "
+            f"SELECT user_id, '{t}', id, CASE WHEN deleted_at IS NULL THEN 'upsert' ELSE 'delete' END, "
+            f"updated_at FROM {t} ORDER BY updated_at"
+        )
+        added += cur.rowcount
+    if added:
+        log.info(f"🔧 change_log backfilled with {added} rows")
+
 async def get_db() -> AsyncIterator[aiosqlite.Connection]:
     db = await aiosqlite.connect(DB_PATH, timeout=5)
     db.row_factory = sqlite3.Row
@@ -0,0 +1,231 @@
+"""
+Cash-flow forecast per category.
+
+Schedules are built from the last FORECAST_HISTORY_MONTHS full months:
+
+  income   — per source: its average monthly income, paid on the day of
+             `expected_date` (or the most frequent payday in history) and
+             split into categories by the source's rules like the plan page
+             does (percent, capped by cap_cents, the rest to 'reserve');
+             sources without rules keep their historical split
+  expenses — per category: its average monthly spend, spread over the month
+             by the category's day-of-month profile
+  planned  — operations already dated in the future
+
+All amounts are in the base currency (amount_cents * rate). The projection is
+array math over a (category × day) grid, so its cost does not depend on the
+amount of history. Results are cached until the user's change_log seq moves.
+"""
+from collections import OrderedDict
+import datetime, logging, os, time
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException
+from .db import get_db
+from .deps import get_claims
+from .sync import latest_seq
+
+log = logging.getLogger(__name__)
+router = APIRouter(prefix="/api/forecast", tags=["forecast"])
+
+FORECAST_HISTORY_MONTHS = int(os.getenv("FORECAST_HISTORY_MONTHS", "6"))
+FORECAST_CACHE_SIZE = int(os.getenv("FORECAST_CACHE_SIZE", "256"))
+MAX_MONTHS = 60
+RESERVE = "reserve"
+
+# (uid, months, today) -> (seq, result)
+_cache = OrderedDict()
+
+def _add_months(day: datetime.date, months: int) -> datetime.date:
+    m = day.year * 12 + day.month - 1 + months
+    return datetime.date(m // 12, m % 12 + 1, 1)
+
+async def load_history(db, uid, today: datetime.date):
+    """Everything the projection needs, aggregated by SQLite into small row sets."""
+    window_end = today.replace(day=1)
+    window_start = _add_months(window_end, -FORECAST_HISTORY_MONTHS)
+    live = "user_id=? AND deleted_at IS NULL"
+    window = (uid, window_start.isoformat(), window_end.isoformat())
+    q = lambda sql, args: db.execute(sql, args)
+    h = {}
+    first = await (await q(f"SELECT MIN(date) AS d FROM operations WHERE {live}", (uid,))).fetchone()
+    h["first_day"] = datetime.date.fromisoformat(first["d"][:10]) if first["d"] else None
+    h["expense"] = await (await q(
+        "SELECT category_id, CAST(substr(date,9,2) AS INTEGER) AS dom, SUM(amount_cents*rate) AS cents "
+        f"FROM operations WHERE {live} AND type='expense' AND date>=? AND date<? GROUP BY category_id, dom",
+        window)).fetchall()
+    h["income"] = await (await q(
+        "SELECT COALESCE(source_id,'') AS source, category_id, CAST(substr(date,9,2) AS INTEGER) AS dom, "
+        "COUNT(*) AS n, SUM(amount_cents*rate) AS cents "
+        f"FROM operations WHERE {live} AND type='income' AND date>=? AND date<? GROUP BY source, category_id, dom",
+        window)).fetchall()
+    # Остаток на сегодня — из материализованных балансов (app/balances.py), валюта по последнему курсу
+    h["start"] = await (await q(
+        "SELECT b.key AS category_id, b.currency, (SELECT cumulative_cents FROM balance_days d "
+        "  WHERE d.user_id=b.user_id AND d.scope=b.scope AND d.key=b.key AND d.currency=b.currency AND d.day<=? "
+        "  ORDER BY d.day DESC LIMIT 1) AS cents "
+        "FROM balances b WHERE b.user_id=? AND b.scope='category'",
+        (today.isoformat(), uid))).fetchall()
+    h["rates"] = {}
+    for currency in {r["currency"] for r in h["start"]}:
+        row = await (await q(
+            f"SELECT rate FROM operations WHERE {live} AND currency=? ORDER BY date DESC LIMIT 1",
+            (uid, currency))).fetchone()
+        h["rates"][currency] = row["rate"] if row else 1.0
+    h["planned"] = await (await q(
+        "SELECT category_id, type, substr(date,1,10) AS day, SUM(amount_cents*rate) AS cents "
+        f"FROM operations WHERE {live} AND date>=? GROUP BY category_id, type, day",
+        (uid, (today + datetime.timedelta(days=1)).isoformat()))).fetchall()
+    h["sources"] = await (await q(f"SELECT id, expected_date FROM sources WHERE {live}", (uid,))).fetchall()
+    h["rules"] = await (await q(
+        f"SELECT source_id, category_id, percent, cap_cents FROM rules WHERE {live}", (uid,))).fetchall()
+    h["categories"] = await (await q(
+        f"SELECT id, name FROM categories WHERE {live} ORDER BY name", (uid,))).fetchall()
+    return h
+
+def project(h, today: datetime.date, months: int):
+    start = today + datetime.timedelta(days=1)
+    end = _add_months(start, months)
+    days = np.arange(np.datetime64(start), np.datetime64(end), dtype="datetime64[D]")
+    month_of = days.astype("datetime64[M]")
+    dom = (days - month_of.astype("datetime64[D]")).astype(np.int64) + 1
+    mlen = ((month_of + 1).astype("datetime64[D]") - month_of.astype("datetime64[D]")).astype(np.int64)
+
+    # История короче окна — делим на фактическое число месяцев
+    covered = FORECAST_HISTORY_MONTHS
+    if h["first_day"]:
+        seen = (today.year - h["first_day"].year) * 12 + today.month - h["first_day"].month
+        covered = max(1, min(FORECAST_HISTORY_MONTHS, seen))
+
+    names = {r["id"]: r["name"] for r in h["categories"]}
+    cats = {c: i for i, c in enumerate(names)}
+    idx = lambda c: cats.setdefault(c, len(cats))
+    sources = {r["id"]: r["expected_date"] for r in h["sources"]}
+    for r in h["income"]:
+        sources.setdefault(r["source"], None)
+    src = {s: i for i, s in enumerate(sources)}
+    rules = {}
+    for r in h["rules"]:
+        rules.setdefault(r["source_id"], []).append(r)
+
+    # Расходы: месячное среднее × профиль по дням месяца
+    hist = {}
+    for r in h["expense"]:
+        hist[(idx(r["category_id"]), r["dom"])] = r["cents"]
+    # Доходы: месячное среднее по источнику и его раскладка по категориям
+    income = np.zeros(len(src))
+    split = {}
+    for r in h["income"]:
+        k = (src[r["source"]], idx(r["category_id"]))
+        income[k[0]] += r["cents"] / covered
+        split[k] = split.get(k, 0) + r["cents"] / covered
+    alloc = {}
+    for s, i in src.items():
+        if s in rules and income[i] > 0:
+            rest = income[i]
+            for r in rules[s]:
+                share = min(np.floor(income[i] * r["percent"] / 100), r["cap_cents"] if r["cap_cents"] is not None else np.inf)
+                alloc[(i, idx(r["category_id"]))] = alloc.get((i, idx(r["category_id"])), 0) + share
+                rest -= share
+            if rest > 0:
+                alloc[(i, idx(RESERVE))] = alloc.get((i, idx(RESERVE)), 0) + rest
+        else:
+            alloc.update({k: v for k, v in split.items() if k[0] == i})
+    for r in h["start"] + h["planned"]:
+        idx(r["category_id"])
+
+    C, S, D = len(cats), len(src), len(days)
+    profile = np.zeros((C, 32))
+    for (c, d), cents in hist.items():
+        profile[c, min(max(d, 1), 31)] += cents
+    monthly_spend = profile.sum(axis=1) / covered
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cum = np.nan_to_num(np.cumsum(profile, axis=1) / profile.sum(axis=1, keepdims=True))
+    # Последний день короткого месяца забирает хвост профиля (29–31 числа)
+    upper = np.where(dom == mlen, 31, dom)
+    expense = monthly_spend[:, None] * (cum[:, upper] - cum[:, dom - 1])
+
+    payday = np.ones(S, dtype=np.int64)
+    first_pay = np.full(S, np.datetime64(start))
+    counts = {}
+    for r in h["income"]:
+        k = (src[r["source"]], r["dom"])
+        counts[k] = counts.get(k, 0) + r["n"]
+    best = {}
+    for (i, d), n in counts.items():
+        if n > best.get(i, 0):
+            best[i], payday[i] = n, d
+    for s, expected in sources.items():
+        if expected:
+            payday[src[s]] = int(expected[8:10])
+            first_pay[src[s]] = max(np.datetime64(expected[:10]), np.datetime64(start))
+    paid = (dom[None, :] == np.minimum(payday[:, None], mlen[None, :])) & (days[None, :] >= first_pay[:, None])
+    A = np.zeros((S, C))
+    for (s, c), cents in alloc.items():
+        A[s, c] = cents
+    inflow = A.T @ paid
+
+    day0 = np.datetime64(start)
+    for r in h["planned"]:
+        d = (np.datetime64(r["day"]) - day0).astype(np.int64)
+        if d < D:
+            (inflow if r["type"] == "income" else expense)[cats[r["category_id"]], d] += r["cents"]
+
+    opening = np.zeros(C)
+    for r in h["start"]:
+        opening[cats[r["category_id"]]] += (r["cents"] or 0) * h["rates"][r["currency"]]
+    balance = opening[:, None] + np.cumsum(inflow - expense, axis=1)
+
+    bounds = np.flatnonzero(np.r_[True, month_of[1:] != month_of[:-1]])
+    last = np.r_[bounds[1:] - 1, D - 1]
+    as_cents = lambda a: np.rint(a).astype(np.int64).tolist()
+    income_m = np.add.reduceat(inflow, bounds, axis=1)
+    expense_m = np.add.reduceat(expense, bounds, axis=1)
+    balance_m = balance[:, last]
+    out = [{
+        "category_id": c, "name": names.get(c, c),
+        "start_cents": int(round(opening[i])),
+        "income_cents": as_cents(income_m[i]),
+        "expense_cents": as_cents(expense_m[i]),
+        "balance_cents": as_cents(balance_m[i]),
+    } for c, i in cats.items()]
+    return {
+        "from": start.isoformat(), "to": (end - datetime.timedelta(days=1)).isoformat(),
+        "history_months": covered,
+        "months": [str(m) for m in month_of[bounds]],
+        "categories": out,
+        "total": {
+            "start_cents": int(round(opening.sum())),
+            "income_cents": as_cents(income_m.sum(axis=0)),
+            "expense_cents": as_cents(expense_m.sum(axis=0)),
+            "balance_cents": as_cents(balance_m.sum(axis=0)),
+        },
+    }
+
+@router.get("")
+async def get_forecast(months: int = 12, claims = Depends(get_claims), db = Depends(get_db)):
+    """Projected income, expenses and end-of-month balances for the next `months` months."""
+    if not 1 <= months <= MAX_MONTHS:
+        raise HTTPException(400, f"months must be between 1 and {MAX_MONTHS}")
+    uid = claims["uid"]
+    today = datetime.datetime.utcnow().date()
+    key = (uid, months, today)
+    await db.execute("BEGIN")
+    try:
+        seq = await latest_seq(db, uid)
+        hit = _cache.get(key)
+        if hit and hit[0] == seq:
+            _cache.move_to_end(key)
+            return {**hit[1], "seq": seq, "cached": True}
+        started = time.perf_counter()
+        h = await load_history(db, uid, today)
+    finally:
+        await db.rollback()
+    loaded = time.perf_counter()
+    result = project(h, today, months)
+    done = time.perf_counter()
+    log.info(f"📈 forecast {uid} {months}m: load {(loaded - started) * 1000:.1f}ms, "
+             f"project {(done - loaded) * 1000:.1f}ms")
+    _cache[key] = (seq, result)
+    while len(_cache) > FORECAST_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return {**result, "seq": seq, "cached": False}
@@ -0,0 +1,184 @@
+"""
+Category spending limits evaluated on the server.
+
+A category's `limit_type` is 'weekly', 'monthly' or 'yearly' (anything else
+means no limit) and `limit_value` is the limit in cents of the base currency
+(amount_cents * rate, as in operations).
+
+Expense usage is kept in counters per (user, category, period) for all three
+period kinds at once, so changing a category's limit type needs no recount.
+Push moves an operation's amount from its old period to the new one with
+three upserts. Reading a category's usage is one primary-key lookup.
+
+Crossing 80% or 100% of a limit upwards appends a row to limit_events (once
+per category, period and threshold).
+
+    python -m app.limits rebuild
+"""
+import asyncio, datetime, logging, sys, time
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from .db import get_db, DB_PATH
+from .deps import get_claims
+
+log = logging.getLogger(__name__)
+router = APIRouter(prefix="/api/limits", tags=["limits"])
+
+LIMIT_TYPES = ("weekly", "monthly", "yearly")
+THRESHOLDS = (80, 100)  # проценты
+
+def period_keys(day: str):
+    """{'weekly': 'W2024-19', 'monthly': 'M2024-05', 'yearly': 'Y2024'} for YYYY-MM-DD."""
+    d = datetime.date.fromisoformat(day[:10])
+    year, week, _ = d.isocalendar()
+    return {"weekly": f"W{year}-{week:02d}", "monthly": f"M{d:%Y-%m}", "yearly": f"Y{d:%Y}"}
+
+def _usage(op):
+    """(category_id, day, cents) an operation version counts towards, or None."""
+    if not op or op["deleted_at"] or op["type"] != "expense":
+        return None
+    return op["category_id"], op["date"][:10], round(op["amount_cents"] * (op["rate"] or 1.0))
+
+def _state(used, limit):
+    if limit <= 0:
+        return "none"
+    pct = used * 100 / limit
+    if pct >= 100:
+        return "exceeded"
+    if pct >= 80:
+        return "warning"
+    return "ok"
+
+async def _category_limit(db, uid, category_id):
+    row = await (await db.execute(
+        "SELECT limit_type, limit_value FROM categories WHERE id=? AND user_id=?", (category_id, uid)
+    )).fetchone()
+    if not row or row["limit_type"] not in LIMIT_TYPES or not row["limit_value"]:
+        return None
+    return row["limit_type"], int(row["limit_value"])
+
+async def _emit_crossings(db, uid, category_id, period, before, after, limit, now):
+    for pct in THRESHOLDS:
+        mark = limit * pct / 100
+        if before < mark <= after:
+            await db.execute(
+                "INSERT OR IGNORE INTO limit_events(user_id, category_id, period, threshold, used_cents, "
+                "limit_cents, created_at) VALUES(?,?,?,?,?,?,?)",
+                (uid, category_id, period, pct, after, limit, now)
+            )
+
+async def _add_usage(db, uid, category_id, day, cents, now):
+    limit = await _category_limit(db, uid, category_id)
+    for kind, period in period_keys(day).items():
+        row = await (await db.execute(
+            "INSERT INTO limit_usage(user_id, category_id, period, used_cents) VALUES(?,?,?,?) "
+            "ON CONFLICT(user_id, category_id, period) DO UPDATE SET used_cents=used_cents+excluded.used_cents "
+            "RETURNING used_cents",
+            (uid, category_id, period, cents)
+        )).fetchone()
+        if limit and limit[0] == kind and cents > 0:
+            await _emit_crossings(db, uid, category_id, period, row["used_cents"] - cents,
+                                  row["used_cents"], limit[1], now)
+
+async def apply_operation_usage(db, uid, old, new, now):
+    """Move limit usage from the old version of an operation to the new one."""
+    before, after = _usage(old), _usage(new)
+    if before == after:
+        return
+    if before:
+        await _add_usage(db, uid, before[0], before[1], -before[2], now)
+    if after:
+        await _add_usage(db, uid, after[0], after[1], after[2], now)
+
+async def check_category_limit(db, uid, category_id, now):
+    """A changed limit can put current usage over a threshold without a new operation."""
+    limit = await _category_limit(db, uid, category_id)
+    if not limit:
+        return
+    period = period_keys(now)[limit[0]]
+    row = await (await db.execute(
+        "SELECT used_cents FROM limit_usage WHERE user_id=? AND category_id=? AND period=?",
+        (uid, category_id, period)
+    )).fetchone()
+    if row:
+        await _emit_crossings(db, uid, category_id, period, -1, row["used_cents"], limit[1], now)
+
+async def rebuild_usage(db):
+    await db.execute("DELETE FROM limit_usage")
+    totals = {}
+    async with db.execute(
+        "SELECT user_id, category_id, date, amount_cents, rate FROM operations "
+        "WHERE type='expense' AND deleted_at IS NULL"
+    ) as cur:
+        async for r in cur:
+            cents = round(r["amount_cents"] * (r["rate"] or 1.0))
+            for period in period_keys(r["date"]).values():
+                key = (r["user_id"], r["category_id"], period)
+                totals[key] = totals.get(key, 0) + cents
+    await db.executemany(
+        "INSERT INTO limit_usage(user_id, category_id, period, used_cents) VALUES(?,?,?,?)",
+        [(*k, v) for k, v in totals.items()]
+    )
+
+async def backfill_usage(db):
+    if await (await db.execute("SELECT 1 FROM limit_usage LIMIT 1")).fetchone():
+        return
+    if not await (await db.execute("SELECT 1 FROM operations WHERE type='expense' LIMIT 1")).fetchone():
+        return
+    await rebuild_usage(db)
+    log.info("🔧 limit usage rebuilt from operations")
+
+@router.get("")
+async def get_limits(at: Optional[str] = None, claims = Depends(get_claims), db = Depends(get_db)):
+    """Usage of every category with a limit in the period containing `at` (default: today)."""
+    day = at or time.strftime("%Y-%m-%d", time.gmtime())
+    try:
+        keys = period_keys(day)
+    except ValueError:
+        raise HTTPException(400, "at must be YYYY-MM-DD")
+    rows = await (await db.execute(
+        "SELECT c.id, c.name, c.limit_type, c.limit_value, COALESCE(u.used_cents, 0) AS used_cents "
+        "FROM categories c LEFT JOIN limit_usage u ON u.user_id=c.user_id AND u.category_id=c.id "
+        "  AND u.period = CASE c.limit_type WHEN 'weekly' THEN ? WHEN 'monthly' THEN ? WHEN 'yearly' THEN ? END "
+        "WHERE c.user_id=? AND c.deleted_at IS NULL AND c.limit_type IN ('weekly','monthly','yearly') "
+        "  AND c.limit_value > 0 ORDER BY c.name",
+        (keys["weekly"], keys["monthly"], keys["yearly"], claims["uid"])
+    )).fetchall()
+    out = []
+    for r in rows:
+        limit = int(r["limit_value"])
+        out.append({
+            "category_id": r["id"], "name": r["name"], "limit_type": r["limit_type"],
+            "period": keys[r["limit_type"]], "limit_cents": limit, "used_cents": r["used_cents"],
+            "remaining_cents": limit - r["used_cents"], "state": _state(r["used_cents"], limit),
+        })
+    return out
+
+@router.get("/events")
+async def get_limit_events(after: int = 0, limit: int = 100, claims = Depends(get_claims), db = Depends(get_db)):
+    """Threshold crossings with id > after, oldest first."""
+    rows = await (await db.execute(
+        "SELECT id, category_id, period, threshold, used_cents, limit_cents, created_at FROM limit_events "
+        "WHERE user_id=? AND id>? ORDER BY id LIMIT ?",
+        (claims["uid"], after, min(max(limit, 1), 1000))
+    )).fetchall()
+    return [dict(r) for r in rows]
+
+async def _rebuild_cli():
+    import aiosqlite, sqlite3
+    async with aiosqlite.connect(DB_PATH, timeout=5) as db:
+        db.row_factory = sqlite3.Row
+        await rebuild_usage(db)
+        await db.commit()
+
+def main(argv):
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if argv != ["rebuild"]:
+        print("usage: python -m app.limits rebuild")
+        return 2
+    asyncio.run(_rebuild_cli())
+    print("✅ limit usage rebuilt")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
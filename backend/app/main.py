@@ -6,6 +6,10 @@ from .db import init_db, get_db
 from .jwt_utils import parse_token
 from .auth import router as auth_router
 from .sync import router as sync_router
+from .balances import router as balances_router, backfill_balances
+from .limits import router as limits_router, backfill_usage
+from .forecast import router as forecast_router
+from .snapshot import router as snapshot_router
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("app.main")
@@ -14,6 +18,10 @@ log = logging.getLogger("app.main")
 async def lifespan(app: FastAPI):
     log.info("🚀 Starting Budget PWA Backend...")
     await init_db()
+    async for db in get_db():
+        await backfill_balances(db)
+        await backfill_usage(db)
+        await db.commit()
     log.info("✅ Database initialized")
     yield
 
@@ -59,4 +67,8 @@ async def me(request: Request):
     return {"user_id": request.state.claims["uid"], "email": request.state.claims["eml"]}
 
 app.include_router(auth_router)
-app.include_router(sync_router)
\ No newline at end of file
+app.include_router(sync_router)
+app.include_router(balances_router)
+app.include_router(limits_router)
+app.include_router(forecast_router)
+app.include_router(snapshot_router)
\ No newline at end of file
@@ -64,16 +64,37 @@ class Operation(BaseModel):
     updated_at: str
     deleted_at: Optional[str] = None
 
+class Recurring(BaseModel):
+    id: str
+    user_id: str
+    type: Literal["income","expense"]
+    source_id: Optional[str] = None
+    category_id: str
+    wallet: Optional[str] = None
+    amount_cents: int
+    currency: str = "EUR"
+    rate: float = 1.0
+    note: Optional[str] = None
+    freq: Literal["daily","weekly","monthly","yearly"]
+    every: int = Field(1, ge=1)
+    start_date: str
+    end_date: Optional[str] = None
+    created_at: str
+    updated_at: str
+    deleted_at: Optional[str] = None
+
 # ---- Sync ----
 class SyncPush(BaseModel):
     categories: List[Category] = []
     sources:    List[Source]   = []
     rules:      List[Rule]     = []
     operations: List[Operation]= []
+    recurring:  List[Recurring]= []
 
 class SyncPull(BaseModel):
     categories: List[Category]
     sources:    List[Source]
     rules:      List[Rule]
     operations: List[Operation]
+    recurring:  List[Recurring]
     server_time: str
\ No newline at end of file
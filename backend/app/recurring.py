@@ -0,0 +1,123 @@
+"""
+Recurring operations: templates (schedule + amount, category, source) that
+turn into ordinary operations when they come due.
+
+There is no background loop over users. Due instances are materialized
+lazily when the user syncs (pull and push): the (user_id, next_due) partial
+index returns only templates with something due, so the cost is O(due items).
+
+An instance's id is uuid5(template id, date), inserted with ON CONFLICT DO
+NOTHING: running the materializer twice, from two requests or after a crash
+before next_due was saved, never duplicates an operation, and an instance the
+user deleted stays deleted.
+"""
+import datetime, logging, os, uuid
+from .balances import apply_operation_change
+from .limits import apply_operation_usage
+
+log = logging.getLogger(__name__)
+
+RECURRING_BATCH = int(os.getenv("RECURRING_BATCH", "200"))
+
+# Столбцы операции, которые копируются из шаблона
+TEMPLATE_FIELDS = ("type", "source_id", "category_id", "wallet", "amount_cents", "currency", "rate", "note")
+
+def _add_months(day: datetime.date, months: int, dom: int) -> datetime.date:
+    m = day.year * 12 + day.month - 1 + months
+    year, month = m // 12, m % 12 + 1
+    last = (datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)).day
+    return datetime.date(year, month, min(dom, last))
+
+def occurrence(t, n: int) -> datetime.date:
+    """n-th date of a template's schedule; 31st of the month falls back to the month's last day."""
+    start = datetime.date.fromisoformat(t["start_date"][:10])
+    step = n * t["every"]
+    if t["freq"] == "daily":
+        return start + datetime.timedelta(days=step)
+    if t["freq"] == "weekly":
+        return start + datetime.timedelta(weeks=step)
+    return _add_months(start, step * (12 if t["freq"] == "yearly" else 1), start.day)
+
+def first_on_or_after(t, day: datetime.date) -> int:
+    start = datetime.date.fromisoformat(t["start_date"][:10])
+    if day <= start:
+        return 0
+    span = {"daily": 1, "weekly": 7}.get(t["freq"])
+    if span:
+        n = -(-(day - start).days // (span * t["every"]))
+    else:
+        months = (day.year - start.year) * 12 + day.month - start.month
+        n = max(0, months // (t["every"] * (12 if t["freq"] == "yearly" else 1)))
+    while occurrence(t, n) < day:
+        n += 1
+    return n
+
+def instance_id(template_id: str, day: datetime.date) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"recurring:{template_id}:{day.isoformat()}"))
+
+def _next_due(t, after: datetime.date):
+    day = occurrence(t, first_on_or_after(t, after + datetime.timedelta(days=1)))
+    if t["end_date"] and day.isoformat() > t["end_date"][:10]:
+        return None
+    return day.isoformat()
+
+async def reschedule(db, uid, template_id):
+    """After a template is pushed: its next due date is the first one not yet materialized."""
+    t = await (await db.execute(
+        "SELECT * FROM recurring WHERE id=? AND user_id=?", (template_id, uid)
+    )).fetchone()
+    if not t:
+        return
+    day = datetime.date.fromisoformat(t["start_date"][:10])
+    if t["next_due"] and t["next_due"] > t["start_date"][:10]:
+        day = datetime.date.fromisoformat(t["next_due"])
+    due = occurrence(t, first_on_or_after(t, day)).isoformat()
+    if t["end_date"] and due > t["end_date"][:10]:
+        due = None
+    await db.execute("UPDATE recurring SET next_due=? WHERE id=?", (due, template_id))
+
+async def materialize_due(db, uid, now: str) -> int:
+    """Create the user's operations due up to today; returns how many were created.
+
+    Runs inside the caller's transaction; the caller commits."""
+    today = now[:10]
+    created = 0
+    while True:
+        templates = await (await db.execute(
+            "SELECT * FROM recurring WHERE user_id=? AND deleted_at IS NULL AND next_due<=? "
+            "ORDER BY next_due LIMIT ?",
+            (uid, today, RECURRING_BATCH)
+        )).fetchall()
+        if not templates:
+            break
+        for t in templates:
+            last = min(today, t["end_date"][:10]) if t["end_date"] else today
+            n = first_on_or_after(t, datetime.date.fromisoformat(t["next_due"]))
+            day = occurrence(t, n)
+            while day.isoformat() <= last:
+                op = {f: t[f] for f in TEMPLATE_FIELDS}
+                op.update(id=instance_id(t["id"], day), user_id=uid, date=day.isoformat(),
+                          created_at=now, updated_at=now, deleted_at=None)
+                cols = list(op)
+                cur = await db.execute(
+                    f"INSERT INTO operations({', '.join(cols)}) VALUES({', '.join('?' * len(cols))}) "
+                    "ON CONFLICT(id) DO NOTHING",
+                    [op[c] for c in cols]
+                )
+                if cur.rowcount:
+                    created += 1
+                    await db.execute(
+                        "INSERT INTO change_log(user_id, table_name, row_id, op, changed_at) VALUES(?,?,?,?,?)",
+                        (uid, "operations", op["id"], "upsert", now)
+                    )
+                    await apply_operation_change(db, uid, None, op, now)
+                    await apply_operation_usage(db, uid, None, op, now)
+                n += 1
+                day = occurrence(t, n)
+            await db.execute(
+                "UPDATE recurring SET next_due=? WHERE id=?",
+                (_next_due(t, datetime.date.fromisoformat(today)), t["id"])
+            )
+    if created:
+        log.info(f"🔁 {created} recurring operations materialized for {uid}")
+    return created
@@ -0,0 +1,169 @@
+"""
+Bootstrap snapshot of a user's data for a new device.
+
+A fresh device used to fill its local store by pulling every row ever
+written through /api/sync/pull. GET /api/sync/snapshot serves one prebuilt
+file instead: all live rows (deleted_at IS NULL) of the synced tables and the
+change_log seq they are consistent with, as gzip-compressed JSON with the
+column names listed once per table:
+
+  {"v": 1, "seq": 42, "server_time": "...",
+   "tables": {"categories": {"columns": ["id", ...], "rows": [[...], ...]}, ...}}
+
+The device then continues with /api/sync/pull?since_seq=<seq>.
+
+Files live in SNAPSHOT_DIR, one per user, and are rebuilt on the first
+request after the user's seq moves. A cache hit costs a change_log index
+seek and a sequential file read. The ETag carries the seq: If-None-Match
+answers 304, Range (single range) and If-Range resume a cut-off download.
+"""
+import asyncio, gzip, hashlib, json, logging, os, re, tempfile, time
+from pathlib import Path
+from typing import Optional, Tuple
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from .db import get_db, DB_PATH
+from .deps import get_claims
+from .recurring import materialize_due
+from .sync import TABLES, latest_seq, _now
+
+log = logging.getLogger(__name__)
+router = APIRouter(tags=["sync"])
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", str(Path(DB_PATH).parent / "snapshots"))
+SNAPSHOT_GZIP_LEVEL = int(os.getenv("SNAPSHOT_GZIP_LEVEL", "6"))
+SNAPSHOT_VERSION = 1
+MEDIA_TYPE = "application/gzip"
+READ_CHUNK = 64 * 1024
+
+def _key(uid: str) -> str:
+    # id пользователя не попадает в имя файла как есть
+    return hashlib.sha256(uid.encode("utf-8")).hexdigest()[:32]
+
+def snapshot_path(uid: str, seq: int) -> Path:
+    return Path(SNAPSHOT_DIR) / f"{_key(uid)}.{seq}.v{SNAPSHOT_VERSION}.json.gz"
+
+def snapshot_etag(uid: str, seq: int) -> str:
+    return f'"{_key(uid)[:12]}-{seq}-v{SNAPSHOT_VERSION}"'
+
+def _write(path: Path, snapshot: dict):
+    """Write the file atomically; returns it open for reading."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    body = gzip.compress(
+        json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        compresslevel=SNAPSHOT_GZIP_LEVEL
+    )
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    f = os.fdopen(fd, "w+b")
+    try:
+        f.write(body)
+        f.flush()
+        os.replace(tmp, path)
+    except BaseException:
+        f.close()
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    # Старые снимки этого пользователя больше не отдаются; уже открытые дочитываются
+    for old in path.parent.glob(f"{path.name.split('.', 1)[0]}.*.json.gz"):
+        if old != path:
+            old.unlink(missing_ok=True)
+    f.seek(0)
+    return f
+
+async def build_snapshot(db, uid: str) -> Tuple[int, object]:
+    """Read the live rows and their seq in one read transaction and write the file.
+
+    Returns (seq, file open for reading)."""
+    started = time.perf_counter()
+    await db.execute("BEGIN")
+    try:
+        seq = await latest_seq(db, uid)
+        tables = {}
+        for t, cols in TABLES.items():
+            rows = await (await db.execute(
+                f"SELECT {', '.join(cols)} FROM {t} WHERE user_id=? AND deleted_at IS NULL ORDER BY id",
+                (uid,)
+            )).fetchall()
+            tables[t] = {"columns": cols, "rows": [list(r) for r in rows]}
+    finally:
+        await db.rollback()
+    snapshot = {"v": SNAPSHOT_VERSION, "seq": seq, "server_time": _now(), "tables": tables}
+    f = await asyncio.to_thread(_write, snapshot_path(uid, seq), snapshot)
+    log.info(f"📦 Snapshot seq={seq}: {sum(len(t['rows']) for t in tables.values())} rows, "
+             f"{os.fstat(f.fileno()).st_size} bytes in {time.perf_counter() - started:.2f}s")
+    return seq, f
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+def byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """[start, end) of a single 'bytes=' range; None serves the whole file.
+
+    Raises ValueError when the range starts past the end."""
+    match = _RANGE.fullmatch((header or "").strip())
+    if not match or match.group(1) == match.group(2) == "":
+        # Несколько диапазонов или мусор — отдаётся весь файл
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+        if last and int(last) < start:
+            return None
+    if start >= size:
+        raise ValueError(start)
+    return start, end
+
+def _read(f, start: int, end: int):
+    with f:
+        f.seek(start)
+        left = end - start
+        while left > 0:
+            chunk = f.read(min(READ_CHUNK, left))
+            if not chunk:
+                break
+            left -= len(chunk)
+            yield chunk
+
+@router.get("/api/sync/snapshot")
+async def get_snapshot(
+    claims = Depends(get_claims),
+    db = Depends(get_db),
+    range_: Optional[str] = Header(None, alias="range"),
+    if_range: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    uid = claims["uid"]
+    # Как и pull: наступившие повторяющиеся операции создаются до снимка
+    await materialize_due(db, uid, _now())
+    await db.commit()
+    seq = await latest_seq(db, uid)
+    etag = snapshot_etag(uid, seq)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Accept-Ranges": "bytes",
+               "X-Snapshot-Seq": str(seq)}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        f = open(snapshot_path(uid, seq), "rb")
+    except FileNotFoundError:
+        seq, f = await build_snapshot(db, uid)
+        etag = headers["ETag"] = snapshot_etag(uid, seq)
+        headers["X-Snapshot-Seq"] = str(seq)
+
+    size = os.fstat(f.fileno()).st_size
+    start, end, status = 0, size, 200
+    if range_ and (if_range is None or if_range.strip() == etag):
+        try:
+            requested = byte_range(range_, size)
+        except ValueError:
+            f.close()
+            raise HTTPException(status_code=416, detail="Range not satisfiable",
+                                headers={"Content-Range": f"bytes */{size}"})
+        if requested:
+            start, end = requested
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    headers["Content-Length"] = str(end - start)
+    return StreamingResponse(_read(f, start, end), status_code=status, media_type=MEDIA_TYPE, headers=headers)
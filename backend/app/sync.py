@@ -1,8 +1,14 @@
 from typing import Optional
-from fastapi import APIRouter, Request, Depends
+from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
 from .db import get_db
-from .models import SyncPush
-import time
+from .jsonstream import stream_sections, JsonStreamError
+from .models import Category, Source, Rule, Operation, Recurring
+from .balances import apply_operation_change
+from .limits import apply_operation_usage, check_category_limit
+from .recurring import materialize_due, reschedule
+import json, os, sqlite3, tempfile, time
 
 router = APIRouter()
 
@@ -11,44 +17,200 @@ TABLES = {
     "sources":    ["id","user_id","name","currency","expected_date","icon","color","created_at","updated_at","deleted_at"],
     "rules":      ["id","user_id","source_id","category_id","percent","cap_cents","created_at","updated_at","deleted_at"],
     "operations": ["id","user_id","type","source_id","category_id","wallet","amount_cents","currency","rate","date","note","created_at","updated_at","deleted_at"],
+    # next_due ведёт сервер, клиент его не присылает
+    "recurring":  ["id","user_id","type","source_id","category_id","wallet","amount_cents","currency","rate","note","freq","every","start_date","end_date","created_at","updated_at","deleted_at"],
 }
 
+# лимит SQLite на число параметров в одном запросе
+SQL_VARS_PER_QUERY = 500
+
+# строк тела push, записываемых одной транзакцией
+SYNC_PUSH_BATCH = int(os.getenv("SYNC_PUSH_BATCH", "1000"))
+
+# массивы тела push и их модели, строка валидируется сразу после разбора
+PUSH_SECTIONS = {
+    "categories": Category.model_validate,
+    "sources":    Source.model_validate,
+    "rules":      Rule.model_validate,
+    "operations": Operation.model_validate,
+    "recurring":  Recurring.model_validate,
+}
+
+# отложенные строки (родитель придёт позже) держатся в памяти до стольких байт, дальше — на диске
+SYNC_DEFERRED_MEMORY = int(os.getenv("SYNC_DEFERRED_MEMORY", str(8 * 1024 * 1024)))
+
+class _Deferred:
+    # Строки JSON в SpooledTemporaryFile: память push не зависит от того, где в теле родители
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=SYNC_DEFERRED_MEMORY, mode="w+", encoding="utf-8")
+
+    def append(self, item):
+        t, row = item
+        self.file.write(f"{t}\t{row.model_dump_json()}\n")
+
+    def batches(self, t, size):
+        # строки таблицы t в порядке тела, пачками по size
+        parse = PUSH_SECTIONS[t]
+        self.file.seek(0)
+        batch = []
+        for line in self.file:
+            name, _, data = line.partition("\t")
+            if name != t:
+                continue
+            batch.append(parse(json.loads(data)))
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def close(self):
+        self.file.close()
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+async def latest_seq(db, uid):
+    row = await (await db.execute(
+        "SELECT seq FROM change_log WHERE user_id=? ORDER BY seq DESC LIMIT 1", (uid,)
+    )).fetchone()
+    return row["seq"] if row else 0
+
+async def _pull_by_seq(db, uid, since_seq):
+    # Диапазон (user_id, seq) по индексу → id изменённых строк → сами строки
+    changed = {t: set() for t in TABLES}
+    rows = await (await db.execute(
+        "SELECT table_name, row_id FROM change_log WHERE user_id=? AND seq>?",
+        (uid, since_seq)
+    )).fetchall()
+    for r in rows:
+        if r["table_name"] in changed:
+            changed[r["table_name"]].add(r["row_id"])
+    payload = {}
+    for t, cols in TABLES.items():
+        ids = list(changed[t])
+        payload[t] = []
+        for i in range(0, len(ids), SQL_VARS_PER_QUERY):
+            chunk = ids[i:i + SQL_VARS_PER_QUERY]
+            rows = await (await db.execute(
+                f"SELECT {', '.join(cols)} FROM {t} WHERE user_id=? AND id IN ({','.join('?' * len(chunk))})",
+                (uid, *chunk)
+            )).fetchall()
+            payload[t].extend(dict(r) for r in rows)
+    return payload
+
 @router.get("/api/sync/pull")
 async def pull(
     since: Optional[str] = None,
+    since_seq: Optional[int] = None,
     request: Request = None,
     db = Depends(get_db)
 ):
     claims = request.state.claims
     uid = claims["uid"]
-    since = since or "1970-01-01T00:00:00Z"
-    payload = {}
-    for t, cols in TABLES.items():
-        rows = await (await db.execute(
-            f"SELECT {', '.join(cols)} FROM {t} WHERE user_id=? AND updated_at>?",
-            (uid, since)
-        )).fetchall()
-        payload[t] = [dict(r) for r in rows]
-    payload["server_time"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    # Наступившие повторяющиеся операции создаются до чтения
+    await materialize_due(db, uid, _now())
+    await db.commit()
+    # Один снимок: строки и seq согласованы между собой
+    await db.execute("BEGIN")
+    try:
+        seq = await latest_seq(db, uid)
+        if since_seq is not None:
+            payload = await _pull_by_seq(db, uid, since_seq)
+        else:
+            # старые клиенты: по updated_at
+            since = since or "1970-01-01T00:00:00Z"
+            payload = {}
+            for t, cols in TABLES.items():
+                rows = await (await db.execute(
+                    f"SELECT {', '.join(cols)} FROM {t} WHERE user_id=? AND updated_at>?",
+                    (uid, since)
+                )).fetchall()
+                payload[t] = [dict(r) for r in rows]
+    finally:
+        await db.rollback()
+    payload["seq"] = seq
+    payload["server_time"] = _now()
     return payload
 
-@router.post("/api/sync/push")
-async def push(body: SyncPush, request: Request, db = Depends(get_db)):
-    claims = request.state.claims
-    uid = claims["uid"]
-    for t, cols in TABLES.items():
-        rows = getattr(body, t)
-        if not rows: continue
-        qs_cols = ",".join(cols)
-        placeholders = ",".join(["?"]*len(cols))
-        setters = ",".join([f"{c}=excluded.{c}" for c in cols if c!="id"])
+async def _apply_rows(db, uid, t, rows, now, deferred=None):
+    # Одна пачка в своей транзакции: запись идёт, пока клиент ещё досылает тело
+    cols = TABLES[t]
+    qs_cols = ",".join(cols)
+    placeholders = ",".join(["?"]*len(cols))
+    setters = ",".join([f"{c}=excluded.{c}" for c in cols if c!="id"])
+    # Строка без изменений (или чужая) не переписывается и не попадает в журнал
+    changed = f"({','.join(f'{t}.{c}' for c in cols)}) IS NOT ({','.join(f'excluded.{c}' for c in cols)})"
+    written = 0
+    await db.execute("BEGIN IMMEDIATE")
+    try:
         for row in rows:
             row.user_id = uid
             values = [getattr(row, c) for c in cols]
-            await db.execute(
-                f"INSERT INTO {t}({qs_cols}) VALUES({placeholders}) "
-                f"ON CONFLICT(id) DO UPDATE SET {setters}",
-                values
-            )
+            old = None
+            if t == "operations":
+                old = await (await db.execute(
+                    f"SELECT {qs_cols} FROM operations WHERE id=? AND user_id=?",
+                    (row.id, uid)
+                )).fetchone()
+            try:
+                cur = await db.execute(
+                    f"INSERT INTO {t}({qs_cols}) VALUES({placeholders}) "
+                    f"ON CONFLICT(id) DO UPDATE SET {setters} "
+                    f"WHERE {t}.user_id=excluded.user_id AND {changed}",
+                    values
+                )
+            except sqlite3.IntegrityError:
+                # Родитель (категория, источник) может прийти позже в том же теле
+                if deferred is None:
+                    raise
+                deferred.append((t, row))
+                continue
+            if cur.rowcount:
+                written += 1
+                await db.execute(
+                    "INSERT INTO change_log(user_id, table_name, row_id, op, changed_at) VALUES(?,?,?,?,?)",
+                    (uid, t, row.id, "delete" if row.deleted_at else "upsert", now)
+                )
+                if t == "operations":
+                    new = row.model_dump()
+                    await apply_operation_change(db, uid, old, new, now)
+                    await apply_operation_usage(db, uid, old, new, now)
+                elif t == "categories":
+                    await check_category_limit(db, uid, row.id, now)
+                elif t == "recurring":
+                    await reschedule(db, uid, row.id)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return written
+
+@router.post("/api/sync/push")
+async def push(request: Request, db = Depends(get_db)):
+    # Тело — SyncPush; разбирается по мере загрузки, пишется пачками по SYNC_PUSH_BATCH.
+    # Запись идемпотентна: оборванный push досылается целиком ещё раз
+    claims = request.state.claims
+    uid = claims["uid"]
+    now = _now()
+    written = 0
+    deferred = _Deferred()
+    try:
+        async for t, rows in stream_sections(request.stream(), PUSH_SECTIONS, SYNC_PUSH_BATCH):
+            written += await _apply_rows(db, uid, t, rows, now, deferred)
+        # Отложенные строки по порядку TABLES: сначала родители; тоже пачками
+        for t in TABLES:
+            for rows in deferred.batches(t, SYNC_PUSH_BATCH):
+                written += await _apply_rows(db, uid, t, rows, now)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    except JsonStreamError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid push body: {e}")
+    except sqlite3.IntegrityError as e:
+        raise HTTPException(status_code=409, detail=f"Push rejected: {e}")
+    finally:
+        deferred.close()
+    await materialize_due(db, uid, now)
+    seq = await latest_seq(db, uid)
     await db.commit()
-    return {"ok": True}
\ No newline at end of file
+    return {"ok": True, "written": written, "seq": seq}
@@ -72,4 +72,86 @@ CREATE TABLE IF NOT EXISTS operations (
   deleted_at    TEXT
 );
 CREATE INDEX IF NOT EXISTS idx_ops_user ON operations(user_id);
-CREATE INDEX IF NOT EXISTS idx_ops_updated ON operations(updated_at);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_ops_updated ON operations(updated_at);
+-- покрывающий индекс для агрегатов по периоду (app/forecast.py): таблица не читается
+CREATE INDEX IF NOT EXISTS idx_ops_user_date ON operations(user_id, date, type, category_id, source_id, amount_cents, rate, deleted_at);
+
+-- шаблоны повторяющихся операций (app/recurring.py); next_due ведёт сервер
+CREATE TABLE IF NOT EXISTS recurring (
+  id            TEXT PRIMARY KEY,
+  user_id       TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  type          TEXT NOT NULL CHECK(type IN ('income','expense')),
+  source_id     TEXT,
+  category_id   TEXT NOT NULL REFERENCES categories(id) ON DELETE RESTRICT,
+  wallet        TEXT,
+  amount_cents  INTEGER NOT NULL,
+  currency      TEXT NOT NULL DEFAULT 'EUR',
+  rate          REAL NOT NULL DEFAULT 1.0,
+  note          TEXT,
+  freq          TEXT NOT NULL CHECK(freq IN ('daily','weekly','monthly','yearly')),
+  every         INTEGER NOT NULL DEFAULT 1,
+  start_date    TEXT NOT NULL,
+  end_date      TEXT,
+  next_due      TEXT,                          -- NULL: расписание закончилось
+  created_at    TEXT NOT NULL,
+  updated_at    TEXT NOT NULL,
+  deleted_at    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_recurring_updated ON recurring(updated_at);
+CREATE INDEX IF NOT EXISTS idx_recurring_due ON recurring(user_id, next_due) WHERE deleted_at IS NULL;
+
+-- append-only change log: pull читает диапазон (user_id, seq)
+CREATE TABLE IF NOT EXISTS change_log (
+  seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id     TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  table_name  TEXT NOT NULL,
+  row_id      TEXT NOT NULL,
+  op          TEXT NOT NULL CHECK(op IN ('upsert','delete')),
+  changed_at  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_change_log_user_seq ON change_log(user_id, seq);
+
+-- материализованные балансы (app/balances.py): текущий итог + контрольные точки по дням
+CREATE TABLE IF NOT EXISTS balances (
+  user_id      TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  scope        TEXT NOT NULL CHECK(scope IN ('wallet','category')),
+  key          TEXT NOT NULL,
+  currency     TEXT NOT NULL,
+  total_cents  INTEGER NOT NULL DEFAULT 0,
+  updated_at   TEXT NOT NULL,
+  PRIMARY KEY (user_id, scope, key, currency)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS balance_days (
+  user_id           TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  scope             TEXT NOT NULL,
+  key               TEXT NOT NULL,
+  currency          TEXT NOT NULL,
+  day               TEXT NOT NULL,               -- YYYY-MM-DD
+  delta_cents       INTEGER NOT NULL DEFAULT 0,
+  cumulative_cents  INTEGER NOT NULL DEFAULT 0,  -- баланс на конец дня
+  PRIMARY KEY (user_id, scope, key, currency, day)
+) WITHOUT ROWID;
+
+-- лимиты категорий (app/limits.py): расход за неделю/месяц/год, период 'W2024-19' / 'M2024-05' / 'Y2024'
+CREATE TABLE IF NOT EXISTS limit_usage (
+  user_id      TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  category_id  TEXT NOT NULL,
+  period       TEXT NOT NULL,
+  used_cents   INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, category_id, period)
+) WITHOUT ROWID;
+
+-- пересечения порогов 80% / 100%, по одному на категорию, период и порог
+CREATE TABLE IF NOT EXISTS limit_events (
+  id           INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id      TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  category_id  TEXT NOT NULL,
+  period       TEXT NOT NULL,
+  threshold    INTEGER NOT NULL,
+  used_cents   INTEGER NOT NULL,
+  limit_cents  INTEGER NOT NULL,
+  created_at   TEXT NOT NULL,
+  UNIQUE (user_id, category_id, period, threshold)
+);
+CREATE INDEX IF NOT EXISTS idx_limit_events_user ON limit_events(user_id, id);
@@ -41,11 +41,33 @@ export async function login(email: string, password: string) {
   return data;
 }
 
+// Новое устройство: один файл со всеми живыми строками (/api/sync/snapshot) вместо
+// полного pull, дальше — обычный pull с его seq
+async function bootstrap() {
+  if (typeof DecompressionStream === 'undefined') return;
+  const res = await fetch(`${API}/api/sync/snapshot`, { headers: authHeaders() });
+  if (!res.ok || !res.body) return;
+  const data = await new Response(res.body.pipeThrough(new DecompressionStream('gzip'))).json();
+  await db.transaction('rw', [db.categories, db.sources, db.rules, db.operations, db.meta], async () => {
+    for (const t of ['categories','sources','rules','operations'] as const) {
+      const table = data.tables?.[t] as { columns: string[]; rows: any[][] } | undefined;
+      if (!table?.rows.length) continue;
+      const rows = table.rows.map(r => Object.fromEntries(table.columns.map((c, i) => [c, r[i]])));
+      await (db as any)[t].bulkPut(rows);
+    }
+    await db.meta.put({ key:'last_pull', value: data.server_time });
+    await db.meta.put({ key:'last_seq', value: String(data.seq) });
+  });
+}
+
 export async function pull() {
   if (!token) return;
   try {
-    const since = (await db.meta.get('last_pull'))?.value || '1970-01-01T00:00:00Z';
-    const res = await fetch(`${API}/api/sync/pull?since=${encodeURIComponent(since)}`, { headers: authHeaders() });
+    // без снимка (старый сервер, ошибка) — полный pull с seq 0
+    if (!(await db.meta.get('last_seq'))) await bootstrap().catch(() => {});
+    // seq назначает сервер: не зависит от часов устройств
+    const sinceSeq = (await db.meta.get('last_seq'))?.value || '0';
+    const res = await fetch(`${API}/api/sync/pull?since_seq=${encodeURIComponent(sinceSeq)}`, { headers: authHeaders() });
     if (res.status === 401 || res.status === 403) return;
     if (!res.ok) return;
     const data = await res.json();
@@ -56,6 +78,7 @@ export async function pull() {
         for (const row of rows) await (db as any)[t].put(row);
       }
       await db.meta.put({ key:'last_pull', value: data.server_time });
+      await db.meta.put({ key:'last_seq', value: String(data.seq) });
     });
   } catch {}
 }